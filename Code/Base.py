@@ -14,13 +14,16 @@ _
 
 
 import json
+from array import array
+from collections import Counter
 from random import choice
 from Const import *
-from typing import Dict, List
+from WishRandom import RandomBackend
+from typing import Dict, Iterator, List, Sequence, Tuple
 from dataclasses import dataclass, field
 
 
-@dataclass
+@dataclass(slots=True)
 class Card:
     """
     卡片类，封装卡片的各种属性
@@ -34,6 +37,7 @@ class Card:
     title: str = ""         # 卡片称号，用于抽卡界面显示
     profession: str = ""    # 卡片职业类型  智识/单手剑/击破
     image_path: str = ""    # 图片路径
+    id: int = field(default=-1, compare=False, repr=False)  # 卡片编号, 由 CardRegistry 分配, 未注册时为 -1
     
     def __str__(self) -> str:
         return f"Card({self.content}, {self.star}, {self.type}, {self.attribute}, {self.profession}, {self.image_path})"
@@ -73,18 +77,89 @@ class Card:
                self.type != ""
 
 
+class CardRegistry:
+    """
+    卡片注册表
+    为每个卡片分配连续的整数编号, (游戏, 类型, 星级, 卡片名称) 相同的卡片共用同一编号
+    """
+    def __init__(self) -> None:
+        self.cards: List[Card] = []                             # 编号 -> 卡片对象
+        self.ids: Dict[Tuple[str, str, int, str], int] = {}    # (游戏, 类型, 星级, 卡片名称) -> 编号
+
+    def register(self, card: Card) -> int:
+        """
+        注册卡片并返回编号, 同时写入 card.id
+        """
+        if card.id >= 0:
+            return card.id
+
+        key = (card.game, card.type, card.star, card.content)
+        card_id = self.ids.get(key)
+        if card_id is None:
+            card_id = self.ids[key] = len(self.cards)
+            self.cards.append(card)
+        card.id = card_id
+        return card_id
+
+    def get(self, card_id: int) -> Card:
+        """
+        根据编号获取卡片, 编号不存在时返回空卡片
+        """
+        if 0 <= card_id < len(self.cards):
+            return self.cards[card_id]
+        return Card.none()
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+
+# 全局卡片注册表
+card_registry = CardRegistry()
+
+
 class PackedCard:
     """
     对卡片的二次封装，用于在抽卡时使用
+    抽卡得到的 PackedCard 由 PackedCard.intern 驻留, 相同 (卡片, 实际标签, 标签组) 的结果共用同一对象, 不应修改
+    驻留的 PackedCard 按驻留顺序拥有连续的编号 index, 列式抽卡结果以该编号存储
     """
-    def __init__(self, card: Card, real_tag: str = TAG_STANDARD, tags: List[str] = [TAG_STANDARD], rarity: str = ""):
-        self.card = card            # 卡片对象
-        self.real_tag = real_tag    # 卡片被抽出时，所属的标签组
-        self.tags = tags            # 卡片所属的所有标签组
-        self.rarity = rarity        # 卡片稀有度映射
+    __slots__ = ("card", "real_tag", "tags", "rarity", "index")
+
+    # 驻留池: (卡片编号, 实际标签, 标签组) -> PackedCard
+    _interned: Dict[Tuple[int, str, Tuple[str, ...]], "PackedCard"] = {}
+    # 驻留编号 -> PackedCard
+    interned_cards: List["PackedCard"] = []
+    # 驻留编号 -> 卡片编号 / 星级 / 实际标签编码, 与 interned_cards 一同增长, 供列式抽卡结果查表
+    interned_card_ids: array = array("i")
+    interned_stars: array = array("b")
+    interned_tag_codes: array = array("b")
+
+    def __init__(self, card: Card, real_tag: str = TAG_STANDARD, tags: Sequence[str] = (TAG_STANDARD,), rarity: str = ""):
+        self.card = card                        # 卡片对象
+        self.real_tag = real_tag                # 卡片被抽出时，所属的标签组
+        self.tags: Tuple[str, ...] = tuple(tags)    # 卡片所属的所有标签组
+        self.rarity = rarity                    # 卡片稀有度映射
+        self.index = -1                         # 驻留编号, 未驻留时为 -1
 
     def __str__(self) -> str:
-        return f"PackedCard({self.card}, {self.real_tag}, {self.tags}, {self.rarity})"
+        return f"PackedCard({self.card}, {self.real_tag}, {list(self.tags)}, {self.rarity})"
+
+    @staticmethod
+    def intern(card: Card, real_tag: str = TAG_STANDARD, tags: Sequence[str] = (TAG_STANDARD,)) -> "PackedCard":
+        """
+        获取驻留的 PackedCard, 未注册的卡片先注册到全局卡片注册表
+        """
+        tags = tuple(tags)
+        key = (card_registry.register(card) if card.id < 0 else card.id, real_tag, tags)
+        packed_card = PackedCard._interned.get(key)
+        if packed_card is None:
+            packed_card = PackedCard._interned[key] = PackedCard(card, real_tag, tags)
+            packed_card.index = len(PackedCard.interned_cards)
+            PackedCard.interned_cards.append(packed_card)
+            PackedCard.interned_card_ids.append(packed_card.card.id)
+            PackedCard.interned_stars.append(card.star)
+            PackedCard.interned_tag_codes.append(TAG_CODES.index(real_tag) if real_tag in TAG_CODES else 0)
+        return packed_card
 
 
 class SingleTagCardGroup:
@@ -94,6 +169,10 @@ class SingleTagCardGroup:
     管理结构：
     类型 -> 星级 -> 卡片名称: 卡片对象
     """
+    # 全局修改版本号, 任一单标签卡组的卡片或排除卡片发生变化时自增
+    # 多个卡组可能共用同一个单标签卡组 (如常驻卡组), CardGroup 据此判断标签索引是否过期
+    revision: int = 0
+
     def __init__(self, name: str):
         self.name = name
 
@@ -106,6 +185,10 @@ class SingleTagCardGroup:
 
         # 排除的卡片，抽卡将不抽出这些卡片，同时也不视为存在于卡组中
         self.exclude_cards: Dict[str, Dict[int, List[str]]] = {}
+
+        # 可抽出的卡片缓存: (类型, 星级) -> 已排除 exclude_cards 的卡片元组
+        # 仅在 add_card, remove_card, add_exclude_card, clear_exclude_card 时失效
+        self._eligible_cards: Dict[Tuple[str, int], Tuple[Card, ...]] = {}
     
     def __str__(self) -> str:
         cards_info = "\n".join([
@@ -166,9 +249,13 @@ class SingleTagCardGroup:
 
         target = self.cards[card.type][card.star]
         if card.content not in target:
+            if card.id < 0:
+                card_registry.register(card)
             target[card.content] = card
             self.count += 1
             self.max_star = max(self.max_star, card.star)
+            self._eligible_cards.pop((card.type, card.star), None)
+            SingleTagCardGroup.revision += 1
     
     def add_exclude_card(self, card: Card):
         """
@@ -181,6 +268,8 @@ class SingleTagCardGroup:
             self.exclude_cards[card.type][card.star] = []
 
         self.exclude_cards[card.type][card.star].append(card.content)
+        self._eligible_cards.pop((card.type, card.star), None)
+        SingleTagCardGroup.revision += 1
     
     def has_exclude_card(self, card: Card) -> bool:
         """
@@ -193,23 +282,42 @@ class SingleTagCardGroup:
         清空排除卡片
         """
         self.exclude_cards = {}
-    
-    def random_card(self, type_: str, star: int) -> Card:
+        self._eligible_cards.clear()
+        SingleTagCardGroup.revision += 1
+
+    def eligible_cards(self, type_: str, star: int) -> Tuple[Card, ...]:
         """
-        随机抽取一个卡片
+        获取指定类型和星级下可抽出的卡片 (不含排除卡片)
+        结果按卡片添加顺序排列, 并缓存至卡组被修改
         """
-        if type_ not in self.cards or star not in self.cards[type_]:
-            return Card.none()
+        key = (type_, star)
+        eligible = self._eligible_cards.get(key)
+        if eligible is not None:
+            return eligible
 
-        target = self.cards[type_][star]
+        target = self.cards.get(type_, {}).get(star, {})
+        excluded = self.exclude_cards.get(type_, {}).get(star)
+        if excluded:
+            eligible = tuple(card for content, card in target.items() if content not in excluded)
+        else:
+            eligible = tuple(target.values())
 
-        if self.exclude_cards and type_ in self.exclude_cards and star in self.exclude_cards[type_]:
-            target = {k: v for k, v in target.items() if k not in self.exclude_cards[type_][star]}
+        self._eligible_cards[key] = eligible
+        return eligible
+    
+    def random_card(self, type_: str, star: int, rng: RandomBackend | None = None) -> Card:
+        """
+        随机抽取一个卡片
+        rng 为随机数后端，为 None 时使用全局 random 模块
+        """
+        eligible = self._eligible_cards.get((type_, star))
+        if eligible is None:
+            eligible = self.eligible_cards(type_, star)
 
-        if not target:
+        if not eligible:
             return Card.none()
 
-        return choice(list(target.values()))
+        return (rng.choice if rng else choice)(eligible)
     
     def remove_card(self, type_: str, star: int, content: str):
         """
@@ -219,6 +327,8 @@ class SingleTagCardGroup:
         if content in target:
             del target[content]
             self.count -= 1
+            self._eligible_cards.pop((type_, star), None)
+            SingleTagCardGroup.revision += 1
             if star >= self.max_star:
                 # 更新最高星级
                 self.max_star = max([max(stars.keys()) for stars in self.cards.values()])
@@ -281,6 +391,15 @@ class CardGroup:
         self.max_star = standard_card_group.max_star
         # 卡片总数
         self.count = standard_card_group.count
+
+        # 标签索引: (类型, 星级, 卡片名称) -> 卡片所属标签组的位掩码 (已排除 exclude_cards)
+        # 第 i 个标签组对应第 i 位, 按 single_tag_card_groups 的顺序排列
+        self._tag_index: Dict[Tuple[str, int, str], int] = {}
+        self._tag_bits: Dict[str, int] = {}                 # 标签 -> 位
+        self._mask_tags: Dict[int, Tuple[str, ...]] = {}    # 位掩码 -> 按顺序排列的标签
+        self._index_revision = -1                           # 建立索引时的 SingleTagCardGroup.revision
+        # 抽卡结果缓存: 标签 -> 卡片编号 -> 驻留的 PackedCard, 随标签索引一同重建
+        self._packed_cards: Dict[str, Dict[int, PackedCard]] = {}
     
     def __str__(self) -> str:
         cards_info = "\n".join([
@@ -303,6 +422,7 @@ class CardGroup:
         """
         if tag not in self.single_tag_card_groups:
             self.single_tag_card_groups[tag] = SingleTagCardGroup(self.name + f"-{tag}") if not card_group else card_group
+            self._index_revision = -1
             self.max_star = max(self.max_star, self.single_tag_card_groups[tag].max_star)
             self.count += self.single_tag_card_groups[tag].count
 
@@ -344,33 +464,55 @@ class CardGroup:
             self.count += 1
             self.max_star = max(self.max_star, card.star)
 
-    def random_card(self, type_: str, star: int, tag: str = TAG_STANDARD) -> PackedCard:
+    def _build_tag_index(self):
         """
-        随机抽取一个卡片
+        建立卡片到标签位掩码的索引
         """
-        if tag not in self.single_tag_card_groups or \
-              type_ not in self.single_tag_card_groups[tag].types() or \
-                  star not in self.single_tag_card_groups[tag].stars(type_):
-            return PackedCard(Card.none())
-        
-        card = self.single_tag_card_groups[tag].random_card(type_, star)
+        self._tag_bits = {tag: 1 << bit for bit, tag in enumerate(self.single_tag_card_groups.keys())}
+        self._tag_index = {}
+        for tag, group in self.single_tag_card_groups.items():
+            bit = self._tag_bits[tag]
+            for card in group.all_cards():
+                if not group.has_exclude_card(card):
+                    key = (card.type, card.star, card.content)
+                    self._tag_index[key] = self._tag_index.get(key, 0) | bit
+        self._mask_tags = {
+            mask: tuple(tag for tag, bit in self._tag_bits.items() if mask & bit)
+            for mask in range(1 << len(self._tag_bits))
+        }
+        self._packed_cards = {tag: {} for tag in self.single_tag_card_groups.keys()}
+        self._index_revision = SingleTagCardGroup.revision
 
-        tags = [tag]
+    def card_tags(self, card: Card, tag: str = TAG_STANDARD) -> List[str]:
+        """
+        获取从 tag 组抽出的卡片所属的所有标签组
+        tag 在首位, 其余标签按标签组顺序排列, 不包括卡片被排除的标签组
+        """
+        if self._index_revision != SingleTagCardGroup.revision:
+            self._build_tag_index()
 
-        # 检查卡片是否存在于其他标签组
-        for t in self.single_tag_card_groups.keys():
-            if t == tag:
-                continue
-            if card.type not in self.single_tag_card_groups[t].types():
-                continue
-            if card.star not in self.single_tag_card_groups[t].stars(card.type):
-                continue
-            if card.content not in self.single_tag_card_groups[t].card_contents(card.type, card.star):
-                continue
-            if not self.single_tag_card_groups[t].has_exclude_card(card):
-                tags.append(t)
+        mask = self._tag_index.get((card.type, card.star, card.content), 0) & ~self._tag_bits.get(tag, 0)
+        return [tag, *self._mask_tags[mask]]
+
+    def random_card(self, type_: str, star: int, tag: str = TAG_STANDARD, rng: RandomBackend | None = None) -> PackedCard:
+        """
+        随机抽取一个卡片
+        rng 为随机数后端，为 None 时使用全局 random 模块
+        """
+        group = self.single_tag_card_groups.get(tag)
+        if group is None or star not in group.cards.get(type_, ()):
+            return PackedCard.intern(Card.none())
 
-        return PackedCard(card, tag, tags)
+        card = group.random_card(type_, star, rng)
+
+        if self._index_revision != SingleTagCardGroup.revision:
+            self._build_tag_index()
+        packed_cards = self._packed_cards[tag]
+        packed_card = packed_cards.get(card.id)
+        if packed_card is None:
+            packed_card = PackedCard.intern(card, tag, self.card_tags(card, tag))
+            packed_cards[card.id] = packed_card
+        return packed_card
 
     def remove_card(self, type_: str, star: int, content: str, tag: str = TAG_STANDARD):
         """
@@ -418,6 +560,31 @@ class CardGroup:
                 for card in higher_group.all_cards():
                     lower_group.add_exclude_card(card)
 
+    def appoint_share(self) -> Dict[int, float]:
+        """
+        计算各星级 UP 组卡片中同时属于 Appoint 组的卡片比例
+        用于分析工具估计 "随机抽出的 UP 卡片恰好是 Appoint 卡片" 的概率
+        """
+        if TAG_UP not in self.single_tag_card_groups or TAG_APPOINT not in self.single_tag_card_groups:
+            return {}
+
+        up_group = self.single_tag_card_groups[TAG_UP]
+        appoint_group = self.single_tag_card_groups[TAG_APPOINT]
+        share: Dict[int, float] = {}
+        for star in sorted({card.star for card in up_group.all_cards()}):
+            up_cards = [
+                card for card in up_group.all_cards()
+                if card.star == star and not up_group.has_exclude_card(card)
+            ]
+            if not up_cards:
+                continue
+            appoint_count = sum(
+                1 for card in up_cards
+                if card.content in appoint_group.card_contents(card.type, card.star)
+            )
+            share[star] = appoint_count / len(up_cards)
+        return share
+
 
 class WishResult:
     """
@@ -437,6 +604,140 @@ class WishResult:
         return self.cards[0]
 
 
+class ColumnarWishResult:
+    """
+    列式抽卡结果
+    接口与 WishResult 相同, 抽卡时只记录驻留的 PackedCard 编号 (一个整数数组)
+    卡片编号、星级、标签编码、类型编码 四列按需由驻留编号查表生成, 统计在数组上完成, 不创建 PackedCard 列表
+    查表使用 PackedCard 驻留池旁的对照表, 不在每次访问时重建
+    """
+    def __init__(self):
+        self.indices: array = array("i")    # 每抽的驻留 PackedCard 编号
+        self._cards: List[PackedCard] = []  # cards 的缓存, 只追加新增的部分
+
+    def add(self, packed_card: PackedCard):
+        index = packed_card.index
+        if index < 0:
+            index = PackedCard.intern(packed_card.card, packed_card.real_tag, packed_card.tags).index
+        self.indices.append(index)
+
+    @property
+    def count(self) -> int:
+        return len(self.indices)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __iter__(self) -> Iterator[PackedCard]:
+        """
+        按抽卡顺序迭代 PackedCard (驻留对象, 不应修改)
+        """
+        return map(PackedCard.interned_cards.__getitem__, self.indices)
+
+    @property
+    def cards(self) -> List[PackedCard]:
+        """
+        PackedCard 列表, 兼容 WishResult.cards
+        """
+        if len(self._cards) < len(self.indices):
+            self._cards.extend(map(PackedCard.interned_cards.__getitem__, self.indices[len(self._cards):]))
+        return self._cards
+
+    def get_one(self) -> PackedCard:
+        return PackedCard.interned_cards[self.indices[0]]
+
+    def _column(self, typecode: str, values: Sequence[int]) -> array:
+        """
+        由 驻留编号 -> 值 的对照表生成一列
+        """
+        return array(typecode, map(values.__getitem__, self.indices))
+
+    @property
+    def card_ids(self) -> array:
+        """
+        卡片编号列
+        """
+        return self._column("i", PackedCard.interned_card_ids)
+
+    @property
+    def stars(self) -> array:
+        """
+        星级列
+        """
+        return self._column("b", PackedCard.interned_stars)
+
+    @property
+    def tag_codes(self) -> array:
+        """
+        实际标签编码列, 编码为 TAG_CODES 中的下标, 未知标签视为 TAG_STANDARD
+        """
+        return self._column("b", PackedCard.interned_tag_codes)
+
+    def type_codes(self) -> Tuple[array, Tuple[str, ...]]:
+        """
+        类型编码列, 返回 (类型编码列, 类型名称表), 编码为类型名称表中的下标
+        """
+        type_names = tuple(sorted({PackedCard.interned_cards[index].card.type for index in set(self.indices)}))
+        codes = {type_: code for code, type_ in enumerate(type_names)}
+        column = self._column("h", [codes.get(packed_card.card.type, -1) for packed_card in PackedCard.interned_cards])
+        return column, type_names
+
+    def _index_counts(self) -> Counter:
+        return Counter(self.indices)
+
+    @property
+    def max_star(self) -> int:
+        return max(self.stars, default=0)
+
+    def star_counts(self) -> Dict[int, int]:
+        """
+        星级 -> 次数
+        """
+        counts: Dict[int, int] = {}
+        for index, count in self._index_counts().items():
+            star = PackedCard.interned_stars[index]
+            counts[star] = counts.get(star, 0) + count
+        return counts
+
+    def tag_counts(self) -> Dict[int, Dict[str, int]]:
+        """
+        星级 -> 实际标签 -> 次数
+        """
+        counts: Dict[int, Dict[str, int]] = {}
+        for index, count in self._index_counts().items():
+            packed_card = PackedCard.interned_cards[index]
+            star_tags = counts.setdefault(packed_card.card.star, {})
+            star_tags[packed_card.real_tag] = star_tags.get(packed_card.real_tag, 0) + count
+        return counts
+
+    def up_rate(self, star: int | None = None) -> float:
+        """
+        该星级 (默认为最高星级) 结果中实际标签为 UP 组 (包括 Fes 和 Appoint) 的比例
+        """
+        star = self.max_star if star is None else star
+        tags = self.tag_counts().get(star, {})
+        total = sum(tags.values())
+        if not total:
+            return 0.0
+        return sum(count for tag, count in tags.items() if tag != TAG_STANDARD) / total
+
+    def star_positions(self, star: int | None = None) -> List[int]:
+        """
+        该星级 (默认为最高星级) 出现的位置 (从 0 开始的抽数下标)
+        """
+        star = self.max_star if star is None else star
+        if not self.indices or not 0 <= star < 128:
+            return []
+        stars = self.stars.tobytes()    # 星级列的每一项恰为一个字节, 在字节串上查找
+        target = bytes((star,))
+        positions = []
+        position = stars.find(target)
+        while position >= 0:
+            positions.append(position)
+            position = stars.find(target, position + 1)
+        return positions
+
+
 @dataclass
 class LogicResult:
     star: int
@@ -446,6 +747,18 @@ class LogicResult:
     def __str__(self) -> str:
         return f"LogicResult({self.star}, '{self.type_}', {self.tags})"
 
+    def real_tag(self) -> str:
+        """
+        按 Appoint > Fes > UP > Standard 的优先级确定实际抽取的标签组
+        """
+        if TAG_APPOINT in self.tags:
+            return TAG_APPOINT
+        if TAG_FES in self.tags:
+            return TAG_FES
+        if TAG_UP in self.tags:
+            return TAG_UP
+        return TAG_STANDARD
+
 
 if __name__ == '__main__':
     p = SingleTagCardGroup("test-standard")
@@ -0,0 +1,557 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    BatchSimulator
+
+Description
+_
+    Wishes 批量模拟模块
+    基于 NumPy 将抽卡逻辑向量化，以数组的形式同时模拟大量独立玩家的抽卡过程
+    每个规则都有对应的向量化实现，按规则链顺序执行，与 WishRule 中的规则语义保持一致
+    *批量模拟只关注 星级 和 标签，类型相关的规则不影响星级与标签，因此被忽略
+    *其他规则用到、但不在 StarCounterRule.star_list 中的星级, 计数器以 -1 表示尚未计数, 与逻辑会话相同
+"""
+
+
+import numpy as np
+from Const import *
+from Base import *
+from WishRule import *
+from typing import Dict, List, Type, Optional
+
+
+class BatchContext:
+    """
+    批量规则执行上下文
+    所有数组的长度均为玩家数
+    """
+    def __init__(self, players: int, rng: np.random.Generator) -> None:
+        self.players = players
+        self.rng = rng
+
+        # 当前抽逻辑结果, 星级为 0 表示星级未决定
+        self.star = np.zeros(players, dtype=np.int16)
+        self.up = np.zeros(players, dtype=bool)
+        self.fes = np.zeros(players, dtype=bool)
+        self.appoint = np.zeros(players, dtype=bool)
+
+        # 当前抽实际抽出的卡片是否属于 Appoint 组 (对应 PackedCard.tags 中的 TAG_APPOINT)
+        self.card_appoint = np.zeros(players, dtype=bool)
+
+        # 星级概率权重, 形状为 (玩家数, 星级数), 由 StarProbabilityRule 注册
+        self.weights: Optional[np.ndarray] = None
+        self.weight_stars: Tuple[int, ...] = ()
+
+        # 规则通讯桥梁, 可通过规则 tag 名称访问批量规则对象
+        self.rule_bridge: Dict[str, BatchRule] = {}
+
+    def new_draw(self):
+        """
+        开始新的一抽, 清空当前抽逻辑结果
+        """
+        self.star.fill(0)
+        self.up.fill(False)
+        self.fes.fill(False)
+        self.appoint.fill(False)
+        self.card_appoint.fill(False)
+
+    def decide(self, mask: np.ndarray, star: int):
+        """
+        为 mask 中的玩家重新决定星级, 等价于创建新的 LogicResult
+        """
+        self.star[mask] = star
+        self.up[mask] = False
+        self.fes[mask] = False
+        self.appoint[mask] = False
+
+    def tag_codes(self) -> np.ndarray:
+        """
+        返回当前抽各玩家卡片的 real_tag 编码 (TAG_CODES 的下标)
+        优先级与 CardPool 一致: Appoint > Fes > UP > Standard
+        """
+        codes = np.zeros(self.players, dtype=np.int8)
+        codes[self.up] = TAG_CODES.index(TAG_UP)
+        codes[self.fes] = TAG_CODES.index(TAG_FES)
+        codes[self.appoint] = TAG_CODES.index(TAG_APPOINT)
+        return codes
+
+    def star_counter(self, star: int) -> np.ndarray:
+        """
+        获取 StarCounterRule 的星级计数器, 可直接修改
+        值为 -1 表示尚未计数, 读取计数时应使用 star_count
+        """
+        counter_rule: BatchStarCounterRule = self.rule_bridge[StarCounterRule.tag]    # type: ignore
+        if star in counter_rule.star_counter:
+            return counter_rule.star_counter[star]
+        return np.zeros(self.players, dtype=np.int32)
+
+    def star_count(self, star: int) -> np.ndarray:
+        """
+        获取星级计数, 尚未计数 (-1) 或未统计的星级视为 0
+        """
+        return np.maximum(self.star_counter(star), 0)
+
+
+class BatchRule:
+    """
+    批量规则基类
+    由规则对象和已加载状态的逻辑会话上下文构造, 默认不操作
+    """
+    tag: str = "BaseRule"
+
+    def __init__(self, rule: BaseRule, logic_ctx: RuleContext, players: int) -> None:
+        pass
+
+    def set_bridge(self, ctx: BatchContext):
+        ctx.rule_bridge[self.tag] = self
+
+    def apply(self, ctx: BatchContext):
+        pass
+
+    def callback(self, ctx: BatchContext):
+        pass
+
+
+class BatchStarCounterRule(BatchRule):
+    """
+    StarCounterRule 的批量实现
+    """
+    tag: str = StarCounterRule.tag
+
+    def __init__(self, rule: StarCounterRule, logic_ctx: RuleContext, players: int) -> None:
+        # 直接读取槽位, 保留尚未计数 (-1) 的星级
+        state = logic_ctx.state
+        self.star_counter: Dict[int, np.ndarray] = {
+            star: np.full(players, state[slot], dtype=np.int32)
+            for star, slot in rule.star_slots.items()
+        }
+
+    def callback(self, ctx: BatchContext):
+        for star, counter in self.star_counter.items():
+            counter[counter >= 0] += 1
+            counter[ctx.star == star] = 0
+
+
+class BatchStarPityRule(BatchRule):
+    """
+    StarPityRule 的批量实现
+    """
+    tag: str = StarPityRule.tag
+
+    def __init__(self, rule: StarPityRule, logic_ctx: RuleContext, players: int) -> None:
+        self.star_pity = dict(rule.star_pity)
+        self.reset_lower_pity = rule.reset_lower_pity
+
+    def apply(self, ctx: BatchContext):
+        remaining = np.ones(ctx.players, dtype=bool)
+        for star, threshold in self.star_pity.items():
+            counter = ctx.star_counter(star)
+            triggered = remaining & (np.maximum(counter, 0) + 1 >= threshold)
+            ctx.decide(triggered, star)
+            counter[triggered] = 0
+            remaining &= ~triggered
+
+    def callback(self, ctx: BatchContext):
+        if not self.reset_lower_pity:
+            return
+
+        counter_rule: BatchStarCounterRule = ctx.rule_bridge[StarCounterRule.tag]     # type: ignore
+        for star, counter in counter_rule.star_counter.items():
+            counter[(star < ctx.star) & (counter >= 0)] = 0
+
+
+class BatchStarProbabilityRule(BatchRule):
+    """
+    StarProbabilityRule 的批量实现
+    """
+    tag: str = StarProbabilityRule.tag
+
+    def __init__(self, rule: StarProbabilityRule, logic_ctx: RuleContext, players: int) -> None:
+        self.stars = np.array(tuple(rule.base_probability.keys()), dtype=np.int16)
+        self.base_weights = np.array(tuple(rule.base_probability.values()), dtype=np.int64)
+        self.weights = np.tile(self.base_weights, (players, 1))
+
+    def set_bridge(self, ctx: BatchContext):
+        ctx.rule_bridge[self.tag] = self
+        ctx.weights = self.weights
+        ctx.weight_stars = tuple(int(star) for star in self.stars)
+
+    def apply(self, ctx: BatchContext):
+        """
+        与 random.choices 相同, 在累积权重上查找随机数所在区间
+        """
+        pending = ctx.star == 0
+        count = int(np.count_nonzero(pending))
+        if not count:
+            return
+
+        cum_weights = np.cumsum(self.weights[pending], axis=1)
+        x = ctx.rng.random(count) * cum_weights[:, -1]
+        index = np.minimum((cum_weights <= x[:, None]).sum(axis=1), len(self.stars) - 1)
+        ctx.decide(pending, 0)
+        ctx.star[pending] = self.stars[index]
+
+    def callback(self, ctx: BatchContext):
+        self.weights[:] = self.base_weights
+
+
+def _normalize_weights(weights: np.ndarray):
+    """
+    对概率权重进行归一化处理，确保概率权重和不超过 MAX_PROBABILITY
+    """
+    total = np.zeros(weights.shape[0], dtype=np.int64)
+    for column in range(weights.shape[1]):
+        p = np.clip(np.minimum(MAX_PROBABILITY - total, weights[:, column]), 0, None)
+        weights[:, column] = p
+        total += p
+
+
+class BatchStarProbabilityIncreaseRule(BatchRule):
+    """
+    StarProbabilityIncreaseRule 的批量实现
+    """
+    tag: str = StarProbabilityIncreaseRule.tag
+
+    def __init__(self, rule: StarProbabilityIncreaseRule, logic_ctx: RuleContext, players: int) -> None:
+        self.star_increase = dict(rule.star_increase)
+
+    def apply(self, ctx: BatchContext):
+        weights: np.ndarray = ctx.weights   # type: ignore
+        for star, (start, increment) in self.star_increase.items():
+            counter = ctx.star_count(star) + 1
+            k = counter - start + 1
+            column = ctx.weight_stars.index(star)
+            weights[:, column] += np.where(counter >= start, k * increment, 0)
+        _normalize_weights(weights)
+
+
+class BatchStarProbabilityIntervalIncreaseRule(BatchRule):
+    """
+    StarProbabilityIntervalIncreaseRule 的批量实现
+    """
+    tag: str = StarProbabilityIntervalIncreaseRule.tag
+
+    def __init__(self, rule: StarProbabilityIntervalIncreaseRule, logic_ctx: RuleContext, players: int) -> None:
+        self.star_increase = {star: list(intervals) for star, intervals in rule.star_increase.items()}
+
+    def apply(self, ctx: BatchContext):
+        weights: np.ndarray = ctx.weights   # type: ignore
+        for star, intervals in self.star_increase.items():
+            counter = ctx.star_count(star) + 1
+            column = ctx.weight_stars.index(star)
+            active = np.ones(ctx.players, dtype=bool)
+            for start, increment in intervals:
+                active &= counter >= start      # 等价于逐区间检查时的 break
+                weights[:, column] += np.where(active, (counter - start + 1) * increment, 0)
+        _normalize_weights(weights)
+
+
+class BatchUpRule(BatchRule):
+    """
+    UpRule 的批量实现
+    """
+    tag: str = UpRule.tag
+
+    def __init__(self, rule: UpRule, logic_ctx: RuleContext, players: int) -> None:
+        self.up_probability = dict(rule.up_probability)
+        self.up_pity = dict(rule.up_pity)
+        self.up_counter: Dict[int, np.ndarray] = {
+            star: np.full(players, counter, dtype=np.int32)
+            for star, counter in rule.read_state(logic_ctx, "up_counter").items()
+        }
+        self.is_up_pity: Dict[int, np.ndarray] = {
+            star: np.zeros(players, dtype=bool)
+            for star in self.up_pity.keys()
+        }
+
+    def apply(self, ctx: BatchContext):
+        for is_up_pity in self.is_up_pity.values():
+            is_up_pity.fill(False)
+
+        for star, up_weight in self.up_probability.items():
+            current = ctx.star == star
+            counter = self.up_counter[star]
+
+            pity = np.zeros(ctx.players, dtype=bool)
+            if star in self.up_pity:
+                pity = current & (counter >= self.up_pity[star])   # 触发 UP 保底
+                ctx.up |= pity
+                counter[pity] = 0
+                self.is_up_pity[star] |= pity
+
+            normal = current & ~pity
+            ctx.up |= normal & (ctx.rng.random(ctx.players) * MAX_PROBABILITY < up_weight)
+            counter[normal & ctx.up] = 0
+            counter[normal & ~ctx.up] += 1
+
+
+class BatchFesRule(BatchRule):
+    """
+    FesRule 的批量实现
+    """
+    tag: str = FesRule.tag
+
+    def __init__(self, rule: FesRule, logic_ctx: RuleContext, players: int) -> None:
+        self.fes_probability = dict(rule.fes_probability)
+
+    def apply(self, ctx: BatchContext):
+        for star, fes_weight in self.fes_probability.items():
+            current = ctx.up & (ctx.star == star)
+            ctx.fes |= current & (ctx.rng.random(ctx.players) * MAX_PROBABILITY < fes_weight)
+
+
+class BatchAppointRule(BatchRule):
+    """
+    AppointRule 的批量实现
+    """
+    tag: str = AppointRule.tag
+
+    def __init__(self, rule: AppointRule, logic_ctx: RuleContext, players: int) -> None:
+        self.appoint_pity = dict(rule.appoint_pity)
+        self.appoint_counter: Dict[int, np.ndarray] = {
+            star: np.full(players, counter, dtype=np.int32)
+            for star, counter in rule.read_state(logic_ctx, "appoint_counter").items()
+        }
+
+    def apply(self, ctx: BatchContext):
+        for star, pity in self.appoint_pity.items():
+            current = ctx.up & (ctx.star == star)
+            counter = self.appoint_counter[star]
+            hit = current & (counter >= pity)
+            ctx.appoint |= hit
+            counter[hit] = 0
+            counter[current & ~hit] += 1
+
+    def callback(self, ctx: BatchContext):
+        for star, counter in self.appoint_counter.items():
+            counter[ctx.card_appoint & (ctx.star == star)] = 0
+
+
+class BatchCaptureRule(BatchRule):
+    """
+    CaptureRule 的批量实现
+    """
+    tag: str = CaptureRule.tag
+
+    def __init__(self, rule: CaptureRule, logic_ctx: RuleContext, players: int) -> None:
+        self.capture_probability = dict(rule.capture_probability)
+
+    def apply(self, ctx: BatchContext):
+        for star, capture_weight in self.capture_probability.items():
+            current = ~ctx.up & (ctx.star == star)
+            ctx.up |= current & (ctx.rng.random(ctx.players) * MAX_PROBABILITY < capture_weight)
+
+
+class BatchCapturePityRule(BatchRule):
+    """
+    CapturePityRule 的批量实现
+    """
+    tag: str = CapturePityRule.tag
+
+    def __init__(self, rule: CapturePityRule, logic_ctx: RuleContext, players: int) -> None:
+        self.capture_pity = dict(rule.capture_pity)
+        self.capture_pity_counter: Dict[int, np.ndarray] = {
+            star: np.full(players, counter, dtype=np.int32)
+            for star, counter in rule.read_state(logic_ctx, "capture_pity_counter").items()
+        }
+
+    def apply(self, ctx: BatchContext):
+        for star, pity in self.capture_pity.items():
+            counter = self.capture_pity_counter[star]
+            hit = (ctx.star == star) & (counter >= pity)
+            ctx.up |= hit
+            counter[hit] = 0
+
+    def callback(self, ctx: BatchContext):
+        if UpRule.tag not in ctx.rule_bridge:
+            return
+
+        up_rule: BatchUpRule = ctx.rule_bridge[UpRule.tag]     # type: ignore
+        for star, counter in self.capture_pity_counter.items():
+            if star not in up_rule.is_up_pity:
+                continue
+            current = ctx.up & (ctx.star == star)
+            by_pity = current & up_rule.is_up_pity[star]
+            counter[by_pity] += 1
+            counter[current & ~by_pity] = 0
+
+
+def tag_to_batch_rule_class(rule_tag: str) -> Type[BatchRule]:
+    match rule_tag:
+        case StarCounterRule.tag:
+            return BatchStarCounterRule
+        case StarPityRule.tag:
+            return BatchStarPityRule
+        case StarProbabilityRule.tag:
+            return BatchStarProbabilityRule
+        case StarProbabilityIncreaseRule.tag:
+            return BatchStarProbabilityIncreaseRule
+        case StarProbabilityIntervalIncreaseRule.tag:
+            return BatchStarProbabilityIntervalIncreaseRule
+        case UpRule.tag:
+            return BatchUpRule
+        case FesRule.tag:
+            return BatchFesRule
+        case AppointRule.tag:
+            return BatchAppointRule
+        case CaptureRule.tag:
+            return BatchCaptureRule
+        case CapturePityRule.tag:
+            return BatchCapturePityRule
+        case TypeStarCounterRule.tag | TypeStarProbabilityRule.tag | TypeStarPityRule.tag | UpTypeRule.tag:
+            return BatchRule    # 类型相关规则不影响星级与标签
+        case _:
+            raise ValueError(f"BatchSimulator: 不支持的规则 <{rule_tag}>")
+
+
+class BatchResult:
+    """
+    批量模拟结果
+    stars 与 tags 的形状为 (抽数, 玩家数), tags 中为 TAG_CODES 的下标
+    """
+    def __init__(self, stars: np.ndarray, tags: np.ndarray) -> None:
+        self.stars = stars
+        self.tags = tags
+        self.draws, self.players = stars.shape
+
+    def star_counts(self) -> Dict[int, int]:
+        """
+        各星级的出现次数
+        """
+        stars, counts = np.unique(self.stars, return_counts=True)
+        return {int(star): int(count) for star, count in zip(stars, counts)}
+
+    def tag_counts(self, star: int) -> Dict[str, int]:
+        """
+        指定星级下各标签的出现次数
+        """
+        tags = self.tags[self.stars == star]
+        return {
+            tag: int(np.count_nonzero(tags == code))
+            for code, tag in enumerate(TAG_CODES)
+        }
+
+    def up_rate(self, star: int) -> float:
+        """
+        指定星级中 UP 卡片 (包括 Fes 和 Appoint) 所占的比例
+        """
+        tags = self.tags[self.stars == star]
+        if not tags.size:
+            return 0.0
+        return float(np.count_nonzero(tags >= TAG_CODES.index(TAG_UP)) / tags.size)
+
+    def hit_positions(self, star: int, tag: str = TAG_STANDARD) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        返回 (玩家下标, 抽数) 两个数组, 抽数从 1 开始
+        只统计标签编码不低于 tag 的指定星级卡片, 结果按玩家、抽数排序
+        """
+        hits = (self.stars == star) & (self.tags >= TAG_CODES.index(tag))
+        players, draws = np.nonzero(hits.T)
+        return players, draws + 1
+
+    def intervals(self, star: int, tag: str = TAG_STANDARD) -> np.ndarray:
+        """
+        各玩家连续两次命中之间的间隔抽数, 首次命中的间隔从模拟开始计算
+        """
+        players, draws = self.hit_positions(star, tag)
+        if not draws.size:
+            return draws
+        intervals = np.diff(draws, prepend=0)
+        first = np.ones(players.size, dtype=bool)
+        first[1:] = players[1:] != players[:-1]
+        intervals[first] = draws[first]
+        return intervals
+
+    def first_hits(self, star: int, tag: str = TAG_STANDARD) -> np.ndarray:
+        """
+        各玩家首次命中的抽数, 未命中的玩家为 0
+        """
+        players, draws = self.hit_positions(star, tag)
+        first = np.zeros(self.players, dtype=np.int64)
+        order = np.ones(players.size, dtype=bool)
+        order[1:] = players[1:] != players[:-1]
+        first[players[order]] = draws[order]
+        return first
+
+
+class BatchSimulator:
+    """
+    批量模拟器
+    以抽卡逻辑配置 (与 WishLogicSystem.load_logic 读取的 json 相同) 构造
+    所有玩家从同一逻辑状态开始, 各自独立抽卡
+    """
+    def __init__(
+            self,
+            config: Dict,
+            players: int,
+            seed: int | None = None,
+            state: Dict | None = None,
+            appoint_share: Dict[int, float] | None = None
+            ) -> None:
+        """
+        state: 初始逻辑状态, 格式与 CardPool.get_logic_state 相同
+        appoint_share: 各星级非定轨 UP 卡片恰好为 Appoint 卡片的概率, 可由 CardGroup.appoint_share 计算
+        """
+        self.config = config
+        self.players = players
+        self.appoint_share = appoint_share if appoint_share else {}
+        self.rng = np.random.default_rng(seed)
+        self.prototype = WishLogicPrototype(config)
+        self.reset(state)
+
+    def reset(self, state: Dict | None = None):
+        """
+        重置所有玩家的逻辑状态
+        """
+        logic = self.prototype.new_logic(state=state)
+
+        self.ctx = BatchContext(self.players, self.rng)
+        self.rules: List[BatchRule] = [
+            tag_to_batch_rule_class(rule.tag)(rule, logic.ctx, self.players)  # type: ignore
+            for rule in logic.rules
+        ]
+        for rule in self.rules:
+            rule.set_bridge(self.ctx)
+
+    def _resolve_cards(self):
+        """
+        模拟卡组抽卡对回调的影响: 非定轨的 UP 卡片有一定概率恰好属于 Appoint 组
+        """
+        ctx = self.ctx
+        ctx.card_appoint[:] = ctx.appoint
+        for star, share in self.appoint_share.items():
+            candidate = (ctx.up | ctx.fes) & ~ctx.appoint & (ctx.star == star)
+            ctx.card_appoint |= candidate & (ctx.rng.random(ctx.players) < share)
+
+    def step(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        所有玩家同时抽一次, 返回本抽的 星级数组 和 标签编码数组
+        """
+        ctx = self.ctx
+        ctx.new_draw()
+
+        for rule in self.rules:
+            rule.apply(ctx)
+
+        if AppointRule.tag in ctx.rule_bridge:
+            self._resolve_cards()
+        stars = ctx.star.astype(np.int8)
+        tags = ctx.tag_codes()
+
+        for rule in self.rules:
+            rule.callback(ctx)
+
+        return stars, tags
+
+    def run(self, draws: int) -> BatchResult:
+        """
+        所有玩家各抽 draws 次
+        """
+        stars = np.empty((draws, self.players), dtype=np.int8)
+        tags = np.empty((draws, self.players), dtype=np.int8)
+        for i in range(draws):
+            stars[i], tags[i] = self.step()
+        return BatchResult(stars, tags)
@@ -0,0 +1,112 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    CardCatalog
+
+Description
+_
+    Wishes 卡片目录缓存模块
+    CardSystem 启动时需要逐个读取每张卡片的 json 文件, 卡片数量较多时启动较慢
+    卡片目录将所有卡片文件的内容编译为卡片目录中的单个 json 文件 (CARD_CATALOG_NAME), 并记录每个源文件的
+        修改时间 (纳秒) 和字节数
+    加载时只检查源文件的修改时间和字节数, 未变化的卡片直接由缓存创建, 只重新读取新增或修改过的文件
+        已删除的文件和不再加载的目录从缓存中移除
+    卡片的加载顺序与 CardSystem.load_cards 相同 (目录遍历顺序), 因此卡片编号与不使用缓存时一致
+    load_cards 可在多个线程中同时加载不同的目录, 见 CardSystem 的并发加载
+    缓存文件格式:
+        {"version": 格式版本, "dirs": {相对目录: {文件名: [修改时间, 字节数, [卡片字段...]]}}}
+        卡片字段按 Card 的字段顺序排列: content, game, star, type, attribute, title, profession, image_path
+"""
+
+
+from Const import *
+from Base import Card
+from typing import Dict, List
+import json
+import os
+import threading
+
+
+CATALOG_VERSION = 1
+
+
+class CardCatalog:
+    """
+    卡片目录缓存
+    """
+    def __init__(self, cards_dir: str) -> None:
+        self.cards_dir = cards_dir
+        self.path = os.path.join(cards_dir, CARD_CATALOG_NAME)
+        self.dirs: Dict[str, Dict[str, List]] = {}      # 缓存中的 相对目录 -> 文件名 -> 条目
+        self.loaded: Dict[str, Dict[str, List]] = {}    # 本次加载的 相对目录 -> 文件名 -> 条目
+        self.changed = False                            # 本次加载的内容与缓存是否不同
+        self.reused = 0                                 # 由缓存创建的卡片数
+        self.parsed = 0                                 # 重新读取的卡片文件数
+        self._lock = threading.Lock()                   # 保护以上统计和 loaded
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CATALOG_VERSION:
+                self.dirs = data["dirs"]
+        except (OSError, ValueError, AttributeError, KeyError):
+            # 缓存不存在或已损坏时全部重新读取
+            self.dirs = {}
+
+    def load_cards(self, dir_path: str) -> Dict[str, Card]:
+        """
+        与 CardSystem.load_cards 相同: 加载目录下的所有卡片 json 文件为 卡片名称: 卡片对象 键值对并返回
+        未变化的文件由缓存创建卡片
+        """
+        cards: Dict[str, Card] = {}
+        key = os.path.relpath(dir_path, self.cards_dir).replace(os.sep, "/")
+        cached = self.dirs.get(key, {})
+        entries: Dict[str, List] = {}
+        reused = parsed = 0
+        if os.path.exists(dir_path):
+            with os.scandir(dir_path) as it:
+                for file in it:
+                    if not file.name.endswith(".json"):
+                        continue
+                    stat = file.stat()
+                    entry = cached.get(file.name)
+                    if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                        card = Card(*entry[2])
+                        reused += 1
+                    else:
+                        card = Card.load_from_json(file.path)
+                        entry = [stat.st_mtime_ns, stat.st_size, [
+                            card.content, card.game, card.star, card.type,
+                            card.attribute, card.title, card.profession, card.image_path
+                        ]]
+                        parsed += 1
+                    entries[file.name] = entry
+                    cards[card.content] = card
+
+        with self._lock:
+            self.reused += reused
+            self.parsed += parsed
+            if parsed or len(entries) != len(cached):
+                self.changed = True     # 有文件被修改、新增或删除
+            self.loaded[key] = entries
+        return cards
+
+    def save(self):
+        """
+        加载完成后调用, 内容有变化时原子地替换缓存文件
+        缓存文件无法写入时 (如只读目录) 忽略, 下次启动重新读取
+        """
+        if not self.changed and self.loaded.keys() == self.dirs.keys():
+            return
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8", newline="") as f:
+                json.dump({"version": CATALOG_VERSION, "dirs": self.loaded}, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(temp_path, self.path)
+        except OSError:
+            return
+        self.dirs = self.loaded
+        self.changed = False
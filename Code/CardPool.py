@@ -14,23 +14,45 @@ _
 
 
 from Base import *
+from typing import Iterator
 from WishRule import WishLogic
+from WishRandom import RandomBackend
 from WishRecorder import WishRecorder
+from RecordLog import CsvRecordLog
+from FastForward import FastForward
 
 
 class CardPool:
     """
     卡池类
     集成抽卡逻辑、卡组管理、抽卡记录三部分功能
+    抽卡逻辑和卡组共用卡池的随机数后端
     """
-    def __init__(self, name: str, logic: WishLogic, card_group: CardGroup, recorder_dir: str, none_flag: bool = False) -> None:
+    def __init__(
+            self,
+            name: str,
+            logic: WishLogic,
+            card_group: CardGroup,
+            recorder_dir: str,
+            none_flag: bool = False,
+            rng: RandomBackend | None = None,
+            record_backend: str = CsvRecordLog.name,
+            record_durability: str = RECORD_DURABILITY_NONE,
+            record_segments: Dict | None = None
+            ) -> None:
         self.none_flag = none_flag
         if none_flag:
             return
         self.name = name
         self.logic = logic
+        if rng is not None:
+            self.logic.set_rng(rng)
         self.card_group = card_group
-        self.recorder = WishRecorder(recorder_dir, self.card_group.max_star)
+        self.recorder = WishRecorder(
+            recorder_dir, self.card_group.max_star, record_backend, record_durability, segments=record_segments
+        )
+        self._fast_forward: FastForward | None = None   # 快进抽卡器, 首次快进抽卡时创建
+        self._fast_forward_checked = False
     
     def _wish(self) -> PackedCard:
         """
@@ -38,16 +60,7 @@ class CardPool:
         """
         logic_result = self.logic.wish()
 
-        if TAG_APPOINT in logic_result.tags:
-            tag = TAG_APPOINT
-        elif TAG_FES in logic_result.tags:
-            tag = TAG_FES
-        elif TAG_UP in logic_result.tags:
-            tag = TAG_UP
-        else:
-            tag = TAG_STANDARD
-
-        packed_card = self.card_group.random_card(logic_result.type_, logic_result.star, tag)
+        packed_card = self.card_group.random_card(logic_result.type_, logic_result.star, logic_result.real_tag(), self.logic.rng)
 
         self.logic.callback(packed_card)
 
@@ -78,18 +91,91 @@ class CardPool:
 
         return result
     
-    def wish_count(self, count: int) -> WishResult:
+    def wish_count(self, count: int, fast_forward: bool = False, columnar: bool | None = None) -> WishResult | ColumnarWishResult:
         """
         指定次数抽卡
+        fast_forward: 是否使用快进抽卡 (见 FastForward), 抽卡逻辑不支持快进时逐抽执行
+        columnar: 是否返回列式抽卡结果, 为 None 时次数达到 COLUMNAR_RESULT_MIN_COUNT 才返回列式结果
         """
-        result = WishResult()
+        if columnar is None:
+            columnar = count >= COLUMNAR_RESULT_MIN_COUNT
+        result = ColumnarWishResult() if columnar else WishResult()
+        add_result = result.add
+
+        fast = self.get_fast_forward() if fast_forward else None
+        if fast is not None:
+            add_record = self.recorder.add_record
+
+            def add(packed_card: PackedCard):
+                add_record(packed_card)
+                add_result(packed_card)
 
+            fast.wish(count, add)
+            return result
+
+        wish = self._wish
         for _ in range(count):
-            packed_card = self._wish()
-            result.add(packed_card)
+            add_result(wish())
 
         return result
+
+    def iter_wishes(self, count: int | None = None, fast_forward: bool = False) -> Iterator[PackedCard]:
+        """
+        逐抽产生抽卡结果的生成器, 每张卡片在抽出时即被记录, 不保存抽卡结果
+        count: 抽卡次数, 为 None 时无限抽卡
+        fast_forward: 是否使用快进抽卡, 快进时按 WISH_BATCH_SIZE 分批抽卡
+        """
+        if fast_forward and self.get_fast_forward() is not None:
+            for batch in self.iter_wish_batches(WISH_BATCH_SIZE, count, fast_forward):
+                yield from batch
+            return
+
+        wish = self._wish
+        if count is None:
+            while True:
+                yield wish()
+
+        for _ in range(count):
+            yield wish()
+
+    def iter_wish_batches(self, chunk: int = WISH_BATCH_SIZE, count: int | None = None, fast_forward: bool = False) -> Iterator[ColumnarWishResult]:
+        """
+        分批抽卡的生成器, 每批抽 chunk 次 (最后一批可能不足), 以列式抽卡结果产生
+        count: 总抽卡次数, 为 None 时无限抽卡
+        fast_forward: 是否使用快进抽卡 (见 FastForward)
+        """
+        if chunk <= 0:
+            raise ValueError(f"Invalid chunk size: {chunk}")
+
+        remaining = count
+        while remaining is None or remaining > 0:
+            size = chunk if remaining is None else min(chunk, remaining)
+            yield self.wish_count(size, fast_forward, columnar=True)  # type: ignore
+            if remaining is not None:
+                remaining -= size
+
+    def get_fast_forward(self) -> FastForward | None:
+        """
+        获取快进抽卡器, 抽卡逻辑不支持快进时返回 None
+        """
+        if not self._fast_forward_checked:
+            self._fast_forward_checked = True
+            try:
+                self._fast_forward = FastForward(self.logic, self.card_group)
+            except ValueError:
+                self._fast_forward = None
+        return self._fast_forward
     
+    @property
+    def rng(self) -> RandomBackend:
+        return self.logic.rng
+
+    def seed(self, seed: int | None = None):
+        """
+        重新设定卡池随机数种子
+        """
+        self.logic.rng.seed(seed)
+
     def reset(self, with_records: bool = True):
         """
         重置卡池
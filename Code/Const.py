@@ -23,5 +23,77 @@ TAG_FES = "fes"             # Fes 组, 包含于 UP 组
 TAG_APPOINT = "appoint"     # Appoint (定轨) 组, 包含于 UP 组和 Fes 组
 TAG_STANDARD = "standard"   # 常驻组
 
+# NOTE: 标签编码, 按 real_tag 的判定优先级从低到高排列, 用于数组化的抽卡结果
+TAG_CODES = (TAG_STANDARD, TAG_UP, TAG_FES, TAG_APPOINT)
+
 # NOTE: 记录模块缓存大小
 CACHE_SIZE = 10
+
+# NOTE: 抽样模块权重表缓存大小
+SAMPLING_CACHE_SIZE = 256
+
+# NOTE: 随机数后端批量预生成的随机数个数
+RANDOM_BUFFER_SIZE = 4096
+
+# NOTE: 软保底概率表大小上限, 超出时逐抽计算增长后的概率
+SOFT_PITY_TABLE_SIZE = 65536
+
+# NOTE: 逻辑会话状态数组的类型码 (array 模块), 计数器和保底标记均按有符号 32 位整数存放
+STATE_TYPECODE = "i"
+
+# NOTE: 快进抽卡中单次抽样的最长低星连抽数, 超出时从新状态继续抽样
+FAST_FORWARD_RUN_LIMIT = 1024
+
+# NOTE: 命令行抽卡次数达到该值时使用快进抽卡
+FAST_FORWARD_MIN_COUNT = 10000
+
+# NOTE: 抽卡目标, 用于马尔可夫链分析和目标概率查询
+GOAL_STAR = "star"          # 抽出目标星级
+GOAL_UP = "up"              # 抽出目标星级的 UP 卡片 (包括 Fes 和 Appoint)
+GOAL_APPOINT = "appoint"    # 抽出目标星级的 Appoint 卡片
+
+# NOTE: 目标概率查询的结果缓存大小 (LRU)
+GOAL_QUERY_CACHE_SIZE = 1024
+
+# NOTE: 目标概率查询缓存的马尔可夫链数量 (LRU), 每条链缓存其全部已展开状态的转移
+GOAL_QUERY_CHAIN_CACHE_SIZE = 16
+
+# NOTE: CardPool.wish_count 默认返回列式抽卡结果的最小抽卡次数
+COLUMNAR_RESULT_MIN_COUNT = 1000
+
+# NOTE: 分批抽卡时每批的抽卡次数
+WISH_BATCH_SIZE = 1000
+
+# NOTE: 抽卡记录后台写入的默认刷新策略: 缓存记录数, 最长刷新间隔 (秒)
+RECORD_FLUSH_COUNT = 1000
+RECORD_FLUSH_INTERVAL = 1.0
+
+# NOTE: 抽卡记录的持久化模式, 见 WishRecorder
+RECORD_DURABILITY_NONE = "none"     # 不主动写入磁盘
+RECORD_DURABILITY_BATCH = "batch"   # 写入检查点前将日志写入磁盘
+RECORD_DURABILITY_FLUSH = "flush"   # 每次写入日志后都将日志写入磁盘
+
+# NOTE: 抽卡记录两次检查点 (重写 profile.json) 之间的日志写入次数
+RECORD_CHECKPOINT_INTERVAL = 10
+
+# NOTE: 抽卡记录稀疏索引中每个索引块包含的记录数
+RECORD_INDEX_INTERVAL = 1024
+
+# NOTE: 读取抽卡记录日志时每次读取的字节数
+RECORD_READ_SIZE = 1 << 20
+
+# NOTE: SQLite 记录后端的数据库文件名, 位于各卡池记录目录的上级目录, 所有卡池共用
+RECORD_DATABASE_NAME = "records.db"
+
+# NOTE: 抽卡记录日志封存分段的压缩方式, 见 RecordLog
+RECORD_COMPRESSION_GZIP = "gzip"
+RECORD_COMPRESSION_LZMA = "lzma"
+
+# NOTE: 启用抽卡记录日志分段但未指定轮换条件时, details 日志轮换的字节数
+RECORD_SEGMENT_SIZE = 64 << 20
+
+# NOTE: 卡片目录缓存文件名, 位于卡片目录中, 见 CardCatalog
+CARD_CATALOG_NAME = "CardCatalog.json"
+
+# NOTE: 并发加载卡片和配置文件的默认线程数, 见 ManageSystem.load_systems
+LOAD_WORKERS = 8
@@ -0,0 +1,229 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    FastForward
+
+Description
+_
+    Wishes 快进抽卡模块
+    大量抽卡时, 绝大多数结果是最低星级的填充抽, 它们只会让星级计数器自增
+    因此低星连抽期间的星级判定状态是确定的, 连抽长度的分布可由马尔可夫链的风险曲线直接求出:
+        P(连抽长度 >= n) = 各步抽出最低星级的概率之积
+    快进时对每段低星连抽只抽样一次长度 (逆 CDF 查表), 连抽中的卡片按类型概率表批量抽取
+    连抽结束后的一抽以 "非最低星级" 为条件确定星级, 再交给抽卡逻辑完成其余判定
+    结果的分布与逐抽执行完全一致, 但消耗的随机数序列不同
+    *要求最低星级不参与星级判定、UP、Fes、捕获、定轨 和 类型计数与保底
+"""
+
+
+from Const import *
+from Base import *
+from WishRule import *
+from MarkovChain import MarkovChain
+from Sampling import WeightTable
+from typing import Callable, Dict, List, Tuple
+
+
+# 连抽表的抽样结果: (连抽长度, 连抽结束时的链状态, 是否在连抽结束后抽出高星级)
+RunSample = Tuple[int, Tuple[int, ...], bool]
+
+
+class FastForward:
+    """
+    快进抽卡器
+    以逻辑会话和卡组构造, 链状态的转移表和连抽长度表按需计算并缓存
+    无法快进的抽卡逻辑在构造时抛出 ValueError
+    """
+    def __init__(self, logic: WishLogic, card_group: CardGroup) -> None:
+        self.logic = logic
+        self.card_group = card_group
+        self.chain = MarkovChain(logic.config)
+        self.base_star = min(self.chain.base_weights.keys())
+
+        counter_rule: StarCounterRule | None = logic.ctx.rule_bridge.get(StarCounterRule.tag)   # type: ignore
+        if counter_rule is None:
+            raise ValueError("FastForward: 抽卡逻辑缺少 StarCounterRule")
+        if not self.chain.counted_stars <= set(counter_rule.star_list):
+            raise ValueError("FastForward: 影响星级判定的星级必须在 StarCounterRule 的星级列表中")
+        if self.base_star in self.chain.counted_stars:
+            raise ValueError(f"FastForward: 最低星级 <{self.base_star}> 参与星级判定")
+        for rule in logic.rules:
+            if self._uses_base_star(rule):
+                raise ValueError(f"FastForward: 规则 <{rule.tag}> 使用了最低星级 <{self.base_star}>")
+
+        self.counter_slots: Tuple[int, ...] = tuple(counter_rule.star_slots.values())
+        self.base_counter_slot = counter_rule.star_slots.get(self.base_star)
+        self.flag_slots: Tuple[int, ...] = tuple(
+            slot
+            for rule in logic.rules
+            for slots, is_flag in rule.state_groups.values() if is_flag
+            for slot in _flatten(slots)
+        )
+
+        # 链状态中星级计数器槽位 -> 会话状态槽位, 其余链槽位不影响星级判定, 固定为初始值
+        self.key_slots: Tuple[Tuple[int, int], ...] = tuple(
+            (chain_slot, counter_rule.star_slots[star])
+            for (tag, star), chain_slot in self.chain.ctx.slots.items()
+            if tag == StarCounterRule.tag
+        )
+
+        type_rule: TypeStarProbabilityRule | None = logic.ctx.rule_bridge.get(TypeStarProbabilityRule.tag)  # type: ignore
+        self.base_type_table = type_rule.type_tables.get(self.base_star) if type_rule else None
+
+        self._steps: Dict[Tuple[int, ...], Tuple[float, Tuple[int, ...], WeightTable | None]] = {}
+        self._runs: Dict[Tuple[int, ...], WeightTable] = {}
+
+    def _uses_base_star(self, rule: BaseRule) -> bool:
+        """
+        规则是否会因最低星级的抽卡结果改变状态或标签
+        """
+        if isinstance(rule, StarCounterRule):
+            return False
+        if isinstance(rule, FesRule):
+            return self.base_star in rule.fes_probability
+        if isinstance(rule, CaptureRule):
+            return self.base_star in rule.capture_probability
+        return any(self.base_star in slots for slots, _ in rule.state_groups.values())
+
+    def chain_key(self, state: array) -> Tuple[int, ...]:
+        """
+        由会话状态得到只含星级计数器的链状态
+        """
+        key = list(self.chain.initial_state)
+        for chain_slot, slot in self.key_slots:
+            counter = state[slot]
+            key[chain_slot] = counter if counter > 0 else 0
+        return tuple(key)
+
+    def chain_key_of(self, chain_state: Tuple[int, ...]) -> Tuple[int, ...]:
+        """
+        将完整链状态中的非计数器槽位还原为初始值
+        """
+        key = list(self.chain.initial_state)
+        for chain_slot, _ in self.key_slots:
+            key[chain_slot] = chain_state[chain_slot]
+        return tuple(key)
+
+    def _step(self, key: Tuple[int, ...]) -> Tuple[float, Tuple[int, ...], WeightTable | None]:
+        """
+        从链状态抽一次: 返回 (抽出最低星级的概率, 抽出最低星级后的链状态, 以非最低星级为条件的星级权重表)
+        """
+        step = self._steps.get(key)
+        if step is not None:
+            return step
+
+        base_star = self.base_star
+        p_base = 0.0
+        next_key = key
+        star_p: Dict[int, float] = {}
+        for p, outcome, next_state in self.chain.transitions(key):
+            if outcome.star == base_star:
+                p_base += p
+                next_key = self.chain_key_of(next_state)
+            else:
+                star_p[outcome.star] = star_p.get(outcome.star, 0.0) + p
+
+        star_table = WeightTable(tuple(star_p.keys()), tuple(star_p.values())) if star_p else None    # type: ignore
+        step = self._steps[key] = (p_base, next_key, star_table)
+        return step
+
+    def run_table(self, key: Tuple[int, ...]) -> WeightTable:
+        """
+        从链状态出发的低星连抽长度表 (风险曲线的逆 CDF)
+        连抽长度为 n 的权重为 前 n 抽均为最低星级 且 第 n + 1 抽不是最低星级 的概率
+        连抽达到 FAST_FORWARD_RUN_LIMIT 时截断, 剩余概率归入最后一项, 抽中后从新状态继续抽样
+        """
+        table = self._runs.get(key)
+        if table is not None:
+            return table
+
+        population: List[RunSample] = []
+        weights: List[float] = []
+        survival = 1.0
+        current = key
+        for n in range(FAST_FORWARD_RUN_LIMIT):
+            p_base, next_key, _ = self._step(current)
+            if p_base < 1.0:
+                population.append((n, current, True))
+                weights.append(survival * (1.0 - p_base))
+            survival *= p_base
+            if survival <= 0.0:
+                break
+            current = next_key
+        else:
+            population.append((FAST_FORWARD_RUN_LIMIT, current, False))
+            weights.append(survival)
+
+        table = self._runs[key] = WeightTable(population, weights)    # type: ignore
+        return table
+
+    def _advance(self, state: array, count: int):
+        """
+        将会话状态推进 count 次最低星级的抽卡
+        等价于逐抽执行: 保底标记被清除, 已开始计数的星级计数器自增, 最低星级计数器归零
+        """
+        for slot in self.flag_slots:
+            state[slot] = 0
+        for slot in self.counter_slots:
+            if state[slot] >= 0:
+                state[slot] += count
+        if self.base_counter_slot is not None:
+            state[self.base_counter_slot] = 0
+
+    def _fill(self, count: int, add: Callable[[PackedCard], None]):
+        """
+        批量抽取 count 张最低星级的常驻卡片
+        """
+        rng = self.logic.rng
+        random_card = self.card_group.random_card
+        base_star = self.base_star
+        table = self.base_type_table
+        if table is None:
+            for _ in range(count):
+                add(random_card("", base_star, TAG_STANDARD, rng))
+            return
+        draw = table.draw
+        rand = rng.random
+        for _ in range(count):
+            add(random_card(draw(rand), base_star, TAG_STANDARD, rng))
+
+    def wish(self, count: int, add: Callable[[PackedCard], None]):
+        """
+        快进抽卡 count 次, 每张卡片按抽卡顺序传给 add
+        结束时会话状态与逐抽执行 count 次后的状态服从相同分布
+        """
+        logic = self.logic
+        state = logic.ctx.state
+        rand = logic.rng.random
+        remaining = count
+
+        while remaining > 0:
+            run, end_key, has_event = self.run_table(self.chain_key(state)).draw(rand)
+            run = min(run, remaining)
+            if run:
+                self._fill(run, add)
+                self._advance(state, run)
+                remaining -= run
+            if not remaining or not has_event:
+                continue
+
+            star_table = self._step(end_key)[2]
+            logic_result = logic.wish(star_table.draw(rand))    # type: ignore
+            packed_card = self.card_group.random_card(logic_result.type_, logic_result.star, logic_result.real_tag(), logic.rng)
+            logic.callback(packed_card)
+            add(packed_card)
+            remaining -= 1
+
+
+def _flatten(slots: Dict) -> List[int]:
+    """
+    展开 (可能嵌套的) 槽位字典
+    """
+    return [
+        slot
+        for value in slots.values()
+        for slot in (_flatten(value) if isinstance(value, dict) else (value,))
+    ]
@@ -0,0 +1,180 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    GoalQuery
+
+Description
+_
+    Wishes 目标概率查询模块
+    基于抽卡逻辑配置和逻辑状态, 由马尔可夫链精确计算抽卡目标的达成概率, 例如:
+        从当前状态出发, N 抽以内抽出至少 k 个目标星级 UP 卡片的概率
+        抽出 k 个目标所需的期望抽数
+        抽出 k 个目标的抽数百分位
+    同一 (逻辑配置, 逻辑状态, 目标, k) 的抽数分布只计算一次, 并缓存在 LRU 缓存中
+    各逻辑配置的马尔可夫链 (及其状态转移) 同样缓存在 LRU 缓存中
+    一次计算同时得到 1 ~ k 个目标的分布, 不同 N 的查询共用同一分布
+"""
+
+
+from Const import *
+from MarkovChain import MarkovChain, PassageDistribution
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+import hashlib
+import json
+import math
+
+
+# 缓存键: (逻辑配置哈希, 链状态, 目标, 目标次数)
+QueryKey = Tuple[str, Tuple[int, ...], str, int]
+
+
+def logic_hash(config: Dict, appoint_share: Dict[int, float] | None = None) -> str:
+    """
+    抽卡逻辑配置的哈希值, 内容相同的配置得到相同的哈希值
+    """
+    content = json.dumps(
+        [config, sorted((appoint_share or {}).items())],
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class GoalQuery:
+    """
+    目标概率查询
+    查询参数 config 和 state 与 MarkovChain 相同, 可直接使用 CardPool.logic.config 和 CardPool.get_logic_state()
+    appoint_share 见 MarkovChain, 可由 CardGroup.appoint_share 计算
+    """
+    def __init__(self, cache_size: int = GOAL_QUERY_CACHE_SIZE, chain_cache_size: int = GOAL_QUERY_CHAIN_CACHE_SIZE) -> None:
+        if cache_size <= 0:
+            raise ValueError(f"Invalid cache size: {cache_size}")
+        if chain_cache_size <= 0:
+            raise ValueError(f"Invalid chain cache size: {chain_cache_size}")
+        self.cache_size = cache_size
+        self.chain_cache_size = chain_cache_size
+        self.chains: OrderedDict[str, MarkovChain] = OrderedDict()  # 逻辑配置哈希 -> 马尔可夫链
+        self.cache: OrderedDict[QueryKey, PassageDistribution] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def chain(self, config: Dict, appoint_share: Dict[int, float] | None = None) -> Tuple[str, MarkovChain]:
+        """
+        获取逻辑配置对应的马尔可夫链, 返回 (逻辑配置哈希, 马尔可夫链)
+        """
+        key = logic_hash(config, appoint_share)
+        chain = self.chains.get(key)
+        if chain is None:
+            chain = self.chains[key] = MarkovChain(config, appoint_share=appoint_share)
+            while len(self.chains) > self.chain_cache_size:
+                self.chains.popitem(last=False)
+        else:
+            self.chains.move_to_end(key)
+        return key, chain
+
+    def distribution(
+            self,
+            config: Dict,
+            state: Dict | None,
+            copies: int = 1,
+            goal: str = GOAL_UP,
+            appoint_share: Dict[int, float] | None = None
+            ) -> PassageDistribution:
+        """
+        从 state 出发, 第 copies 次达成目标所需抽数的分布
+        """
+        if copies <= 0:
+            raise ValueError(f"Invalid copies: {copies}")
+
+        key_hash, chain = self.chain(config, appoint_share)
+        chain_state = chain.encode_state(state) if state else chain.initial_state
+        key = (key_hash, chain_state, goal, copies)
+
+        distribution = self.cache.get(key)
+        if distribution is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return distribution
+
+        self.misses += 1
+        distributions = chain.draws_until_copies(goal, copies, chain_state)
+        for count, distribution in enumerate(distributions, 1):
+            self._put((key_hash, chain_state, goal, count), distribution)
+        return distributions[-1]
+
+    def _put(self, key: QueryKey, distribution: PassageDistribution):
+        self.cache[key] = distribution
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def probability(
+            self,
+            config: Dict,
+            state: Dict | None,
+            draws: int,
+            copies: int = 1,
+            goal: str = GOAL_UP,
+            appoint_share: Dict[int, float] | None = None
+            ) -> float:
+        """
+        draws 抽以内至少达成 copies 次目标的概率
+        """
+        return self.distribution(config, state, copies, goal, appoint_share).probability(draws)
+
+    def expected_draws(
+            self,
+            config: Dict,
+            state: Dict | None,
+            copies: int = 1,
+            goal: str = GOAL_UP,
+            appoint_share: Dict[int, float] | None = None
+            ) -> float:
+        """
+        达成 copies 次目标的期望抽数, 目标无法达成时返回 math.inf
+        """
+        distribution = self.distribution(config, state, copies, goal, appoint_share)
+        if not distribution.pmf:
+            return math.inf
+        return distribution.mean()
+
+    def percentiles(
+            self,
+            config: Dict,
+            state: Dict | None,
+            copies: int = 1,
+            qs: Sequence[float] = (0.1, 0.25, 0.5, 0.75, 0.9),
+            goal: str = GOAL_UP,
+            appoint_share: Dict[int, float] | None = None
+            ) -> Dict[float, int]:
+        """
+        达成 copies 次目标的概率达到各百分位所需的最少抽数, 无法达到时为 -1
+        """
+        distribution = self.distribution(config, state, copies, goal, appoint_share)
+        return {q: distribution.percentile(q) for q in qs}
+
+    def curve(
+            self,
+            config: Dict,
+            state: Dict | None,
+            draws: int,
+            copies: int = 1,
+            goal: str = GOAL_UP,
+            appoint_share: Dict[int, float] | None = None
+            ) -> List[float]:
+        """
+        1 ~ draws 抽以内至少达成 copies 次目标的概率曲线
+        """
+        distribution = self.distribution(config, state, copies, goal, appoint_share)
+        return [distribution.probability(n) for n in range(1, draws + 1)]
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        self.cache.clear()
+        self.chains.clear()
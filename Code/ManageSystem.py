@@ -9,35 +9,100 @@ _
 Description
 _
     定义 Wishes 中的各种管理系统
+    并发加载:
+        各管理系统可传入线程池 (executor), 将配置文件的读取和解析分发到线程池中执行
+        管理系统之间仍按依赖顺序依次加载: 卡片 -> 常驻卡组 -> 卡组 -> 抽卡逻辑 -> 卡池
+        每个管理系统内, 对象按目录遍历顺序依次创建和注册, 加载结果 (包括卡片编号) 与顺序加载相同
+        卡片按目录并发加载, 卡池连同抽卡记录的加载一起并发创建
+        load_systems 按上述顺序创建所有管理系统
 """
 
 
 import os
 import json
+from concurrent.futures import Executor, ThreadPoolExecutor
 from Const import *
 from Base import *
 from CardPool import CardPool
+from CardCatalog import CardCatalog
 from WishRule import WishLogic
-from WishRule import WishLogic
-from typing import Dict, List, Sequence
+from WishRule import WishLogicPrototype
+from WishRandom import GlobalRandomBackend, make_rng
+from RecordLog import CsvRecordLog
+from typing import Any, Callable, Dict, List, Sequence, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+
+def read_json(file: str) -> Any:
+    """
+    读取 json 文件
+    """
+    with open(file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def json_files(dir_path: str) -> List[str]:
+    """
+    目录下所有 json 文件的路径, 按目录遍历顺序
+    """
+    return [os.path.join(dir_path, filename) for filename in os.listdir(dir_path) if filename.endswith(".json")]
+
+
+def map_files(function: Callable[[str], T], paths: Sequence[str], executor: Executor | None = None) -> List[T]:
+    """
+    对每个文件路径调用 function, 返回按 paths 顺序排列的结果
+    executor 不为 None 时在线程池中并发执行
+    """
+    if executor is None:
+        return [function(path) for path in paths]
+    return list(executor.map(function, paths))
 
 
 class CardSystem:
     """
     卡片管理系统
     卡片管理层级: 游戏 -> 类型 -> 星级 -> 卡片名称: 卡片对象
+    use_catalog: 是否使用卡片目录缓存加载卡片, 见 CardCatalog
+    executor: 并发加载各卡片目录的线程池, 为 None 时顺序加载
     """
-    def __init__(self, cards_dir: str, dir_config: Dict[str, Dict[str, Sequence[int]]]):
+    def __init__(
+            self,
+            cards_dir: str,
+            dir_config: Dict[str, Dict[str, Sequence[int]]],
+            use_catalog: bool = True,
+            executor: Executor | None = None
+            ):
+        catalog = CardCatalog(cards_dir) if use_catalog else None
+        load_cards = catalog.load_cards if catalog is not None else self.load_cards
+        dirs: List[Tuple[str, str, int]] = [
+            (game, type_, star)
+            for game, type_dict in dir_config.items()
+            for type_, star_list in type_dict.items()
+            for star in star_list
+        ]
+        loaded = map_files(
+            load_cards,
+            [os.path.join(cards_dir, game, type_, f"Star{star}") for game, type_, star in dirs],
+            executor
+        )
+
         self.card_container: Dict[str, Dict[str, Dict[int, Dict[str, Card]]]] = {
-            game: {
-                type_: {
-                    star: self.load_cards(os.path.join(cards_dir, game, type_, f"Star{star}"))
-                    for star in star_list
-                }
-                for type_, star_list in type_dict.items()
-            }
+            game: {type_: {} for type_ in type_dict}
             for game, type_dict in dir_config.items()
         }
+        for (game, type_, star), cards in zip(dirs, loaded):
+            self.card_container[game][type_][star] = cards
+        if catalog is not None:
+            catalog.save()
+        # 全局卡片注册表, 按加载顺序为卡片分配编号
+        self.registry = card_registry
+        for game_dict in self.card_container.values():
+            for type_dict in game_dict.values():
+                for card_dict in type_dict.values():
+                    for card in card_dict.values():
+                        self.registry.register(card)
     
     @staticmethod
     def load_cards(dir_path: str) -> Dict[str, Card]:
@@ -96,6 +161,12 @@ class CardSystem:
         # 未找到
         return Card.none()
     
+    def get_card_by_id(self, card_id: int) -> Card:
+        """
+        根据卡片编号查找卡片, 若没有匹配的卡片，则返回空卡片: Card.none()
+        """
+        return self.registry.get(card_id)
+
     def has_card(self, card: Card) -> bool:
         """
         判断卡片是否存在于系统中
@@ -110,6 +181,7 @@ class CardSystem:
         """
         if self.has_card(card):     # 检验卡片是否已存在
             return
+        self.registry.register(card)
         
         # 确定卡片所属游戏是否存在
         if card.game not in self.card_container:
@@ -152,24 +224,26 @@ class CardSystem:
 class StandardGroupSystem:
     """
     常驻卡组管理系统
+    executor: 并发读取配置文件的线程池, 为 None 时顺序读取
     """
-    def __init__(self, card_group_dir: str, card_system: CardSystem):
+    def __init__(self, card_group_dir: str, card_system: CardSystem, executor: Executor | None = None):
         self.card_groups: dict[str, SingleTagCardGroup] = {}
         self.card_system = card_system
 
-        for filename in os.listdir(card_group_dir):
-            if filename.endswith(".json"):
-                filepath = os.path.join(card_group_dir, filename)
-                group = self.load_group_from_json(filepath)
-                self.card_groups[group.name] = group
+        for config in map_files(read_json, json_files(card_group_dir), executor):
+            group = self.load_group_from_config(config)
+            self.card_groups[group.name] = group
 
     def load_group_from_json(self, file: str) -> SingleTagCardGroup:
         """
         从 json 文件中加载常驻卡组
         """
-        with open(file, "r", encoding="utf-8") as f:
-            config = json.load(f)
-        
+        return self.load_group_from_config(read_json(file))
+
+    def load_group_from_config(self, config: Dict) -> SingleTagCardGroup:
+        """
+        从配置字典中加载常驻卡组
+        """
         group = SingleTagCardGroup(config["name"])
         del config["name"]
 
@@ -202,25 +276,33 @@ class StandardGroupSystem:
 class CardGroupSystem:
     """
     卡组管理系统
+    executor: 并发读取配置文件的线程池, 为 None 时顺序读取
     """
-    def __init__(self, card_group_dir: str, card_system: CardSystem, standard_group_system: StandardGroupSystem):
+    def __init__(
+            self,
+            card_group_dir: str,
+            card_system: CardSystem,
+            standard_group_system: StandardGroupSystem,
+            executor: Executor | None = None
+            ):
         self.card_groups: dict[str, CardGroup] = {}
         self.card_system = card_system                          # 卡片系统
         self.standard_group_system = standard_group_system      # 常驻卡组管理系统
 
-        for filename in os.listdir(card_group_dir):
-            if filename.endswith(".json"):
-                filepath = os.path.join(card_group_dir, filename)
-                group = self.load_group_from_json(filepath)
-                self.card_groups[group.name] = group
+        for config in map_files(read_json, json_files(card_group_dir), executor):
+            group = self.load_group_from_config(config)
+            self.card_groups[group.name] = group
 
     def load_group_from_json(self, file: str) -> CardGroup:
         """
         从 json 文件中加载卡组
         """
-        with open(file, "r", encoding="utf-8") as f:
-            config = json.load(f)
+        return self.load_group_from_config(read_json(file))
 
+    def load_group_from_config(self, config: Dict) -> CardGroup:
+        """
+        从配置字典中加载卡组
+        """
         group = CardGroup(
             config["name"],
             self.standard_group_system.get_group(config[TAG_STANDARD]),     # 常驻卡组
@@ -286,34 +368,47 @@ class CardGroupSystem:
 class WishLogicSystem:
     """
     抽卡逻辑管理系统
+    executor: 并发读取配置文件的线程池, 为 None 时顺序读取
     """
-    def __init__(self, logic_config_dir: str) -> None:
+    def __init__(self, logic_config_dir: str, executor: Executor | None = None) -> None:
         self.dir = logic_config_dir
-        # 管理层级: 抽卡逻辑名称: 抽卡逻辑对象 (模板原型)
-        self.logics: Dict[str, WishLogic] = self.load_all_logics(logic_config_dir)
+        # 管理层级: 抽卡逻辑名称: 抽卡逻辑原型
+        self.logics: Dict[str, WishLogicPrototype] = self.load_all_logics(logic_config_dir, executor)
         
-    def load_all_logics(self, rule_config_dir: str) -> Dict[str, WishLogic]:
+    def load_all_logics(self, rule_config_dir: str, executor: Executor | None = None) -> Dict[str, WishLogicPrototype]:
         """
         从指定目录加载所有抽卡逻辑
         """
-        logics: Dict[str, WishLogic] = {}
-        for filename in os.listdir(rule_config_dir):
+        def read(file: str) -> Tuple[Dict | None, Exception | None]:
+            # 读取失败的文件与创建失败的逻辑一样只输出错误信息
             try:
-                if filename.endswith(".json"):
-                    logic = self.load_logic(os.path.join(rule_config_dir, filename))
-                    logics[logic.name] = logic
+                return read_json(file), None
             except Exception as e:
-                print(f"\033[31mWishRuleSystem: {filename} 加载失败: {e}\033[0m")
+                return None, e
+
+        logics: Dict[str, WishLogicPrototype] = {}
+        files = json_files(rule_config_dir)
+        for file, (config, error) in zip(files, map_files(read, files, executor)):
+            try:
+                if error is not None:
+                    raise error
+                logic = self.load_logic_from_config(config)     # type: ignore
+                logics[logic.name] = logic
+            except Exception as e:
+                print(f"\033[31mWishRuleSystem: {os.path.basename(file)} 加载失败: {e}\033[0m")
         
         return logics
     
-    def load_logic(self, rule_config_file: str) -> WishLogic:
+    def load_logic(self, rule_config_file: str) -> WishLogicPrototype:
         """
-        从 json 文件中加载抽卡逻辑
+        从 json 文件中加载抽卡逻辑原型
+        """
+        return self.load_logic_from_config(read_json(rule_config_file))
+
+    def load_logic_from_config(self, config: Dict) -> WishLogicPrototype:
+        """
+        从配置字典中加载抽卡逻辑原型
         """
-        with open(rule_config_file, "r", encoding="utf-8") as f:
-            config: Dict = json.load(f)
-        
         # 将字典中使用字符串表示的 star 键转换为整数的 star 键
         # for rule_config in config["rules"].values():
         #     for star_key in rule_config.keys():
@@ -334,15 +429,16 @@ class WishLogicSystem:
         #             config[key][int(star_key)] = config[key][star_key]
         #             del config[key][star_key]
         
-        return WishLogic(config)
+        return WishLogicPrototype(config)
     
     def get_logic(self, name: str) -> WishLogic:
         """
-        根据名称获取抽卡逻辑实例 (副本)
+        根据名称获取抽卡逻辑实例 (新的逻辑会话)
+        同名逻辑的所有会话共用一个原型, 各自持有独立的逻辑状态
         """
         if name not in self.logics:
             return WishLogic.none()
-        return self.logics[name]
+        return self.logics[name].new_logic()
 
     def get_logic_names(self) -> List[str]:
         """
@@ -354,24 +450,39 @@ class WishLogicSystem:
 class CardPoolSystem:
     """
     卡池管理系统
+    executor: 并发创建卡池 (包括读取配置文件和加载抽卡记录) 的线程池, 为 None 时顺序创建
     """
-    def __init__(self, card_pool_dir: str, card_group_system: CardGroupSystem, wish_logic_system: WishLogicSystem) -> None:
+    def __init__(
+            self,
+            card_pool_dir: str,
+            card_group_system: CardGroupSystem,
+            wish_logic_system: WishLogicSystem,
+            executor: Executor | None = None
+            ) -> None:
         self.card_pool_dir = card_pool_dir
         # 管理层级: 卡池名称: 卡池对象
         self.card_pool_group: dict[str, CardPool] = {}
         self.card_group_system = card_group_system
         self.wish_logic_system = wish_logic_system
 
-        for filename in os.listdir(self.card_pool_dir):
-            file = os.path.join(self.card_pool_dir, filename)
-            self.load_card_pool(file)
+        files = [os.path.join(self.card_pool_dir, filename) for filename in os.listdir(self.card_pool_dir)]
+        for card_pool in map_files(self.create_card_pool, files, executor):
+            self.card_pool_group[card_pool.name] = card_pool
     
     def load_card_pool(self, card_pool_config_file: str) -> CardPool:
         """
         从卡池配置文件中加载卡池
         """
-        with open(card_pool_config_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        card_pool = self.create_card_pool(card_pool_config_file)
+        self.card_pool_group[card_pool.name] = card_pool
+
+        return card_pool
+
+    def create_card_pool(self, card_pool_config_file: str) -> CardPool:
+        """
+        从卡池配置文件中创建卡池, 不加入卡池管理系统
+        """
+        data = read_json(card_pool_config_file)
         
         name = data["name"]
         card_group = self.card_group_system.get_group(data["card_group"])
@@ -380,8 +491,23 @@ class CardPoolSystem:
         logic_state = data["logic_state"]
         logic.load_state(logic_state)       # 加载抽卡逻辑状态
 
-        card_pool = CardPool(name, logic, card_group, data["recorder_dir"])
-        self.card_pool_group[name] = card_pool
+        # 可选的随机数后端配置: {"backend": 后端名称, "seed": 种子}
+        rng = make_rng(**data["rng"]) if "rng" in data else None
+
+        # 可选的记录日志后端和持久化模式, 见 RecordLog 和 WishRecorder
+        record_backend = data.get("record_backend", CsvRecordLog.name)
+        record_durability = data.get("record_durability", RECORD_DURABILITY_NONE)
+        # 可选的 details 日志分段配置: {"size": 字节数, "records": 记录数, "compression": 压缩方式}
+        record_segments = data.get("record_segments")
+
+        card_pool = CardPool(
+            name, logic, card_group, data["recorder_dir"], rng=rng,
+            record_backend=record_backend, record_durability=record_durability, record_segments=record_segments
+        )
+
+        # 可选的后台记录写入配置: {"flush_count": 缓存记录数, "flush_interval": 刷新间隔秒数}
+        if "record_writer" in data:
+            card_pool.recorder.start_writer(**data["record_writer"])
 
         return card_pool
     
@@ -400,6 +526,16 @@ class CardPoolSystem:
             "recorder_dir": card_pool.recorder.dir,
             "logic_state": card_pool.get_logic_state()
         }
+        if not isinstance(card_pool.rng, GlobalRandomBackend):
+            data["rng"] = card_pool.rng.config()
+        if card_pool.recorder.log.name != CsvRecordLog.name:
+            data["record_backend"] = card_pool.recorder.log.name
+        if card_pool.recorder.durability != RECORD_DURABILITY_NONE:
+            data["record_durability"] = card_pool.recorder.durability
+        if card_pool.recorder.log.segment_config() is not None:
+            data["record_segments"] = card_pool.recorder.log.segment_config()
+        if card_pool.recorder.writer is not None:
+            data["record_writer"] = card_pool.recorder.writer.config()
 
         with open(file, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=4, ensure_ascii=False)
@@ -425,4 +561,33 @@ class CardPoolSystem:
         获取所有卡池名称
         """
         return list(self.card_pool_group.keys())
-    
\ No newline at end of file
+    
+
+def load_systems(
+        cards_dir: str,
+        cards_dir_config: Dict[str, Dict[str, Sequence[int]]],
+        standard_group_dir: str,
+        card_group_dir: str,
+        logic_config_dir: str,
+        card_pool_dir: str,
+        workers: int = LOAD_WORKERS
+        ) -> Tuple[CardSystem, StandardGroupSystem, CardGroupSystem, WishLogicSystem, CardPoolSystem]:
+    """
+    按依赖顺序创建所有管理系统: 卡片 -> 常驻卡组 -> 卡组 -> 抽卡逻辑 -> 卡池
+    workers 为线程池的线程数, 为 1 时顺序加载
+    """
+    if workers <= 0:
+        raise ValueError(f"Invalid load workers: {workers}")
+
+    def load(executor: Executor | None):
+        card_system = CardSystem(cards_dir, cards_dir_config, executor=executor)
+        standard_group_system = StandardGroupSystem(standard_group_dir, card_system, executor)
+        card_group_system = CardGroupSystem(card_group_dir, card_system, standard_group_system, executor)
+        wish_logic_system = WishLogicSystem(logic_config_dir, executor)
+        card_pool_system = CardPoolSystem(card_pool_dir, card_group_system, wish_logic_system, executor)
+        return card_system, standard_group_system, card_group_system, wish_logic_system, card_pool_system
+
+    if workers == 1:
+        return load(None)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Load") as executor:
+        return load(executor)
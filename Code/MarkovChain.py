@@ -0,0 +1,765 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    MarkovChain
+
+Description
+_
+    Wishes 抽卡逻辑解析模块
+    将抽卡逻辑配置编译为以规则状态为节点的马尔可夫链, 精确计算各类抽数分布
+    链的状态由 星级计数器、目标星级的 UP 计数器、捕获保底计数器 和 Appoint 计数器 组成
+    *只有影响星级判定的计数器，以及目标星级的标签相关计数器会进入状态，其余状态不影响分析结果
+    *保底或概率增长规则用到、但不在 StarCounterRule.star_list 中的星级, 计数器以 -1 表示尚未计数, 与逻辑会话相同
+    *目标星级没有 UP 保底时, UP 计数器不影响分析结果, 不进入状态
+"""
+
+
+from Const import *
+from Base import *
+from WishRule import *
+from dataclasses import dataclass
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple, Type, Optional
+
+
+@dataclass(frozen=True)
+class ChainOutcome:
+    """
+    单抽结果
+    """
+    star: int               # 星级
+    tag: int                # real_tag 编码 (TAG_CODES 的下标)
+    appoint_card: bool      # 抽出的卡片是否属于 Appoint 组
+
+
+class ChainBranch:
+    """
+    单抽执行过程中的概率分支
+    """
+    __slots__ = ("p", "state", "star", "up", "fes", "appoint", "appoint_card", "up_pity", "weights")
+
+    def __init__(self, p: float, state: List[int]) -> None:
+        self.p = p
+        self.state = state
+        self.star = 0
+        self.up = False
+        self.fes = False
+        self.appoint = False
+        self.appoint_card = False
+        self.up_pity = False                            # 目标星级本抽是否触发 UP 保底
+        self.weights: Optional[Dict[int, int]] = None   # 本抽被修改后的星级概率权重
+
+    def split(self, q: float) -> "ChainBranch":
+        """
+        以条件概率 q 复制出新分支
+        """
+        branch = ChainBranch(self.p * q, list(self.state))
+        branch.star = self.star
+        branch.up = self.up
+        branch.fes = self.fes
+        branch.appoint = self.appoint
+        branch.appoint_card = self.appoint_card
+        branch.up_pity = self.up_pity
+        branch.weights = dict(self.weights) if self.weights is not None else None
+        return branch
+
+    def decide(self, star: int):
+        """
+        重新决定星级, 等价于创建新的 LogicResult
+        """
+        self.star = star
+        self.up = False
+        self.fes = False
+        self.appoint = False
+
+    def outcome(self) -> ChainOutcome:
+        if self.appoint:
+            tag = TAG_APPOINT
+        elif self.fes:
+            tag = TAG_FES
+        elif self.up:
+            tag = TAG_UP
+        else:
+            tag = TAG_STANDARD
+        return ChainOutcome(self.star, TAG_CODES.index(tag), self.appoint_card)
+
+
+def _bernoulli(weight: int) -> float:
+    """
+    与 random.choices((True, False), (weight, MAX_PROBABILITY - weight)) 等价的概率
+    """
+    return min(max(weight / MAX_PROBABILITY, 0.0), 1.0)
+
+
+def _split(branch: ChainBranch, q: float) -> Tuple[Optional[ChainBranch], Optional[ChainBranch]]:
+    """
+    按概率 q 将分支拆分为 (命中, 未命中) 两个分支, 概率为 0 的分支为 None
+    """
+    hit = branch.split(q) if q > 0 else None
+    miss = branch.split(1 - q) if q < 1 else None
+    return hit, miss
+
+
+class ChainContext:
+    """
+    马尔可夫链编译上下文
+    负责分配状态槽位
+    """
+    def __init__(self, target_star: int, counted_stars: set[int], base_weights: Dict[int, int], logic_ctx: RuleContext) -> None:
+        self.target_star = target_star          # 分析的目标星级
+        self.counted_stars = counted_stars      # 影响星级判定的计数星级
+        self.base_weights = base_weights        # StarProbabilityRule 的基础概率权重
+        self.logic_ctx = logic_ctx              # 已加载初始状态的逻辑会话上下文, 链规则从中读取初始计数
+
+        self.slots: Dict[Tuple[str, int], int] = {}     # (规则 tag, 星级) -> 状态槽位
+        self.initial: List[int] = []                    # 各槽位初始值
+        self.rule_bridge: Dict[str, ChainRule] = {}
+
+    def add_slot(self, tag: str, star: int, value: int) -> int:
+        """
+        分配状态槽位, 返回槽位下标
+        """
+        self.slots[(tag, star)] = len(self.initial)
+        self.initial.append(int(value))
+        return self.slots[(tag, star)]
+
+    def counter_slot(self, star: int) -> Optional[int]:
+        """
+        获取星级计数器槽位, 未统计的星级返回 None
+        """
+        return self.slots.get((StarCounterRule.tag, star))
+
+    def counter(self, state: List[int], star: int) -> int:
+        """
+        读取星级计数器, 尚未计数 (-1) 或未统计的星级视为 0
+        """
+        slot = self.counter_slot(star)
+        return max(state[slot], 0) if slot is not None else 0
+
+
+class ChainRule:
+    """
+    链规则基类
+    apply 和 callback 接收一个分支, 返回拆分后的分支列表, 默认不操作
+    """
+    tag: str = "BaseRule"
+
+    def __init__(self, rule: BaseRule, ctx: ChainContext) -> None:
+        pass
+
+    def set_bridge(self, ctx: ChainContext):
+        ctx.rule_bridge[self.tag] = self
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        return [branch]
+
+    def callback(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        return [branch]
+
+
+class ChainStarCounterRule(ChainRule):
+    tag: str = StarCounterRule.tag
+
+    def __init__(self, rule: StarCounterRule, ctx: ChainContext) -> None:
+        # 直接读取槽位, 保留尚未计数的 -1 (read_state 不读取负数槽位)
+        state = ctx.logic_ctx.state
+        self.slots: Dict[int, int] = {
+            star: ctx.add_slot(self.tag, star, state[slot])
+            for star, slot in rule.star_slots.items()
+            if star in ctx.counted_stars
+        }
+
+    def callback(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        for star, slot in self.slots.items():
+            if branch.star == star:
+                branch.state[slot] = 0
+            elif branch.state[slot] >= 0:
+                branch.state[slot] += 1
+        return [branch]
+
+
+class ChainStarPityRule(ChainRule):
+    tag: str = StarPityRule.tag
+
+    def __init__(self, rule: StarPityRule, ctx: ChainContext) -> None:
+        self.star_pity = dict(rule.star_pity)
+        self.reset_lower_pity = rule.reset_lower_pity
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        for star, threshold in self.star_pity.items():
+            if ctx.counter(branch.state, star) + 1 >= threshold:
+                branch.decide(star)
+                slot = ctx.counter_slot(star)
+                if slot is not None:
+                    branch.state[slot] = 0
+                break
+        return [branch]
+
+    def callback(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        if self.reset_lower_pity:
+            for (tag, star), slot in ctx.slots.items():
+                if tag == StarCounterRule.tag and star < branch.star and branch.state[slot] >= 0:
+                    branch.state[slot] = 0
+        return [branch]
+
+
+class ChainStarProbabilityRule(ChainRule):
+    tag: str = StarProbabilityRule.tag
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        if branch.star:
+            return [branch]
+
+        weights = branch.weights if branch.weights is not None else ctx.base_weights
+        total = sum(weights.values())
+        branches = []
+        for star, weight in weights.items():
+            if weight <= 0:
+                continue
+            new_branch = branch.split(weight / total)
+            new_branch.decide(star)
+            branches.append(new_branch)
+        return branches
+
+
+def _normalize_weights(weights: Dict[int, int]):
+    """
+    对概率权重进行归一化处理，与 StarProbabilityIncreaseRule 中的处理一致
+    """
+    total = 0
+    for star, probability in weights.items():
+        p = max(min(MAX_PROBABILITY - total, probability), 0)
+        total += p
+        weights[star] = p
+
+
+class ChainStarProbabilityIncreaseRule(ChainRule):
+    tag: str = StarProbabilityIncreaseRule.tag
+
+    def __init__(self, rule: StarProbabilityIncreaseRule, ctx: ChainContext) -> None:
+        self.star_increase = dict(rule.star_increase)
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        weights = dict(branch.weights if branch.weights is not None else ctx.base_weights)
+        for star, (start, increment) in self.star_increase.items():
+            counter = ctx.counter(branch.state, star) + 1
+            if counter >= start:
+                weights[star] += (counter - start + 1) * increment
+        _normalize_weights(weights)
+        branch.weights = weights
+        return [branch]
+
+
+class ChainStarProbabilityIntervalIncreaseRule(ChainRule):
+    tag: str = StarProbabilityIntervalIncreaseRule.tag
+
+    def __init__(self, rule: StarProbabilityIntervalIncreaseRule, ctx: ChainContext) -> None:
+        self.star_increase = {star: list(intervals) for star, intervals in rule.star_increase.items()}
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        weights = dict(branch.weights if branch.weights is not None else ctx.base_weights)
+        for star, intervals in self.star_increase.items():
+            counter = ctx.counter(branch.state, star) + 1
+            for start, increment in intervals:
+                if counter < start:
+                    break
+                weights[star] += (counter - start + 1) * increment
+        _normalize_weights(weights)
+        branch.weights = weights
+        return [branch]
+
+
+class ChainUpRule(ChainRule):
+    tag: str = UpRule.tag
+
+    def __init__(self, rule: UpRule, ctx: ChainContext) -> None:
+        star = ctx.target_star
+        self.up_weight = rule.up_probability.get(star)
+        self.up_pity = rule.up_pity.get(star)
+        # 只有 UP 保底读取计数器, 计数器达到 up_pity 后必定在下一次抽出目标星级时重置, 状态数有界
+        self.slot = None
+        if self.up_weight is not None and self.up_pity is not None:
+            counter = rule.read_state(ctx.logic_ctx, "up_counter")[star]
+            self.slot = ctx.add_slot(self.tag, star, min(counter, self.up_pity))
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        branch.up_pity = False
+        if self.up_weight is None or branch.star != ctx.target_star:
+            return [branch]
+
+        if self.slot is not None and branch.state[self.slot] >= self.up_pity:   # type: ignore  # 触发 UP 保底
+            branch.up = True
+            branch.up_pity = True
+            branch.state[self.slot] = 0
+            return [branch]
+
+        if branch.up:   # 已被其他规则判定为 UP, 随机结果不影响判定
+            if self.slot is not None:
+                branch.state[self.slot] = 0
+            return [branch]
+
+        hit, miss = _split(branch, _bernoulli(self.up_weight))
+        if hit:
+            hit.up = True
+            if self.slot is not None:
+                hit.state[self.slot] = 0
+        if miss and self.slot is not None:
+            miss.state[self.slot] += 1
+        return [b for b in (hit, miss) if b]
+
+
+class ChainFesRule(ChainRule):
+    tag: str = FesRule.tag
+
+    def __init__(self, rule: FesRule, ctx: ChainContext) -> None:
+        self.fes_weight = rule.fes_probability.get(ctx.target_star)
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        if self.fes_weight is None or branch.star != ctx.target_star or not branch.up:
+            return [branch]
+
+        hit, miss = _split(branch, _bernoulli(self.fes_weight))
+        if hit:
+            hit.fes = True
+        return [b for b in (hit, miss) if b]
+
+
+class ChainAppointRule(ChainRule):
+    tag: str = AppointRule.tag
+
+    def __init__(self, rule: AppointRule, ctx: ChainContext) -> None:
+        star = ctx.target_star
+        self.appoint_pity = rule.appoint_pity.get(star)
+        self.slot = ctx.add_slot(self.tag, star, rule.read_state(ctx.logic_ctx, "appoint_counter")[star]) if self.appoint_pity is not None else None
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        if self.slot is None or branch.star != ctx.target_star or not branch.up:
+            return [branch]
+
+        if branch.state[self.slot] >= self.appoint_pity:   # type: ignore
+            branch.appoint = True
+            branch.state[self.slot] = 0
+        else:
+            branch.state[self.slot] += 1
+        return [branch]
+
+    def callback(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        if self.slot is not None and branch.star == ctx.target_star and branch.appoint_card:
+            branch.state[self.slot] = 0
+        return [branch]
+
+
+class ChainCaptureRule(ChainRule):
+    tag: str = CaptureRule.tag
+
+    def __init__(self, rule: CaptureRule, ctx: ChainContext) -> None:
+        self.capture_weight = rule.capture_probability.get(ctx.target_star)
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        if self.capture_weight is None or branch.star != ctx.target_star or branch.up:
+            return [branch]
+
+        hit, miss = _split(branch, _bernoulli(self.capture_weight))
+        if hit:
+            hit.up = True
+        return [b for b in (hit, miss) if b]
+
+
+class ChainCapturePityRule(ChainRule):
+    tag: str = CapturePityRule.tag
+
+    def __init__(self, rule: CapturePityRule, ctx: ChainContext) -> None:
+        star = ctx.target_star
+        self.capture_pity = rule.capture_pity.get(star)
+        self.slot = ctx.add_slot(self.tag, star, rule.read_state(ctx.logic_ctx, "capture_pity_counter")[star]) if self.capture_pity is not None else None
+
+    def apply(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        if self.slot is None or branch.star != ctx.target_star:
+            return [branch]
+
+        if branch.state[self.slot] >= self.capture_pity:   # type: ignore
+            branch.up = True
+            branch.state[self.slot] = 0
+        return [branch]
+
+    def callback(self, ctx: ChainContext, branch: ChainBranch) -> List[ChainBranch]:
+        if self.slot is None or branch.star != ctx.target_star or not branch.up:
+            return [branch]
+
+        up_rule: ChainUpRule | None = ctx.rule_bridge.get(UpRule.tag)    # type: ignore
+        if up_rule is None or up_rule.up_pity is None:
+            return [branch]
+
+        if branch.up_pity:
+            branch.state[self.slot] += 1
+        else:
+            branch.state[self.slot] = 0
+        return [branch]
+
+
+def tag_to_chain_rule_class(rule_tag: str) -> Type[ChainRule]:
+    match rule_tag:
+        case StarCounterRule.tag:
+            return ChainStarCounterRule
+        case StarPityRule.tag:
+            return ChainStarPityRule
+        case StarProbabilityRule.tag:
+            return ChainStarProbabilityRule
+        case StarProbabilityIncreaseRule.tag:
+            return ChainStarProbabilityIncreaseRule
+        case StarProbabilityIntervalIncreaseRule.tag:
+            return ChainStarProbabilityIntervalIncreaseRule
+        case UpRule.tag:
+            return ChainUpRule
+        case FesRule.tag:
+            return ChainFesRule
+        case AppointRule.tag:
+            return ChainAppointRule
+        case CaptureRule.tag:
+            return ChainCaptureRule
+        case CapturePityRule.tag:
+            return ChainCapturePityRule
+        case TypeStarCounterRule.tag | TypeStarProbabilityRule.tag | TypeStarPityRule.tag | UpTypeRule.tag:
+            return ChainRule    # 类型相关规则不影响星级与标签
+        case _:
+            raise ValueError(f"MarkovChain: 不支持的规则 <{rule_tag}>")
+
+
+class PassageDistribution:
+    """
+    首达抽数分布
+    pmf[n - 1] 为恰好在第 n 抽首次命中的概率
+    tail 为计算上限内仍未命中的概率
+    """
+    def __init__(self, pmf: List[float], tail: float) -> None:
+        self.pmf = pmf
+        self.tail = tail
+        self._cdf: List[float] | None = None    # 累积分布, 首次查询时计算
+
+    def __len__(self) -> int:
+        return len(self.pmf)
+
+    def _cumulative(self) -> List[float]:
+        if self._cdf is None:
+            cdf = []
+            total = 0.0
+            for p in self.pmf:
+                total += p
+                cdf.append(total)
+            self._cdf = cdf
+        return self._cdf
+
+    def probability(self, draws: int) -> float:
+        """
+        draws 抽以内命中的概率
+        """
+        cdf = self._cumulative()
+        if draws <= 0 or not cdf:
+            return 0.0
+        return cdf[min(draws, len(cdf)) - 1]
+
+    def cdf(self) -> List[float]:
+        return list(self._cumulative())
+
+    def mean(self) -> float:
+        """
+        期望抽数, 仅在 tail 可忽略时有意义
+        """
+        return sum((n + 1) * p for n, p in enumerate(self.pmf))
+
+    def percentile(self, q: float) -> int:
+        """
+        命中概率达到 q 所需的最少抽数, 若计算上限内无法达到则返回 -1
+        """
+        total = 0.0
+        for n, p in enumerate(self.pmf):
+            total += p
+            if total >= q - 1e-12:
+                return n + 1
+        return -1
+
+
+class MarkovChain:
+    """
+    抽卡逻辑马尔可夫链
+    以抽卡逻辑配置 (与 WishLogicSystem.load_logic 读取的 json 相同) 构造
+    状态转移按需计算并缓存, 从同一状态出发的分析可共享缓存
+    """
+    def __init__(
+            self,
+            config: Dict,
+            star: int | None = None,
+            state: Dict | None = None,
+            appoint_share: Dict[int, float] | None = None
+            ) -> None:
+        """
+        star: 分析的目标星级, 默认为 StarProbabilityRule 中的最高星级
+        state: 初始逻辑状态, 格式与 CardPool.get_logic_state 相同
+        appoint_share: 各星级非定轨 UP 卡片恰好为 Appoint 卡片的概率, 可由 CardGroup.appoint_share 计算
+        """
+        self.config = config
+        self.appoint_share = appoint_share if appoint_share else {}
+
+        # 原型只构建一次, 每次编码状态时创建新的逻辑会话
+        self.prototype = WishLogicPrototype(config)
+        probability_rule = next((rule for rule in self.prototype.rules if isinstance(rule, StarProbabilityRule)), None)
+        if probability_rule is None:
+            raise ValueError("MarkovChain: 抽卡逻辑缺少 StarProbabilityRule")
+        self.base_weights: Dict[int, int] = dict(probability_rule.base_probability)
+        self.target_star = star if star is not None else max(self.base_weights.keys())
+
+        # 只有被保底或概率增长规则读取的星级计数器影响星级判定
+        self.counted_stars: set[int] = set()
+        for rule in self.prototype.rules:
+            if isinstance(rule, StarPityRule):
+                self.counted_stars.update(rule.star_pity.keys())
+            elif isinstance(rule, (StarProbabilityIncreaseRule, StarProbabilityIntervalIncreaseRule)):
+                self.counted_stars.update(rule.star_increase.keys())
+
+        self.ctx, self.rules = self._build(state)
+        self.initial_state: Tuple[int, ...] = tuple(self.ctx.initial)
+        self._transitions: Dict[Tuple[int, ...], List[Tuple[float, ChainOutcome, Tuple[int, ...]]]] = {}
+
+    def _build(self, state: Dict | None) -> Tuple[ChainContext, List[ChainRule]]:
+        logic = self.prototype.new_logic(state=state)
+
+        ctx = ChainContext(self.target_star, self.counted_stars, self.base_weights, logic.ctx)
+        rules = [tag_to_chain_rule_class(rule.tag)(rule, ctx) for rule in logic.rules]  # type: ignore
+        for rule in rules:
+            rule.set_bridge(ctx)
+        return ctx, rules
+
+    def encode_state(self, state: Dict) -> Tuple[int, ...]:
+        """
+        将逻辑状态字典转换为链状态
+        """
+        ctx, _ = self._build(state)
+        return tuple(ctx.initial)
+
+    def decode_state(self, chain_state: Tuple[int, ...]) -> Dict[Tuple[str, int], int]:
+        """
+        将链状态转换为 (规则 tag, 星级) -> 计数值 字典
+        """
+        return {key: chain_state[slot] for key, slot in self.ctx.slots.items()}
+
+    def transitions(self, chain_state: Tuple[int, ...]) -> List[Tuple[float, ChainOutcome, Tuple[int, ...]]]:
+        """
+        返回从 chain_state 出发抽一次的所有 (概率, 结果, 下一状态)
+        """
+        if chain_state in self._transitions:
+            return self._transitions[chain_state]
+
+        ctx = self.ctx
+        branches = [ChainBranch(1.0, list(chain_state))]
+        for rule in self.rules:
+            branches = [new_branch for branch in branches for new_branch in rule.apply(ctx, branch)]
+
+        branches = [new_branch for branch in branches for new_branch in self._resolve_card(branch)]
+
+        for rule in self.rules:
+            branches = [new_branch for branch in branches for new_branch in rule.callback(ctx, branch)]
+
+        merged: Dict[Tuple[ChainOutcome, Tuple[int, ...]], float] = defaultdict(float)
+        for branch in branches:
+            merged[(branch.outcome(), tuple(branch.state))] += branch.p
+
+        result = [(p, outcome, next_state) for (outcome, next_state), p in merged.items()]
+        self._transitions[chain_state] = result
+        return result
+
+    def _resolve_card(self, branch: ChainBranch) -> List[ChainBranch]:
+        """
+        模拟卡组抽卡: 定轨结果必定为 Appoint 卡片, 非定轨的 UP 卡片按比例可能恰好为 Appoint 卡片
+        """
+        if branch.appoint:
+            branch.appoint_card = True
+            return [branch]
+
+        share = self.appoint_share.get(branch.star, 0.0)
+        if not share or not (branch.up or branch.fes):
+            return [branch]
+
+        hit, miss = _split(branch, share)
+        if hit:
+            hit.appoint_card = True
+        return [b for b in (hit, miss) if b]
+
+    def first_passage(
+            self,
+            hit: Callable[[ChainOutcome], bool],
+            chain_state: Tuple[int, ...] | None = None,
+            limit: int = 10000,
+            tolerance: float = 1e-12
+            ) -> PassageDistribution:
+        """
+        计算从 chain_state 出发, 首次抽出满足 hit 的结果所需抽数的分布
+        当未命中概率低于 tolerance 或达到 limit 抽时停止
+        """
+        distribution: Dict[Tuple[int, ...], float] = {chain_state if chain_state is not None else self.initial_state: 1.0}
+        pmf: List[float] = []
+        remaining = 1.0
+
+        while distribution and remaining > tolerance and len(pmf) < limit:
+            next_distribution: Dict[Tuple[int, ...], float] = defaultdict(float)
+            p_hit = 0.0
+            for current, p in distribution.items():
+                for q, outcome, next_state in self.transitions(current):
+                    if hit(outcome):
+                        p_hit += p * q
+                    else:
+                        next_distribution[next_state] += p * q
+            pmf.append(p_hit)
+            distribution = next_distribution
+            remaining = sum(distribution.values())
+
+        return PassageDistribution(pmf, max(remaining, 0.0))
+
+    def _hit_transitions(self, hit: Callable[[ChainOutcome], bool], chain_state: Tuple[int, ...]) -> List[Tuple[float, Tuple[int, ...], bool]]:
+        """
+        按 (下一状态, 是否命中) 合并后的状态转移
+        """
+        merged: Dict[Tuple[Tuple[int, ...], bool], float] = defaultdict(float)
+        for q, outcome, next_state in self.transitions(chain_state):
+            merged[(next_state, hit(outcome))] += q
+        return [(q, next_state, is_hit) for (next_state, is_hit), q in merged.items()]
+
+    def passage_counts(
+            self,
+            hit: Callable[[ChainOutcome], bool],
+            copies: int,
+            chain_state: Tuple[int, ...] | None = None,
+            limit: int = 10000,
+            tolerance: float = 1e-12
+            ) -> List[PassageDistribution]:
+        """
+        计算从 chain_state 出发, 第 1 ~ copies 次抽出满足 hit 的结果所需抽数的分布
+        以 (链状态, 已命中次数) 为节点逐抽递推, 命中 copies 次的概率质量不再继续递推
+        当第 copies 次仍未命中的概率低于 tolerance 或达到 limit 抽时停止
+        *链状态按到达顺序编号, 每抽只展开新到达状态的转移, 各已命中次数的递推以 numpy 稀疏转移 (bincount) 完成
+        *概率质量已全部转移的已命中次数不再递推, 硬保底下 k 个目标的计算量约为 k 个目标首达计算之和
+        """
+        import numpy as np
+
+        if copies <= 0:
+            return []
+
+        start = chain_state if chain_state is not None else self.initial_state
+        index: Dict[Tuple[int, ...], int] = {start: 0}     # 链状态 -> 编号
+        states: List[Tuple[int, ...]] = [start]
+        expanded = 0    # 已展开转移的状态数
+        # 未命中 / 命中的转移: 起点编号, 终点编号, 概率
+        sources = [np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)]
+        targets = [np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)]
+        weights = [np.zeros(0), np.zeros(0)]
+
+        # masses[j, i]: 已命中 j 次、位于第 i 个链状态的概率
+        masses = np.zeros((copies, 1))
+        masses[0, 0] = 1.0
+        low = 0     # 更少命中次数的概率质量已全部转移
+        pmfs: List[List[float]] = [[] for _ in range(copies)]
+        remaining = 1.0
+
+        while remaining > tolerance and len(pmfs[0]) < limit:
+            if expanded < len(states):
+                frontier = states[expanded:]
+                expanded = len(states)
+                edges: Tuple[List, List] = ([], [])
+                for current in frontier:
+                    source = index[current]
+                    for q, next_state, is_hit in self._hit_transitions(hit, current):
+                        if is_hit and copies == 1:
+                            edges[1].append((source, 0, q))     # 只命中一次时无需展开命中后的状态
+                            continue
+                        target = index.get(next_state)
+                        if target is None:
+                            target = index[next_state] = len(states)
+                            states.append(next_state)
+                        edges[is_hit].append((source, target, q))
+                for is_hit, new_edges in enumerate(edges):
+                    if new_edges:
+                        source, target, q = zip(*new_edges)
+                        sources[is_hit] = np.concatenate((sources[is_hit], np.array(source, dtype=np.intp)))
+                        targets[is_hit] = np.concatenate((targets[is_hit], np.array(target, dtype=np.intp)))
+                        weights[is_hit] = np.concatenate((weights[is_hit], np.array(q)))
+                masses = np.concatenate((masses, np.zeros((copies, len(states) - masses.shape[1]))), axis=1)
+
+            while low < copies - 1 and not masses[low].any():
+                low += 1
+            # 第 n 抽时最多已命中 n - 1 次
+            high = min(copies, len(pmfs[0]) + 1)
+            size = len(states)
+            next_masses = np.zeros((copies, size))
+            p_hits = [0.0] * copies
+            for j in range(low, high):
+                moved = masses[j][sources[0]] * weights[0]
+                next_masses[j] += np.bincount(targets[0], weights=moved, minlength=size)
+                moved = masses[j][sources[1]] * weights[1]
+                p_hits[j] = float(moved.sum())
+                if j + 1 < copies:
+                    next_masses[j + 1] += np.bincount(targets[1], weights=moved, minlength=size)
+            for pmf, p_hit in zip(pmfs, p_hits):
+                pmf.append(p_hit)
+            masses = next_masses
+            remaining = float(masses.sum())
+
+        return [PassageDistribution(pmf, max(1.0 - sum(pmf), 0.0)) for pmf in pmfs]
+
+    def goal_hit(self, goal: str) -> Optional[Callable[[ChainOutcome], bool]]:
+        """
+        目标对应的命中判定, 无法达成的目标返回 None
+        goal: GOAL_STAR (目标星级), GOAL_UP (目标星级 UP 卡片, 包括 Fes 和 Appoint), GOAL_APPOINT (目标星级 Appoint 卡片)
+        """
+        star = self.target_star
+        match goal:
+            case "star":
+                return lambda outcome: outcome.star == star
+            case "up":
+                if not any(tag in self.ctx.rule_bridge for tag in (UpRule.tag, CaptureRule.tag, CapturePityRule.tag)):
+                    return None     # 无法抽出 UP 卡片
+                up_code = TAG_CODES.index(TAG_UP)
+                return lambda outcome: outcome.star == star and outcome.tag >= up_code
+            case "appoint":
+                if AppointRule.tag not in self.ctx.rule_bridge and not self.appoint_share.get(star):
+                    return None     # 无法抽出 Appoint 卡片
+                return lambda outcome: outcome.star == star and outcome.appoint_card
+            case _:
+                raise ValueError(f"MarkovChain: 未知的目标 <{goal}>")
+
+    def draws_until_goal(self, goal: str, chain_state: Tuple[int, ...] | None = None) -> PassageDistribution:
+        """
+        距离下一次达成目标的抽数分布
+        """
+        hit = self.goal_hit(goal)
+        if hit is None:
+            return PassageDistribution([], 1.0)
+        return self.first_passage(hit, chain_state)
+
+    def draws_until_copies(self, goal: str, copies: int, chain_state: Tuple[int, ...] | None = None) -> List[PassageDistribution]:
+        """
+        达成目标 1 ~ copies 次所需的抽数分布
+        """
+        hit = self.goal_hit(goal)
+        if hit is None:
+            return [PassageDistribution([], 1.0) for _ in range(copies)]
+        return self.passage_counts(hit, copies, chain_state)
+
+    def draws_until_star(self, chain_state: Tuple[int, ...] | None = None) -> PassageDistribution:
+        """
+        距离下一次抽出目标星级的抽数分布
+        """
+        return self.draws_until_goal(GOAL_STAR, chain_state)
+
+    def draws_until_up(self, chain_state: Tuple[int, ...] | None = None) -> PassageDistribution:
+        """
+        距离下一次抽出目标星级 UP 卡片 (包括 Fes 和 Appoint) 的抽数分布
+        """
+        return self.draws_until_goal(GOAL_UP, chain_state)
+
+    def draws_until_appoint(self, chain_state: Tuple[int, ...] | None = None) -> PassageDistribution:
+        """
+        距离下一次抽出目标星级 Appoint 卡片的抽数分布
+        """
+        return self.draws_until_goal(GOAL_APPOINT, chain_state)
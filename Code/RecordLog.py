@@ -0,0 +1,1164 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    RecordLog
+
+Description
+_
+    Wishes 抽卡记录日志模块
+    WishRecorder 通过记录日志后端写入 details 和 interval 记录
+    支持的后端:
+        csv         文本记录 details.csv / interval.csv (默认)
+        binary      二进制追加日志 details.bin / interval.bin, 定长 struct 记录, 可通过 mmap 读取
+        sqlite      SQLite 数据库, 所有卡池共用记录目录上级目录中的 records.db, 见 SqliteRecordLog
+    二进制日志:
+        每个日志文件以 8 字节文件头开始: 魔数 (4 字节)、格式版本 (uint16)、单条记录字节数 (uint16)
+        details 记录: 累计抽数 (uint32)、时间戳秒数 (uint32)、卡片编号 (uint32)、标签编码 (uint8)
+        interval 记录: 间隔抽数 (uint32)、卡片编号 (uint32)、标签编码 (uint8)
+        卡片编号是记录目录内的字符串字典 records.dict 中的行号, 每行为一个卡片的 [游戏, 类型, 星级, 卡片名称]
+        字典同样只追加, 因此编号在不同运行之间保持稳定 (与 CardRegistry 的编号无关)
+        标签编码为 TAG_CODES 中的下标
+    崩溃恢复:
+        details 日志同时作为预写日志 (WAL), WishRecorder 的 profile 检查点记录了写入时各日志文件的长度 (日志位置)
+        加载时只需重放检查点之后的 details 记录, 并按重放结果重建 interval 日志的尾部
+        末尾未写完整的记录会被截断
+    查询:
+        iter_details 按块读取 details 记录, 供 RecordQuery 建立稀疏索引和查询
+    分段:
+        文件日志后端可按大小或记录数轮换 details 日志, 见 FileRecordLog.configure_segments (默认不轮换)
+        轮换时将当前 details 日志整体压缩 (gzip 或 lzma) 为记录目录下 segments 目录中的封存分段, 再清空当前日志
+        封存分段的解压内容与轮换前的日志文件完全相同, 日志位置在分段内保持不变
+        分段清单 segments.json 按顺序记录每个分段的文件名、压缩方式、记录数、累计抽数范围、时间范围、
+            星级和实际标签位掩码、原始和压缩后的字节数, 查询和导出时跳过不可能包含匹配记录的分段
+        日志位置额外记录检查点时的封存分段数 "segments", 检查点之后封存的分段在恢复时同样会被重放
+        interval 日志只记录最高星级, 不参与轮换
+        二进制后端的字典 records.dict 包含所有抽到过的卡片 (每条 details 记录都引用它), 同样不参与轮换,
+            因为封存分段中的记录仍引用其中的编号
+    SQLite 数据库:
+        以 WAL 模式运行, 每次写入在一个事务中批量插入 details 和 interval 记录, 并增量更新计数器和卡池信息
+        表结构:
+            pools       卡池 -> 缓存大小, 总抽数, 最高星级间隔抽数, 在线统计 (json)
+            details     (卡池, 累计抽数) -> 时间戳秒数, 实际标签, 游戏, 类型, 星级, 卡片名称
+            intervals   卡池, 间隔抽数, 实际标签, 游戏, 类型, 星级, 卡片名称
+            counters    (卡池, 实际标签, 类型, 星级) -> 抽卡次数, 由 details 的写入增量维护
+        details 在 (卡池, 星级)、(卡池, 实际标签) 和 时间戳 上建有索引
+        事务保证记录与计数器一致, 因此不需要 profile.json 和崩溃恢复
+"""
+
+
+from Const import *
+from Base import *
+from abc import abstractmethod, ABC
+from dataclasses import dataclass
+from typing import IO, Iterator, List, Sequence, Tuple, Type
+import datetime as dt
+import gzip
+import json
+import lzma
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+
+
+# 二进制日志文件头: 魔数, 格式版本, 单条记录字节数
+SEGMENT_HEADER = struct.Struct("<4sHH")
+SEGMENT_VERSION = 1
+DETAIL_MAGIC = b"WRDT"
+INTERVAL_MAGIC = b"WRIV"
+DETAIL_RECORD = struct.Struct("<IIIB")      # 累计抽数, 时间戳秒数, 卡片编号, 标签编码
+INTERVAL_RECORD = struct.Struct("<IIB")     # 间隔抽数, 卡片编号, 标签编码
+
+# 崩溃恢复时重放的记录: (累计抽数, 实际标签, 游戏, 类型, 星级, 卡片名称)
+ReplayRow = Tuple[int, str, str, str, int, str]
+
+
+# 封存分段的压缩方式 -> 文件扩展名
+SEGMENT_EXTENSIONS = {RECORD_COMPRESSION_GZIP: ".gz", RECORD_COMPRESSION_LZMA: ".xz"}
+
+
+def star_bit(star: int) -> int:
+    """
+    星级在星级位掩码中的位, 超出范围的星级共用最高位
+    """
+    return 1 << (star if 0 <= star < 31 else 31)
+
+
+def tag_bit(tag: str) -> int:
+    """
+    实际标签在标签位掩码中的位, TAG_CODES 以外的标签共用最高位
+    """
+    return 1 << (TAG_CODES.index(tag) if tag in TAG_CODES else 7)
+
+
+def compressed_file(file: str | IO, compression: str, mode: str) -> IO:
+    """
+    以 compression 压缩方式打开文件路径或二进制文件对象 file, mode 为 "rb" 或 "wb"
+    传入文件对象时, 关闭压缩文件不会关闭 file
+    """
+    match compression:
+        case "gzip":
+            return gzip.open(file, mode)    # type: ignore
+        case "lzma":
+            return lzma.open(file, mode)    # type: ignore
+        case _:
+            raise ValueError(f"Unknown record compression: {compression}")
+
+
+def format_time(epoch: int) -> str:
+    """
+    将时间戳秒数格式化为本地时间字符串, 格式与 str(datetime.replace(microsecond=0)) 相同
+    """
+    return str(dt.datetime.fromtimestamp(epoch))
+
+
+def parse_time(time_string: str) -> int:
+    """
+    format_time 的逆运算
+    """
+    return int(dt.datetime.fromisoformat(time_string).timestamp())
+
+
+@dataclass(slots=True)
+class DetailRecord:
+    """
+    从日志中读取的单条 details 记录
+    """
+    order: int          # 累计抽数
+    time: int           # 时间戳秒数
+    real_tag: str       # 实际标签
+    game: str
+    type: str
+    star: int
+    content: str
+
+    def __str__(self) -> str:
+        """
+        返回 csv 格式的单行字符串
+        """
+        return f"{self.order},{format_time(self.time)},{self.real_tag},{self.game},{self.type},{self.star},{self.content}"
+
+
+@dataclass
+class CardCache:
+    """
+    单张卡片缓存
+    """
+    order: int                  # 累计抽数
+    time: int                   # 时间戳秒数
+    packed_card: PackedCard     # 卡片信息
+
+    def __str__(self) -> str:
+        """
+        返回 csv 格式的单行字符串
+        """
+        card = self.packed_card.card
+        return ",".join((
+            str(self.order),
+            format_time(self.time),
+            self.packed_card.real_tag,
+            card.game,
+            card.type,
+            str(card.star),
+            card.content
+        ))
+
+
+@dataclass
+class IntervalCache:
+    """
+    间隔缓存
+    """
+    counter: int                # 间隔抽数
+    packed_card: PackedCard     # 卡片信息
+
+    def __str__(self) -> str:
+        """
+        返回 csv 格式的单行字符串
+        """
+        card = self.packed_card.card
+        return ",".join((
+            str(self.counter),
+            self.packed_card.real_tag,
+            card.game,
+            card.type,
+            str(card.star),
+            card.content
+        ))
+
+
+class RecordLog(ABC):
+    """
+    抽卡记录日志后端基类
+    """
+    # 后端标识符
+    name: str = "RecordLog"
+    # 是否由后端自身保存 profile (计数器), 为 True 时 WishRecorder 不使用 profile.json
+    stores_profile: bool = False
+
+    def __init__(self, record_dir: str) -> None:
+        self.dir = record_dir
+
+    def open(self):
+        """
+        保持日志打开, 直到 close()
+        """
+        pass
+
+    def close(self):
+        """
+        关闭日志
+        """
+        pass
+
+    def paths(self) -> Tuple[str, ...]:
+        """
+        日志文件路径
+        """
+        return ()
+
+    def positions(self) -> Dict[str, int]:
+        """
+        当前日志位置, 见 WishRecorder 的检查点
+        """
+        return {}
+
+    def positions_valid(self, positions: Dict[str, int]) -> bool:
+        """
+        检查点记录的日志位置 positions 是否仍在日志中 (日志在检查点之后未被截断或重置)
+        """
+        return True
+
+    def sync(self):
+        """
+        将日志写入磁盘
+        """
+        pass
+
+    @abstractmethod
+    def init_files(self):
+        """
+        创建不存在的日志文件
+        """
+        pass
+
+    @abstractmethod
+    def iter_details(self, start: int | None = None, end: int | None = None) -> Iterator[Tuple[int, DetailRecord]]:
+        """
+        按顺序读取 details 日志中位于 [start, end) 的完整记录, 返回 (记录结束位置, 记录)
+        start 默认为第一条记录的位置, end 默认为日志末尾
+        """
+        pass
+
+    @abstractmethod
+    def recover(self, positions: Dict[str, int] | None, max_star: int, interval_counter: int) -> Tuple[List[ReplayRow], int]:
+        """
+        从日志位置 positions 开始恢复, positions 为 None 时从头恢复
+        截断 details 末尾不完整的记录, 并按 details 的重放结果重建 interval 日志在 positions 之后的部分
+        返回 (重放的记录列表, 恢复后的最高星级间隔抽数)
+        """
+        pass
+
+    def set_durability(self, durability: str):
+        """
+        设置持久化模式, 文件日志后端由 WishRecorder 调用 sync() 实现
+        """
+        pass
+
+    def configure_segments(
+            self,
+            size: int | None = None,
+            records: int | None = None,
+            compression: str = RECORD_COMPRESSION_GZIP
+            ):
+        """
+        启用 details 日志分段, 见 FileRecordLog
+        """
+        raise ValueError(f"Record backend does not support segments: {self.name}")
+
+    def segment_config(self) -> Dict | None:
+        """
+        分段配置, 可用于重新调用 configure_segments(), 未启用分段时返回 None
+        """
+        return None
+
+    def should_rotate(self, last_order: int) -> bool:
+        """
+        写入累计抽数至 last_order 的记录后, 是否需要轮换 details 日志 (调用 rotate())
+        """
+        return False
+
+    def rotate(self):
+        """
+        轮换 details 日志, 见 FileRecordLog
+        """
+        pass
+
+    def load_profile(self) -> Dict | None:
+        """
+        读取后端保存的 profile 数据, 不存在时返回 None, 见 stores_profile
+        """
+        return None
+
+    @abstractmethod
+    def write(self, details: List[CardCache], intervals: List[IntervalCache], profile: Dict | None = None):
+        """
+        追加记录
+        profile 为与记录一同保存的 profile 数据, 仅 stores_profile 为 True 的后端使用
+        """
+        pass
+
+    @abstractmethod
+    def reset(self):
+        """
+        清空日志
+        """
+        pass
+
+
+class FileRecordLog(RecordLog):
+    """
+    文件记录日志后端基类
+    details_path 和 interval_path 为当前日志文件路径, 由子类设置
+    """
+    # details 日志的文件头, 第一条记录位于文件头之后
+    details_header: bytes = b""
+    # interval 日志中第一条记录的位置
+    interval_start: int = 0
+
+    def __init__(self, record_dir: str) -> None:
+        super().__init__(record_dir)
+        self.details_path = ""
+        self.interval_path = ""
+        self.keep_open = False              # 是否保持文件句柄打开, 见 open()
+        self._handles: Dict[str, IO] = {}   # 文件路径 -> 追加写入句柄
+        self.durability = RECORD_DURABILITY_NONE
+
+        # 分段, 见 configure_segments()
+        self.segment_dir = os.path.join(record_dir, "segments")
+        self.manifest_path = os.path.join(record_dir, "segments.json")
+        self.segments: List[Dict] = []      # 分段清单, 按封存顺序
+        self.segment_size: int | None = None
+        self.segment_records: int | None = None
+        self.compression = RECORD_COMPRESSION_GZIP
+
+    @property
+    def details_start(self) -> int:
+        """
+        details 日志中第一条记录的位置
+        """
+        return len(self.details_header)
+
+    def open(self):
+        """
+        保持追加写入的文件句柄打开, 之后的写入不再重复打开文件, 直到 close()
+        """
+        self.keep_open = True
+
+    def close(self):
+        """
+        关闭所有文件句柄
+        """
+        self.keep_open = False
+        for f in self._handles.values():
+            f.close()
+        self._handles.clear()
+
+    def _append(self, path: str, data: str | bytes):
+        """
+        向文件追加数据, 并刷新到操作系统缓冲区
+        """
+        f = self._handles.get(path)
+        if f is None:
+            if isinstance(data, bytes):
+                f = open(path, "ab")
+            else:
+                f = open(path, "a", encoding="utf-8", newline="")
+            if not self.keep_open:
+                with f:
+                    f.write(data)
+                return
+            self._handles[path] = f
+        f.write(data)
+        f.flush()
+
+    def _close_handle(self, path: str):
+        """
+        关闭单个文件的追加写入句柄, 下次写入时重新打开
+        """
+        f = self._handles.pop(path, None)
+        if f is not None:
+            f.close()
+
+    @staticmethod
+    def _truncate(path: str, size: int):
+        """
+        将文件截断到 size 字节
+        """
+        if os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    @staticmethod
+    def _read_tail(path: str, start: int) -> bytes:
+        """
+        读取文件从 start 开始的内容
+        """
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read()
+
+    def paths(self) -> Tuple[str, ...]:
+        return (self.details_path, self.interval_path)
+
+    def positions(self) -> Dict[str, int]:
+        """
+        当前日志位置: 日志文件名 -> 文件长度, 以及封存分段数 "segments"
+        """
+        positions = {os.path.basename(path): os.path.getsize(path) for path in self.paths()}
+        positions["segments"] = len(self.segments)
+        return positions
+
+    def positions_valid(self, positions: Dict[str, int]) -> bool:
+        # 检查点之后封存的分段中, 第一个分段的原始内容即检查点时的 details 日志
+        sealed = positions.get("segments", 0)
+        if sealed > len(self.segments):
+            return False
+        current = self.positions()
+        details_name = os.path.basename(self.details_path)
+        for name, size in positions.items():
+            if name == "segments":
+                continue
+            if name == details_name and sealed < len(self.segments):
+                if self.segments[sealed]["raw_size"] < size:
+                    return False
+            elif current.get(name, 0) < size:
+                return False
+        return True
+
+    def sync(self):
+        """
+        将日志文件写入磁盘 (fsync)
+        """
+        for path in self.paths():
+            f = self._handles.get(path)
+            if f is not None:
+                os.fsync(f.fileno())
+            else:
+                with open(path, "ab") as f:
+                    os.fsync(f.fileno())
+
+    def set_durability(self, durability: str):
+        self.durability = durability
+
+    @property
+    def index_path(self) -> str:
+        """
+        details 日志的稀疏索引文件路径, 见 RecordQuery
+        """
+        return self.details_path + ".idx"
+
+    @abstractmethod
+    def iter_details(
+            self,
+            start: int | None = None,
+            end: int | None = None,
+            segment: int | None = None
+            ) -> Iterator[Tuple[int, DetailRecord]]:
+        """
+        按顺序读取 details 日志中位于 [start, end) 的完整记录, 返回 (记录结束位置, 记录)
+        start 默认为第一条记录的位置, end 默认为文件末尾
+        segment 为封存分段的下标, 为 None 时读取当前日志
+        """
+        pass
+
+    def _open_details(self, segment: int | None = None) -> IO:
+        """
+        以二进制只读方式打开当前 details 日志或下标为 segment 的封存分段 (解压后的内容)
+        """
+        if segment is None:
+            return open(self.details_path, "rb")
+        info = self.segments[segment]
+        return compressed_file(os.path.join(self.segment_dir, info["file"]), info["compression"], "rb")
+
+    def _read_chunks(self, start: int, end: int | None, segment: int | None = None) -> Iterator[Tuple[int, bytes]]:
+        """
+        按 RECORD_READ_SIZE 分块读取 details 日志 [start, end) 的内容, 返回 (块起始位置, 块内容)
+        """
+        with self._open_details(segment) as f:
+            f.seek(start)
+            position = start
+            while end is None or position < end:
+                size = RECORD_READ_SIZE if end is None else min(RECORD_READ_SIZE, end - position)
+                data = f.read(size)
+                if not data:
+                    break
+                yield position, data
+                position += len(data)
+
+    @abstractmethod
+    def _parse_rows(self, data: bytes) -> Tuple[List[ReplayRow], int]:
+        """
+        解析 details 日志内容中的完整记录, 返回 (重放记录列表, 完整记录的字节数)
+        """
+        pass
+
+    @abstractmethod
+    def _interval_data(self, intervals: List[Tuple[int, ReplayRow]]) -> str | bytes:
+        """
+        将 (间隔抽数, 重放记录) 列表转换为 interval 日志内容
+        """
+        pass
+
+    def recover(self, positions: Dict[str, int] | None, max_star: int, interval_counter: int) -> Tuple[List[ReplayRow], int]:
+        sealed = positions.get("segments", 0) if positions else 0
+        start = positions[os.path.basename(self.details_path)] if positions else self.details_start
+        interval_start = positions[os.path.basename(self.interval_path)] if positions else self.interval_start
+
+        # 检查点之后封存的分段
+        rows: List[ReplayRow] = []
+        for segment in range(sealed, len(self.segments)):
+            data = b"".join(data for _, data in self._read_chunks(start, None, segment))
+            rows.extend(self._parse_rows(data)[0])
+            start = self.details_start
+
+        data = self._read_tail(self.details_path, start)
+        tail_rows, end = self._parse_rows(data)
+        if end < len(data):
+            self._truncate(self.details_path, start + end)
+        self._truncate(self.interval_path, interval_start)
+        rows.extend(tail_rows)
+
+        intervals: List[Tuple[int, ReplayRow]] = []
+        for row in rows:
+            interval_counter += 1
+            if row[4] == max_star:
+                intervals.append((interval_counter, row))
+                interval_counter = 0
+
+        if intervals:
+            self._append(self.interval_path, self._interval_data(intervals))
+        return rows, interval_counter
+
+    def configure_segments(
+            self,
+            size: int | None = None,
+            records: int | None = None,
+            compression: str = RECORD_COMPRESSION_GZIP
+            ):
+        """
+        启用 details 日志分段: 当前日志达到 size 字节或 records 条记录时轮换, 封存分段以 compression 压缩
+        size 和 records 均为 None 时按 RECORD_SEGMENT_SIZE 字节轮换
+        """
+        if size is not None and size <= 0:
+            raise ValueError(f"Invalid segment size: {size}")
+        if records is not None and records <= 0:
+            raise ValueError(f"Invalid segment records: {records}")
+        if compression not in SEGMENT_EXTENSIONS:
+            raise ValueError(f"Unknown record compression: {compression}")
+        if size is None and records is None:
+            size = RECORD_SEGMENT_SIZE
+        self.segment_size = size
+        self.segment_records = records
+        self.compression = compression
+
+    def segment_config(self) -> Dict | None:
+        if self.segment_size is None and self.segment_records is None:
+            return None
+        return {"size": self.segment_size, "records": self.segment_records, "compression": self.compression}
+
+    @property
+    def sealed_order(self) -> int:
+        """
+        封存分段中最后一条记录的累计抽数, 没有封存分段时为 0
+        """
+        return self.segments[-1]["last_order"] if self.segments else 0
+
+    def should_rotate(self, last_order: int) -> bool:
+        if self.segment_records is not None and last_order - self.sealed_order >= self.segment_records:
+            return True
+        return self.segment_size is not None and os.path.getsize(self.details_path) >= self.segment_size
+
+    def _init_segments(self):
+        """
+        加载分段清单
+        若当前日志的记录已被封存 (轮换时在清空当前日志前中断), 清空当前日志
+        """
+        self.segments = []
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.segments = json.load(f)
+        if self.segments:
+            first = next(self.iter_details(), None)
+            if first is not None and first[1].order <= self.sealed_order:
+                self._clear_details()
+
+    def _write_manifest(self):
+        """
+        原子地替换分段清单
+        """
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8", newline="") as f:
+            json.dump(self.segments, f, indent=4, ensure_ascii=False)
+            if self.durability != RECORD_DURABILITY_NONE:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+
+    def _clear_details(self):
+        """
+        清空当前 details 日志 (保留文件头), 并删除其稀疏索引
+        """
+        self._close_handle(self.details_path)
+        with open(self.details_path, "wb") as f:
+            f.write(self.details_header)
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def rotate(self):
+        """
+        将当前 details 日志压缩为封存分段, 追加到分段清单后清空当前日志
+        步骤: 写入压缩文件 (临时文件 + 重命名) -> 替换分段清单 -> 清空当前日志
+        清空前中断时, 下次加载由 _init_segments() 清空当前日志
+        """
+        records = 0
+        first_order = last_order = min_time = max_time = star_mask = tag_mask = 0
+        for _, record in self.iter_details():
+            if not records:
+                first_order = record.order
+                min_time = max_time = record.time
+            last_order = record.order
+            min_time = min(min_time, record.time)
+            max_time = max(max_time, record.time)
+            star_mask |= star_bit(record.star)
+            tag_mask |= tag_bit(record.real_tag)
+            records += 1
+        if not records:
+            return
+
+        name, extension = os.path.splitext(os.path.basename(self.details_path))
+        file_name = f"{name}-{len(self.segments) + 1:06d}{extension}{SEGMENT_EXTENSIONS[self.compression]}"
+        path = os.path.join(self.segment_dir, file_name)
+        temp_path = path + ".tmp"
+        os.makedirs(self.segment_dir, exist_ok=True)
+        with open(self.details_path, "rb") as source, open(temp_path, "wb") as f:
+            with compressed_file(f, self.compression, "wb") as target:
+                shutil.copyfileobj(source, target, RECORD_READ_SIZE)
+            if self.durability != RECORD_DURABILITY_NONE:
+                f.flush()
+                os.fsync(f.fileno())
+            raw_size = source.tell()
+        os.replace(temp_path, path)
+
+        self.segments.append({
+            "file": file_name,
+            "compression": self.compression,
+            "records": records,
+            "first_order": first_order,
+            "last_order": last_order,
+            "min_time": min_time,
+            "max_time": max_time,
+            "star_mask": star_mask,
+            "tag_mask": tag_mask,
+            "raw_size": raw_size,
+            "size": os.path.getsize(path),
+        })
+        self._write_manifest()
+        self._clear_details()
+
+    def _reset_segments(self):
+        """
+        删除分段清单和所有封存分段
+        """
+        self.segments = []
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        if os.path.exists(self.segment_dir):
+            shutil.rmtree(self.segment_dir)
+
+
+class CsvRecordLog(FileRecordLog):
+    """
+    文本记录日志
+    """
+    name: str = "csv"
+
+    def __init__(self, record_dir: str) -> None:
+        super().__init__(record_dir)
+        self.details_path = os.path.join(record_dir, "details.csv")
+        self.interval_path = os.path.join(record_dir, "interval.csv")
+
+    def init_files(self):
+        for path in (self.details_path, self.interval_path):
+            if not os.path.exists(path):
+                with open(path, "w", encoding="utf-8") as f:
+                    pass
+        self._init_segments()
+
+    def write(self, details: List[CardCache], intervals: List[IntervalCache], profile: Dict | None = None):
+        if details:
+            self._append(self.details_path, "".join(str(row) + "\n" for row in details))
+
+        if intervals:
+            self._append(self.interval_path, "".join(str(row) + "\n" for row in intervals))
+
+    def _parse_rows(self, data: bytes) -> Tuple[List[ReplayRow], int]:
+        end = data.rfind(b"\n") + 1
+        rows: List[ReplayRow] = []
+        for line in data[:end].decode("utf-8").splitlines():
+            # 累计抽数, 时间, 实际标签, 游戏, 类型, 星级, 卡片名称
+            fields = line.split(",", 6)
+            rows.append((int(fields[0]), fields[2], fields[3], fields[4], int(fields[5]), fields[6]))
+        return rows, end
+
+    def _interval_data(self, intervals: List[Tuple[int, ReplayRow]]) -> str | bytes:
+        return "".join(
+            f"{counter},{tag},{game},{type_},{star},{content}\n"
+            for counter, (_, tag, game, type_, star, content) in intervals
+        )
+
+    def iter_details(
+            self,
+            start: int | None = None,
+            end: int | None = None,
+            segment: int | None = None
+            ) -> Iterator[Tuple[int, DetailRecord]]:
+        position = self.details_start if start is None else start
+        rest = b""
+        for _, data in self._read_chunks(position, end, segment):
+            data = rest + data
+            cut = data.rfind(b"\n") + 1
+            rest = data[cut:]
+            for line in data[:cut].split(b"\n")[:-1]:
+                position += len(line) + 1
+                # 累计抽数, 时间, 实际标签, 游戏, 类型, 星级, 卡片名称
+                order, time_string, tag, game, type_, star, content = line.decode("utf-8").split(",", 6)
+                yield position, DetailRecord(int(order), parse_time(time_string), tag, game, type_, int(star), content)
+
+    def reset(self):
+        keep_open = self.keep_open
+        self.close()
+        self.keep_open = keep_open
+        self._reset_segments()
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        for path in (self.details_path, self.interval_path):
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                pass
+
+
+class RecordSegment:
+    """
+    通过 mmap 只读访问的二进制日志文件
+    记录按 struct 元组读取, 可按下标访问或顺序迭代
+    """
+    def __init__(self, path: str, magic: bytes, record: struct.Struct) -> None:
+        self.path = path
+        self.record = record
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        file_magic, version, record_size = SEGMENT_HEADER.unpack_from(self.mmap, 0)
+        if file_magic != magic or version != SEGMENT_VERSION or record_size != record.size:
+            self.close()
+            raise ValueError(f"Invalid record segment: {path}")
+        # 忽略末尾未写完整的记录
+        self.count = (len(self.mmap) - SEGMENT_HEADER.size) // record.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> Tuple:
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("record index out of range")
+        return self.record.unpack_from(self.mmap, SEGMENT_HEADER.size + index * self.record.size)
+
+    def __iter__(self) -> Iterator[Tuple]:
+        end = SEGMENT_HEADER.size + self.count * self.record.size
+        return self.record.iter_unpack(memoryview(self.mmap)[SEGMENT_HEADER.size:end])
+
+    def close(self):
+        self.mmap.close()
+
+    def __enter__(self) -> "RecordSegment":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BinaryRecordLog(FileRecordLog):
+    """
+    二进制追加记录日志
+    """
+    name: str = "binary"
+    details_header: bytes = SEGMENT_HEADER.pack(DETAIL_MAGIC, SEGMENT_VERSION, DETAIL_RECORD.size)
+    interval_start: int = SEGMENT_HEADER.size
+
+    def __init__(self, record_dir: str) -> None:
+        super().__init__(record_dir)
+        self.details_path = os.path.join(record_dir, "details.bin")
+        self.interval_path = os.path.join(record_dir, "interval.bin")
+        self.dict_path = os.path.join(record_dir, "records.dict")
+
+        # 字符串字典: 编号 -> (游戏, 类型, 星级, 卡片名称)
+        self.entries: List[Tuple[str, str, int, str]] = []
+        self.entry_ids: Dict[Tuple[str, str, int, str], int] = {}
+        self._card_ids: Dict[int, int] = {}     # CardRegistry 编号 -> 字典编号
+
+    def init_files(self):
+        for path, magic, record in (
+            (self.details_path, DETAIL_MAGIC, DETAIL_RECORD),
+            (self.interval_path, INTERVAL_MAGIC, INTERVAL_RECORD)
+        ):
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(SEGMENT_HEADER.pack(magic, SEGMENT_VERSION, record.size))
+
+        if not os.path.exists(self.dict_path):
+            with open(self.dict_path, "w", encoding="utf-8") as f:
+                pass
+        self._load_dict()
+        self._init_segments()
+
+    def paths(self) -> Tuple[str, ...]:
+        # 字典在记录之前写入磁盘
+        return (self.dict_path, self.details_path, self.interval_path)
+
+    def _load_dict(self):
+        self.entries = []
+        self.entry_ids = {}
+        self._card_ids = {}
+        with open(self.dict_path, "rb") as f:
+            data = f.read()
+
+        # 只读取完整的行, 末尾未写完整的行会被截断
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            self._truncate(self.dict_path, end)
+        for line in data[:end].decode("utf-8").splitlines():
+            if line.strip():
+                game, type_, star, content = json.loads(line)
+                entry = (game, type_, star, content)
+                self.entry_ids[entry] = len(self.entries)
+                self.entries.append(entry)
+
+    def _parse_rows(self, data: bytes) -> Tuple[List[ReplayRow], int]:
+        end = len(data) - len(data) % DETAIL_RECORD.size
+        rows: List[ReplayRow] = []
+        for order, _, card_id, tag_code in DETAIL_RECORD.iter_unpack(data[:end]):
+            game, type_, star, content = self.entries[card_id]
+            rows.append((order, TAG_CODES[tag_code], game, type_, star, content))
+        return rows, end
+
+    def _interval_data(self, intervals: List[Tuple[int, ReplayRow]]) -> str | bytes:
+        return b"".join(
+            INTERVAL_RECORD.pack(counter, self.entry_ids[(game, type_, star, content)], TAG_CODES.index(tag))
+            for counter, (_, tag, game, type_, star, content) in intervals
+        )
+
+    def iter_details(
+            self,
+            start: int | None = None,
+            end: int | None = None,
+            segment: int | None = None
+            ) -> Iterator[Tuple[int, DetailRecord]]:
+        position = self.details_start if start is None else start
+        size = DETAIL_RECORD.size
+        entries = self.entries
+        rest = b""
+        for _, data in self._read_chunks(position, end, segment):
+            data = rest + data
+            cut = len(data) - len(data) % size
+            rest = data[cut:]
+            for order, epoch, card_id, tag_code in DETAIL_RECORD.iter_unpack(data[:cut]):
+                position += size
+                game, type_, star, content = entries[card_id]
+                yield position, DetailRecord(order, epoch, TAG_CODES[tag_code], game, type_, star, content)
+
+    def card_id(self, card: Card, new_entries: List[str]) -> int:
+        """
+        获取卡片在字符串字典中的编号, 新卡片的字典行追加到 new_entries
+        """
+        card_id = self._card_ids.get(card.id) if card.id >= 0 else None
+        if card_id is not None:
+            return card_id
+
+        entry = (card.game, card.type, card.star, card.content)
+        card_id = self.entry_ids.get(entry)
+        if card_id is None:
+            card_id = self.entry_ids[entry] = len(self.entries)
+            self.entries.append(entry)
+            new_entries.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        if card.id >= 0:
+            self._card_ids[card.id] = card_id
+        return card_id
+
+    def write(self, details: List[CardCache], intervals: List[IntervalCache], profile: Dict | None = None):
+        new_entries: List[str] = []
+        detail_data = b"".join(
+            DETAIL_RECORD.pack(row.order, row.time, self.card_id(row.packed_card.card, new_entries), TAG_CODES.index(row.packed_card.real_tag))
+            for row in details
+        )
+        interval_data = b"".join(
+            INTERVAL_RECORD.pack(row.counter, self.card_id(row.packed_card.card, new_entries), TAG_CODES.index(row.packed_card.real_tag))
+            for row in intervals
+        )
+
+        # 先写字典, 保证记录引用的编号总能在字典中找到
+        if new_entries:
+            self._append(self.dict_path, "".join(new_entries))
+        if detail_data:
+            self._append(self.details_path, detail_data)
+        if interval_data:
+            self._append(self.interval_path, interval_data)
+
+    def reset(self):
+        keep_open = self.keep_open
+        self.close()
+        self.keep_open = keep_open
+        self._reset_segments()
+        for path in (self.details_path, self.interval_path, self.dict_path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.init_files()
+
+    def read_details(self) -> RecordSegment:
+        """
+        以 mmap 打开 details 日志, 记录为 (累计抽数, 时间戳秒数, 卡片编号, 标签编码)
+        """
+        return RecordSegment(self.details_path, DETAIL_MAGIC, DETAIL_RECORD)
+
+    def read_intervals(self) -> RecordSegment:
+        """
+        以 mmap 打开 interval 日志, 记录为 (间隔抽数, 卡片编号, 标签编码)
+        """
+        return RecordSegment(self.interval_path, INTERVAL_MAGIC, INTERVAL_RECORD)
+
+    def entry_fields(self, card_id: int) -> str:
+        """
+        字典编号对应的 csv 字段: 游戏,类型,星级,卡片名称
+        """
+        game, type_, star, content = self.entries[card_id]
+        return f"{game},{type_},{star},{content}"
+
+    def to_csv(self, output_dir: str | None = None):
+        """
+        将二进制日志转换为 details.csv 和 interval.csv, 内容与 csv 后端写出的完全相同
+        details.csv 包括所有封存分段中的记录
+        output_dir 默认为记录目录
+        """
+        output_dir = output_dir if output_dir else self.dir
+        self._load_dict()
+        fields = [self.entry_fields(card_id) for card_id in range(len(self.entries))]
+
+        with self.read_details() as segment, \
+                open(os.path.join(output_dir, "details.csv"), "w", encoding="utf-8", newline="") as f:
+            for index in range(len(self.segments)):
+                for _, record in self.iter_details(segment=index):
+                    f.write(f"{record}\n")
+            for order, epoch, card_id, tag_code in segment:
+                f.write(f"{order},{format_time(epoch)},{TAG_CODES[tag_code]},{fields[card_id]}\n")
+
+        with self.read_intervals() as segment, \
+                open(os.path.join(output_dir, "interval.csv"), "w", encoding="utf-8", newline="") as f:
+            for counter, card_id, tag_code in segment:
+                f.write(f"{counter},{TAG_CODES[tag_code]},{fields[card_id]}\n")
+
+
+class SqliteRecordLog(RecordLog):
+    """
+    SQLite 数据库记录日志
+    数据库文件为记录目录上级目录中的 RECORD_DATABASE_NAME, 记录目录名作为卡池键, 不再创建记录目录
+    连接可在后台写入线程和查询线程之间共用, 所有数据库操作由 lock 串行化
+    """
+    name: str = "sqlite"
+    stores_profile: bool = True
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS pools ("
+        "pool TEXT PRIMARY KEY, cache_size INTEGER NOT NULL, total INTEGER NOT NULL, max_star_interval INTEGER NOT NULL, "
+        "stats TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS details ("
+        "pool TEXT NOT NULL, ord INTEGER NOT NULL, time INTEGER NOT NULL, tag TEXT NOT NULL, "
+        "game TEXT NOT NULL, type TEXT NOT NULL, star INTEGER NOT NULL, content TEXT NOT NULL, "
+        "PRIMARY KEY (pool, ord)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS details_pool_star ON details (pool, star)",
+        "CREATE INDEX IF NOT EXISTS details_pool_tag ON details (pool, tag)",
+        "CREATE INDEX IF NOT EXISTS details_time ON details (time)",
+        "CREATE TABLE IF NOT EXISTS intervals ("
+        "pool TEXT NOT NULL, counter INTEGER NOT NULL, tag TEXT NOT NULL, "
+        "game TEXT NOT NULL, type TEXT NOT NULL, star INTEGER NOT NULL, content TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS intervals_pool ON intervals (pool)",
+        "CREATE TABLE IF NOT EXISTS counters ("
+        "pool TEXT NOT NULL, tag TEXT NOT NULL, type TEXT NOT NULL, star INTEGER NOT NULL, count INTEGER NOT NULL, "
+        "PRIMARY KEY (pool, tag, type, star)) WITHOUT ROWID",
+    )
+
+    INSERT_DETAIL = "INSERT INTO details VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    INSERT_INTERVAL = "INSERT INTO intervals VALUES (?, ?, ?, ?, ?, ?, ?)"
+    UPDATE_COUNTER = (
+        "INSERT INTO counters VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (pool, tag, type, star) DO UPDATE SET count = count + excluded.count"
+    )
+    UPDATE_POOL = (
+        "INSERT INTO pools VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (pool) DO UPDATE SET "
+        "cache_size = excluded.cache_size, total = excluded.total, max_star_interval = excluded.max_star_interval, "
+        "stats = excluded.stats"
+    )
+
+    def __init__(self, record_dir: str) -> None:
+        super().__init__(record_dir)
+        record_dir = os.path.normpath(os.path.abspath(record_dir))
+        self.pool = os.path.basename(record_dir)
+        self.database_path = os.path.join(os.path.dirname(record_dir), RECORD_DATABASE_NAME)
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    def init_files(self):
+        if self.connection is not None:
+            return
+        os.makedirs(os.path.dirname(self.database_path), exist_ok=True)
+        self.connection = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            with self.connection:
+                for statement in self.SCHEMA:
+                    self.connection.execute(statement)
+
+    def set_durability(self, durability: str):
+        match durability:
+            case "none":
+                synchronous = "OFF"
+            case "batch":
+                synchronous = "NORMAL"     # WAL 模式下只在检查点写入磁盘
+            case "flush":
+                synchronous = "FULL"
+            case _:
+                raise ValueError(f"Unknown record durability: {durability}")
+        self.init_files()
+        with self.lock:
+            self.connection.execute(f"PRAGMA synchronous={synchronous}")     # type: ignore
+
+    def paths(self) -> Tuple[str, ...]:
+        return (self.database_path,)
+
+    def positions(self) -> Dict[str, int]:
+        # 事务保证记录与计数器一致, 没有需要恢复的日志位置
+        return {}
+
+    def sync(self):
+        pass
+
+    def execute(self, sql: str, parameters: Sequence = ()) -> List[Tuple]:
+        """
+        执行查询语句并返回全部结果
+        """
+        self.init_files()
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()   # type: ignore
+
+    def load_profile(self) -> Dict | None:
+        rows = self.execute("SELECT cache_size, total, max_star_interval, stats FROM pools WHERE pool = ?", (self.pool,))
+        if not rows:
+            return None
+        cache_size, total, max_star_interval, stats = rows[0]
+
+        counters: Dict[str, Dict[str, Dict[str, int]]] = {}
+        for tag, type_, star, count in self.execute(
+            "SELECT tag, type, star, count FROM counters WHERE pool = ?", (self.pool,)
+        ):
+            counters.setdefault(tag, {}).setdefault(type_, {})[str(star)] = count
+
+        return {
+            "cache_size": cache_size,
+            "total": total,
+            "max_star_interval": max_star_interval,
+            "counters": counters,
+            "stats": json.loads(stats),
+        }
+
+    def write(self, details: List[CardCache], intervals: List[IntervalCache], profile: Dict | None = None):
+        pool = self.pool
+        detail_rows = [
+            (pool, row.order, row.time, row.packed_card.real_tag,
+             row.packed_card.card.game, row.packed_card.card.type, row.packed_card.card.star, row.packed_card.card.content)
+            for row in details
+        ]
+        interval_rows = [
+            (pool, row.counter, row.packed_card.real_tag,
+             row.packed_card.card.game, row.packed_card.card.type, row.packed_card.card.star, row.packed_card.card.content)
+            for row in intervals
+        ]
+        deltas: Dict[Tuple[str, str, int], int] = {}
+        for row in detail_rows:
+            key = (row[3], row[5], row[6])
+            deltas[key] = deltas.get(key, 0) + 1
+
+        self.init_files()
+        connection: sqlite3.Connection = self.connection     # type: ignore
+        with self.lock, connection:
+            if detail_rows:
+                connection.executemany(self.INSERT_DETAIL, detail_rows)
+            if interval_rows:
+                connection.executemany(self.INSERT_INTERVAL, interval_rows)
+            if deltas:
+                connection.executemany(
+                    self.UPDATE_COUNTER,
+                    [(pool, tag, type_, star, count) for (tag, type_, star), count in deltas.items()]
+                )
+            if profile is not None:
+                connection.execute(
+                    self.UPDATE_POOL,
+                    (pool, profile["cache_size"], profile["total"], profile["max_star_interval"],
+                     json.dumps(profile.get("stats", {}), ensure_ascii=False))
+                )
+
+    def recover(self, positions: Dict[str, int] | None, max_star: int, interval_counter: int) -> Tuple[List[ReplayRow], int]:
+        return [], interval_counter
+
+    def iter_details(self, start: int | None = None, end: int | None = None) -> Iterator[Tuple[int, DetailRecord]]:
+        """
+        start 和 end 为累计抽数范围 [start, end), 返回 (累计抽数, 记录)
+        """
+        rows = self.execute(
+            "SELECT ord, time, tag, game, type, star, content FROM details "
+            "WHERE pool = ? AND ord >= ? AND ord < ? ORDER BY ord",
+            (self.pool, start if start is not None else 0, end if end is not None else 1 << 62)
+        )
+        for row in rows:
+            yield row[0], DetailRecord(*row)
+
+    def reset(self):
+        self.init_files()
+        connection: sqlite3.Connection = self.connection     # type: ignore
+        with self.lock, connection:
+            for table in ("details", "intervals", "counters", "pools"):
+                connection.execute(f"DELETE FROM {table} WHERE pool = ?", (self.pool,))
+
+
+def name_to_record_log_class(name: str) -> Type[RecordLog]:
+    match name:
+        case CsvRecordLog.name:
+            return CsvRecordLog
+        case BinaryRecordLog.name:
+            return BinaryRecordLog
+        case SqliteRecordLog.name:
+            return SqliteRecordLog
+        case _:
+            raise ValueError(f"Unknown record backend: {name}")
+
+
+def make_record_log(backend: str, record_dir: str) -> RecordLog:
+    """
+    根据后端名称创建记录日志
+    """
+    return name_to_record_log_class(backend)(record_dir)
@@ -0,0 +1,516 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    RecordQuery
+
+Description
+_
+    Wishes 抽卡记录查询模块
+    按星级、实际标签、类型、卡片名称和时间范围查询 details 记录, 支持分页和查询最近 N 条记录
+    稀疏索引:
+        details 日志按每 RECORD_INDEX_INTERVAL 条记录划分为索引块, 索引文件 (details.*.idx) 保存每块的
+            起始位置、字节数、时间范围、出现过的星级 (位掩码) 和 实际标签 (位掩码)
+        查询时跳过不可能包含匹配记录的索引块, 只读取候选块和最后一个不完整块
+        索引只追加完整的块, 每次查询前读取日志新增的部分更新索引
+        索引文件头: 魔数 (4 字节)、格式版本 (uint16)、单个索引项字节数 (uint16)、每块记录数 (uint32)
+    分段:
+        封存分段按分段清单中的时间范围和位掩码筛选, 与索引块相同; 分段内不建索引, 候选分段整体解压读取
+        没有查询条件时按清单中的记录数整段跳过
+    export 将匹配的记录导出为与 details.csv 格式相同的文件
+    sqlite 记录后端使用 SqliteRecordQuery, 查询直接使用数据库索引, 并提供基于 counters 表的统计
+    make_query 根据记录日志后端选择查询类
+"""
+
+
+from Const import *
+from RecordLog import *
+from typing import Callable, Dict, Iterator, List, Tuple
+import datetime as dt
+import os
+import struct
+
+
+INDEX_HEADER = struct.Struct("<4sHHI")
+INDEX_MAGIC = b"WRIX"
+INDEX_VERSION = 1
+INDEX_ENTRY = struct.Struct("<QIIIIB")     # 起始位置, 字节数, 最早时间戳, 最晚时间戳, 星级位掩码, 标签位掩码
+
+# 索引块: (起始位置, 字节数, 最早时间戳, 最晚时间戳, 星级位掩码, 标签位掩码)
+IndexBlock = Tuple[int, int, int, int, int, int]
+
+
+def segment_block(info: Dict) -> IndexBlock:
+    """
+    将分段清单项转换为索引块, 用于按查询条件筛选分段
+    """
+    return (0, info["raw_size"], info["min_time"], info["max_time"], info["star_mask"], info["tag_mask"])
+
+
+def to_epoch(time: int | dt.datetime | None) -> int | None:
+    if isinstance(time, dt.datetime):
+        return int(time.timestamp())
+    return time
+
+
+class RecordQuery:
+    """
+    抽卡记录查询
+    查询条件均为可选, 时间范围 since ~ until 包含两端, 可为时间戳秒数或 datetime
+    """
+    def __init__(self, log: FileRecordLog, block_size: int = RECORD_INDEX_INTERVAL) -> None:
+        if block_size <= 0:
+            raise ValueError(f"Invalid index block size: {block_size}")
+        self.log = log
+        self.block_size = block_size
+        self.blocks: List[IndexBlock] = []
+        self._load()
+
+    def _load(self):
+        """
+        加载索引文件, 文件无效时重建索引
+        """
+        self.blocks = []
+        valid = False
+        path = self.log.index_path
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) >= INDEX_HEADER.size:
+                magic, version, entry_size, block_size = INDEX_HEADER.unpack_from(data, 0)
+                if (magic, version, entry_size, block_size) == (INDEX_MAGIC, INDEX_VERSION, INDEX_ENTRY.size, self.block_size):
+                    end = len(data) - (len(data) - INDEX_HEADER.size) % INDEX_ENTRY.size
+                    self.blocks = list(INDEX_ENTRY.iter_unpack(data[INDEX_HEADER.size:end]))
+                    valid = end == len(data)
+
+        # 日志被截断 (崩溃恢复) 后, 丢弃超出日志末尾的索引块
+        details_size = os.path.getsize(self.log.details_path)
+        while self.blocks and self.blocks[-1][0] + self.blocks[-1][1] > details_size:
+            self.blocks.pop()
+            valid = False
+        if not valid:
+            self._write_all()
+
+    def _write_all(self):
+        with open(self.log.index_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, INDEX_ENTRY.size, self.block_size))
+            f.write(b"".join(INDEX_ENTRY.pack(*block) for block in self.blocks))
+
+    @property
+    def indexed_end(self) -> int:
+        """
+        最后一个索引块的结束位置
+        """
+        if not self.blocks:
+            return self.log.details_start
+        offset, size, *_ = self.blocks[-1]
+        return offset + size
+
+    def update(self):
+        """
+        为日志新增的完整块追加索引
+        """
+        if not os.path.exists(self.log.index_path):
+            # 日志重置时索引文件被删除
+            self.blocks = []
+            self._write_all()
+
+        start = self.indexed_end
+        if os.path.getsize(self.log.details_path) < start:
+            self._load()
+            start = self.indexed_end
+
+        new_blocks: List[IndexBlock] = []
+        count = 0
+        epoch_min = epoch_max = star_mask = tag_mask = 0
+        for end, record in self.log.iter_details(start):
+            if not count:
+                epoch_min = epoch_max = record.time
+                star_mask = tag_mask = 0
+            epoch_min = min(epoch_min, record.time)
+            epoch_max = max(epoch_max, record.time)
+            star_mask |= star_bit(record.star)
+            tag_mask |= tag_bit(record.real_tag)
+            count += 1
+            if count == self.block_size:
+                new_blocks.append((start, end - start, epoch_min, epoch_max, star_mask, tag_mask))
+                start = end
+                count = 0
+
+        if new_blocks:
+            self.blocks.extend(new_blocks)
+            with open(self.log.index_path, "ab") as f:
+                f.write(b"".join(INDEX_ENTRY.pack(*block) for block in new_blocks))
+
+    def _matcher(
+            self,
+            star: int | None,
+            tag: str | None,
+            type_: str | None,
+            content: str | None,
+            since: int | None,
+            until: int | None
+            ) -> Tuple[Callable[[IndexBlock], bool], Callable[[DetailRecord], bool] | None]:
+        """
+        返回 (索引块是否可能包含匹配记录, 记录是否匹配), 没有查询条件时后者为 None
+        """
+        star_mask = star_bit(star) if star is not None else -1
+        tag_mask = tag_bit(tag) if tag is not None else -1
+        low = since if since is not None else -1
+        high = until if until is not None else 1 << 62
+
+        def block_match(block: IndexBlock) -> bool:
+            _, _, epoch_min, epoch_max, block_stars, block_tags = block
+            return bool(block_stars & star_mask) and bool(block_tags & tag_mask) and epoch_max >= low and epoch_min <= high
+
+        if star is None and tag is None and type_ is None and content is None and since is None and until is None:
+            return block_match, None
+
+        def record_match(record: DetailRecord) -> bool:
+            return (
+                (star is None or record.star == star)
+                and (tag is None or record.real_tag == tag)
+                and (type_ is None or record.type == type_)
+                and (content is None or record.content == content)
+                and low <= record.time <= high
+            )
+
+        return block_match, record_match
+
+    def _scan(
+            self,
+            start: int | None,
+            end: int | None,
+            record_match: Callable[[DetailRecord], bool] | None,
+            segment: int | None = None
+            ) -> Iterator[DetailRecord]:
+        for _, record in self.log.iter_details(start, end, segment):
+            if record_match is None or record_match(record):
+                yield record
+
+    def iter_records(
+            self,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None,
+            offset: int = 0
+            ) -> Iterator[DetailRecord]:
+        """
+        按顺序返回匹配的记录, 跳过前 offset 条
+        """
+        if offset < 0:
+            raise ValueError(f"Invalid offset: {offset}")
+        self.update()
+        block_match, record_match = self._matcher(star, tag, type_, content, to_epoch(since), to_epoch(until))
+
+        for index, info in enumerate(self.log.segments):
+            if not block_match(segment_block(info)):
+                continue
+            if record_match is None and offset >= info["records"]:
+                offset -= info["records"]
+                continue
+            for record in self._scan(None, None, record_match, index):
+                if offset:
+                    offset -= 1
+                    continue
+                yield record
+
+        for block in self.blocks:
+            if not block_match(block):
+                continue
+            block_offset, size, *_ = block
+            if record_match is None and offset >= self.block_size:
+                # 没有查询条件时每块的记录数已知, 整块跳过
+                offset -= self.block_size
+                continue
+            for record in self._scan(block_offset, block_offset + size, record_match):
+                if offset:
+                    offset -= 1
+                    continue
+                yield record
+
+        for record in self._scan(self.indexed_end, None, record_match):
+            if offset:
+                offset -= 1
+                continue
+            yield record
+
+    def find(
+            self,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None,
+            offset: int = 0,
+            limit: int | None = None
+            ) -> List[DetailRecord]:
+        """
+        分页查询: 返回跳过前 offset 条后的至多 limit 条匹配记录
+        """
+        records: List[DetailRecord] = []
+        if limit is not None and limit <= 0:
+            return records
+        for record in self.iter_records(star, tag, type_, content, since, until, offset):
+            records.append(record)
+            if limit is not None and len(records) >= limit:
+                break
+        return records
+
+    def count(
+            self,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None
+            ) -> int:
+        """
+        匹配的记录数
+        """
+        self.update()
+        block_match, record_match = self._matcher(star, tag, type_, content, to_epoch(since), to_epoch(until))
+        if record_match is None:
+            sealed = sum(info["records"] for info in self.log.segments)
+            return sealed + len(self.blocks) * self.block_size + sum(1 for _ in self._scan(self.indexed_end, None, None))
+        return sum(1 for _ in self.iter_records(star, tag, type_, content, since, until))
+
+    def last(
+            self,
+            n: int,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None
+            ) -> List[DetailRecord]:
+        """
+        最近 n 条匹配记录, 按抽卡顺序排列
+        从日志末尾向前逐块 (再逐个封存分段) 查找, 找到 n 条后停止
+        """
+        if n <= 0:
+            return []
+        self.update()
+        block_match, record_match = self._matcher(star, tag, type_, content, to_epoch(since), to_epoch(until))
+
+        chunks: List[List[DetailRecord]] = [list(self._scan(self.indexed_end, None, record_match))]
+        found = len(chunks[0])
+        for block in reversed(self.blocks):
+            if found >= n:
+                break
+            if not block_match(block):
+                continue
+            block_offset, size, *_ = block
+            records = list(self._scan(block_offset, block_offset + size, record_match))
+            chunks.append(records)
+            found += len(records)
+
+        for index in reversed(range(len(self.log.segments))):
+            if found >= n:
+                break
+            if not block_match(segment_block(self.log.segments[index])):
+                continue
+            records = list(self._scan(None, None, record_match, index))
+            chunks.append(records)
+            found += len(records)
+
+        records = [record for chunk in reversed(chunks) for record in chunk]
+        return records[-n:]
+
+    def export(
+            self,
+            path: str,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None
+            ) -> int:
+        """
+        将匹配的记录按顺序写入 path, 格式与 details.csv 相同, 返回写入的记录数
+        """
+        return export_records(path, self.iter_records(star, tag, type_, content, since, until))
+
+
+class SqliteRecordQuery:
+    """
+    SQLite 记录后端的抽卡记录查询, 接口与 RecordQuery 相同
+    """
+    COLUMNS = "ord, time, tag, game, type, star, content"
+
+    def __init__(self, log: SqliteRecordLog) -> None:
+        self.log = log
+
+    def _where(
+            self,
+            star: int | None,
+            tag: str | None,
+            type_: str | None,
+            content: str | None,
+            since: int | dt.datetime | None,
+            until: int | dt.datetime | None
+            ) -> Tuple[str, List]:
+        """
+        查询条件对应的 WHERE 子句和参数
+        """
+        clauses = ["pool = ?"]
+        parameters: List = [self.log.pool]
+        for clause, value in (
+            ("star = ?", star),
+            ("tag = ?", tag),
+            ("type = ?", type_),
+            ("content = ?", content),
+            ("time >= ?", to_epoch(since)),
+            ("time <= ?", to_epoch(until)),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                parameters.append(value)
+        return " AND ".join(clauses), parameters
+
+    def iter_records(
+            self,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None,
+            offset: int = 0
+            ) -> Iterator[DetailRecord]:
+        """
+        按顺序返回匹配的记录, 跳过前 offset 条
+        """
+        return iter(self.find(star, tag, type_, content, since, until, offset))
+
+    def find(
+            self,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None,
+            offset: int = 0,
+            limit: int | None = None
+            ) -> List[DetailRecord]:
+        """
+        分页查询: 返回跳过前 offset 条后的至多 limit 条匹配记录
+        """
+        if offset < 0:
+            raise ValueError(f"Invalid offset: {offset}")
+        if limit is not None and limit <= 0:
+            return []
+        where, parameters = self._where(star, tag, type_, content, since, until)
+        rows = self.log.execute(
+            f"SELECT {self.COLUMNS} FROM details WHERE {where} ORDER BY ord LIMIT ? OFFSET ?",
+            (*parameters, limit if limit is not None else -1, offset)
+        )
+        return [DetailRecord(*row) for row in rows]
+
+    def count(
+            self,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None
+            ) -> int:
+        """
+        匹配的记录数
+        """
+        where, parameters = self._where(star, tag, type_, content, since, until)
+        return self.log.execute(f"SELECT COUNT(*) FROM details WHERE {where}", parameters)[0][0]
+
+    def last(
+            self,
+            n: int,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None
+            ) -> List[DetailRecord]:
+        """
+        最近 n 条匹配记录, 按抽卡顺序排列
+        """
+        if n <= 0:
+            return []
+        where, parameters = self._where(star, tag, type_, content, since, until)
+        rows = self.log.execute(
+            f"SELECT {self.COLUMNS} FROM details WHERE {where} ORDER BY ord DESC LIMIT ?",
+            (*parameters, n)
+        )
+        return [DetailRecord(*row) for row in reversed(rows)]
+
+    def export(
+            self,
+            path: str,
+            star: int | None = None,
+            tag: str | None = None,
+            type_: str | None = None,
+            content: str | None = None,
+            since: int | dt.datetime | None = None,
+            until: int | dt.datetime | None = None
+            ) -> int:
+        """
+        将匹配的记录按顺序写入 path, 格式与 details.csv 相同, 返回写入的记录数
+        """
+        return export_records(path, self.iter_records(star, tag, type_, content, since, until))
+
+    def star_counts(self) -> Dict[int, int]:
+        """
+        各星级的抽卡次数, 由 counters 表计算
+        """
+        return dict(self.log.execute(
+            "SELECT star, SUM(count) FROM counters WHERE pool = ? GROUP BY star", (self.log.pool,)
+        ))
+
+    def up_rate(self, star: int) -> float:
+        """
+        该星级结果中实际标签不是常驻的比例 (UP 出货率)
+        """
+        return self.up_rates(star).get(self.log.pool, 0.0)
+
+    def up_rates(self, star: int) -> Dict[str, float]:
+        """
+        数据库中所有卡池该星级的 UP 出货率: 卡池 -> 出货率
+        """
+        rows = self.log.execute(
+            "SELECT pool, SUM(CASE WHEN tag != ? THEN count ELSE 0 END), SUM(count) "
+            "FROM counters WHERE star = ? GROUP BY pool",
+            (TAG_STANDARD, star)
+        )
+        return {pool: up / total for pool, up, total in rows if total}
+
+
+def export_records(path: str, records: Iterator[DetailRecord]) -> int:
+    """
+    将记录写入 path, 格式与 details.csv 相同, 返回写入的记录数
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for record in records:
+            f.write(f"{record}\n")
+            count += 1
+    return count
+
+
+def make_query(log: RecordLog) -> RecordQuery | SqliteRecordQuery:
+    """
+    根据记录日志后端创建查询
+    """
+    if isinstance(log, SqliteRecordLog):
+        return SqliteRecordQuery(log)
+    return RecordQuery(log)
@@ -0,0 +1,162 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    RecordStats
+
+Description
+_
+    Wishes 抽卡记录在线统计模块
+    WishRecorder 每追加一条记录, 以 O(1) 的开销增量更新以下统计量, 并随 profile 一同保存:
+        保底分布     各星级相邻两次出现的间隔抽数 -> 次数 (最高星级与 interval 记录一致)
+        连续记录     各星级连续 UP / 连续非 UP 的长度 -> 次数, 以及当前未结束的连续记录
+        小保底       各星级 UP 结果中 "歪后必得" 和 "不歪" 的次数, 以及 "歪" 的次数
+        卡片数量     游戏 -> 卡片名称 -> 抽出次数
+    "UP" 指实际标签不是常驻的结果 (包括 Fes 和 Appoint)
+    同一星级中, 前一次为非 UP 时的 UP 记为 "歪后必得", 否则 UP 记为 "不歪", 非 UP 记为 "歪"
+    *保存时星级和间隔抽数使用字符串表示, 与 profile 中的 counters 一致
+"""
+
+
+from Const import *
+from typing import Dict, List, Tuple
+
+
+class RecordStats:
+    """
+    抽卡记录在线统计
+    """
+    def __init__(self) -> None:
+        self.last_seen: Dict[int, int] = {}                 # 星级 -> 上次出现时的累计抽数
+        self.pity: Dict[int, Dict[int, int]] = {}           # 星级 -> 间隔抽数 -> 次数
+        self.streak: Dict[int, List] = {}                   # 星级 -> [当前是否为 UP, 当前连续长度]
+        self.up_streaks: Dict[int, Dict[int, int]] = {}     # 星级 -> 已结束的连续 UP 长度 -> 次数
+        self.standard_streaks: Dict[int, Dict[int, int]] = {}   # 星级 -> 已结束的连续非 UP 长度 -> 次数
+        self.fifty_fifty: Dict[int, List[int]] = {}         # 星级 -> [不歪, 歪, 歪后必得]
+        self.copies: Dict[str, Dict[str, int]] = {}         # 游戏 -> 卡片名称 -> 抽出次数
+
+    def add(self, order: int, tag: str, game: str, star: int, content: str):
+        """
+        追加一条累计抽数为 order 的记录
+        """
+        interval = order - self.last_seen.get(star, 0)
+        self.last_seen[star] = order
+        pity = self.pity.setdefault(star, {})
+        pity[interval] = pity.get(interval, 0) + 1
+
+        is_up = tag != TAG_STANDARD
+        streak = self.streak.get(star)
+        fifty_fifty = self.fifty_fifty.setdefault(star, [0, 0, 0])
+        if streak is None:
+            self.streak[star] = [is_up, 1]
+            fifty_fifty[0 if is_up else 1] += 1
+        else:
+            was_up, length = streak
+            if is_up:
+                fifty_fifty[0 if was_up else 2] += 1
+            else:
+                fifty_fifty[1] += 1
+            if is_up == was_up:
+                streak[1] = length + 1
+            else:
+                ended = (self.up_streaks if was_up else self.standard_streaks).setdefault(star, {})
+                ended[length] = ended.get(length, 0) + 1
+                streak[0] = is_up
+                streak[1] = 1
+
+        game_copies = self.copies.setdefault(game, {})
+        game_copies[content] = game_copies.get(content, 0) + 1
+
+    def to_dict(self) -> Dict:
+        """
+        转换为可保存为 json 的字典 (深拷贝)
+        """
+        def histograms(data: Dict[int, Dict[int, int]]) -> Dict[str, Dict[str, int]]:
+            return {str(star): {str(k): v for k, v in counts.items()} for star, counts in data.items()}
+
+        return {
+            "last_seen": {str(star): order for star, order in self.last_seen.items()},
+            "pity": histograms(self.pity),
+            "streak": {str(star): list(streak) for star, streak in self.streak.items()},
+            "up_streaks": histograms(self.up_streaks),
+            "standard_streaks": histograms(self.standard_streaks),
+            "fifty_fifty": {str(star): list(counts) for star, counts in self.fifty_fifty.items()},
+            "copies": {game: dict(contents) for game, contents in self.copies.items()},
+        }
+
+    @staticmethod
+    def from_dict(data: Dict) -> "RecordStats":
+        """
+        由 to_dict 的结果创建
+        """
+        def histograms(data: Dict[str, Dict[str, int]]) -> Dict[int, Dict[int, int]]:
+            return {int(star): {int(k): v for k, v in counts.items()} for star, counts in data.items()}
+
+        stats = RecordStats()
+        stats.last_seen = {int(star): order for star, order in data["last_seen"].items()}
+        stats.pity = histograms(data["pity"])
+        stats.streak = {int(star): list(streak) for star, streak in data["streak"].items()}
+        stats.up_streaks = histograms(data["up_streaks"])
+        stats.standard_streaks = histograms(data["standard_streaks"])
+        stats.fifty_fifty = {int(star): list(counts) for star, counts in data["fifty_fifty"].items()}
+        stats.copies = {game: dict(contents) for game, contents in data["copies"].items()}
+        return stats
+
+    def pity_histogram(self, star: int) -> Dict[int, int]:
+        """
+        该星级的保底分布: 间隔抽数 -> 次数, 按间隔抽数排序
+        """
+        return dict(sorted(self.pity.get(star, {}).items()))
+
+    def mean_pity(self, star: int) -> float:
+        """
+        该星级的平均间隔抽数
+        """
+        pity = self.pity.get(star, {})
+        total = sum(pity.values())
+        return sum(interval * count for interval, count in pity.items()) / total if total else 0.0
+
+    def streaks(self, star: int, up: bool = True) -> Dict[int, int]:
+        """
+        该星级的连续 UP (up 为 True) 或连续非 UP 的长度分布, 包括当前未结束的连续记录
+        """
+        streaks = dict((self.up_streaks if up else self.standard_streaks).get(star, {}))
+        current = self.streak.get(star)
+        if current is not None and current[0] == up:
+            streaks[current[1]] = streaks.get(current[1], 0) + 1
+        return dict(sorted(streaks.items()))
+
+    def longest_streak(self, star: int, up: bool = True) -> int:
+        """
+        该星级最长的连续 UP 或连续非 UP 长度
+        """
+        return max(self.streaks(star, up), default=0)
+
+    def fifty_fifty_counts(self, star: int) -> Tuple[int, int, int]:
+        """
+        该星级的 (不歪, 歪, 歪后必得) 次数
+        """
+        won, lost, guaranteed = self.fifty_fifty.get(star, (0, 0, 0))
+        return won, lost, guaranteed
+
+    def win_rate(self, star: int) -> float:
+        """
+        该星级小保底不歪的比例: 不歪 / (不歪 + 歪)
+        """
+        won, lost, _ = self.fifty_fifty_counts(star)
+        return won / (won + lost) if won + lost else 0.0
+
+    def guaranteed_rate(self, star: int) -> float:
+        """
+        该星级 UP 结果中歪后必得的比例
+        """
+        won, _, guaranteed = self.fifty_fifty_counts(star)
+        return guaranteed / (won + guaranteed) if won + guaranteed else 0.0
+
+    def card_copies(self, game: str, content: str) -> int:
+        """
+        卡片的抽出次数
+        """
+        return self.copies.get(game, {}).get(content, 0)
@@ -0,0 +1,93 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    RecordWriter
+
+Description
+_
+    Wishes 后台记录写入模块
+    WishRecorder 启用后台写入后, 抽卡线程只把记录追加到内存缓存, 由后台线程批量写入文件 (组提交)
+    刷新策略:
+        按记录数     缓存记录数达到 flush_count 时唤醒后台线程
+        按时间       距上次刷新超过 flush_interval 秒时刷新
+        退出时       close() 或解释器退出时写入剩余记录
+    每次刷新只重写一次 profile.json, 期间的多次抽卡记录合并为一次写入
+"""
+
+
+from Const import *
+from typing import Dict, TYPE_CHECKING
+import atexit
+import threading
+
+if TYPE_CHECKING:
+    from WishRecorder import WishRecorder
+
+
+class RecordWriter:
+    """
+    后台记录写入线程
+    """
+    def __init__(
+            self,
+            recorder: "WishRecorder",
+            flush_count: int = RECORD_FLUSH_COUNT,
+            flush_interval: float = RECORD_FLUSH_INTERVAL
+            ) -> None:
+        if flush_count <= 0:
+            raise ValueError(f"Invalid flush count: {flush_count}")
+        if flush_interval <= 0:
+            raise ValueError(f"Invalid flush interval: {flush_interval}")
+        self.recorder = recorder
+        self.flush_count = flush_count          # 触发刷新的缓存记录数
+        self.flush_interval = flush_interval    # 最长刷新间隔 (秒)
+        self.error: BaseException | None = None # 后台写入时发生的异常, 在 close() 时重新抛出
+
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=f"RecordWriter-{recorder.dir}", daemon=True)
+
+    def config(self) -> Dict:
+        """
+        写入配置, 可用于重新创建写入线程
+        """
+        return {"flush_count": self.flush_count, "flush_interval": self.flush_interval}
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.close)
+
+    def notify(self):
+        """
+        唤醒后台线程立即刷新
+        """
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.recorder._flush()
+            except BaseException as e:
+                # 保留缓存中的记录, 由 close() 时的同步刷新重试
+                self.error = e
+
+    def close(self):
+        """
+        停止后台线程并写入剩余记录
+        """
+        if self._stopping:
+            return
+        self._stopping = True
+        atexit.unregister(self.close)
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.recorder._flush(checkpoint=True)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
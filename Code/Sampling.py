@@ -0,0 +1,100 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    Sampling
+
+Description
+_
+    Wishes 抽样模块
+    预先计算累积权重表, 抽取时只需一次随机数和一次查找
+    在相同随机数序列下, 抽取结果与 random.choices 完全一致
+"""
+
+
+from Const import *
+from bisect import bisect
+from typing import Any, Callable, Dict, Sequence, Tuple
+import random
+
+
+# 随机数函数, 返回 [0, 1) 内的浮点数
+RandomFunc = Callable[[], float]
+
+
+def bernoulli(weight: int, rand: RandomFunc = random.random) -> bool:
+    """
+    以 weight / MAX_PROBABILITY 的概率返回 True
+    与 random.choices((True, False), (weight, MAX_PROBABILITY - weight))[0] 结果一致:
+    两者的累积权重为 (weight, MAX_PROBABILITY), 仅当 random() * MAX_PROBABILITY < weight 时落入第一项
+    """
+    return rand() * MAX_PROBABILITY < weight
+
+
+class WeightTable:
+    """
+    累积权重表
+    建表时计算累积权重, 抽取时在累积权重上二分查找随机数所在区间
+    与 random.choices(population, weights)[0] 的查找方式相同, 因此结果一致
+    """
+    __slots__ = ("population", "weights", "cum_weights", "total", "hi")
+
+    def __init__(self, population: Sequence, weights: Sequence[int]) -> None:
+        if len(population) != len(weights):
+            raise ValueError("The number of weights does not match the population")
+
+        self.population: Tuple = tuple(population)
+        self.weights: Tuple[int, ...] = tuple(weights)
+
+        cum_weights = []
+        total = 0
+        for weight in self.weights:
+            total += weight
+            cum_weights.append(total)
+        self.cum_weights: Tuple[int, ...] = tuple(cum_weights)
+        self.total: int = total
+        self.hi: int = len(self.population) - 1
+
+    def draw(self, rand: RandomFunc = random.random) -> Any:
+        """
+        按权重抽取一项
+        权重和不为正数时抛出 ValueError, 与 random.choices 一致
+        """
+        if self.total <= 0:
+            raise ValueError("Total of weights must be greater than zero")
+        return self.population[bisect(self.cum_weights, rand() * self.total, 0, self.hi)]
+
+    def __len__(self) -> int:
+        return len(self.population)
+
+    def __repr__(self) -> str:
+        return f"WeightTable({dict(zip(self.population, self.weights))})"
+
+
+class WeightTableCache:
+    """
+    累积权重表缓存
+    候选项固定, 权重可变 (如概率增长规则修改后的星级概率)
+    以权重元组为键缓存权重表, 仅当出现新的权重组合时才重新建表
+    """
+    def __init__(self, population: Sequence, max_size: int = SAMPLING_CACHE_SIZE) -> None:
+        self.population: Tuple = tuple(population)
+        self.max_size = max_size
+        self.tables: Dict[Tuple[int, ...], WeightTable] = {}
+
+    def get(self, weights: Tuple[int, ...]) -> WeightTable:
+        """
+        获取权重对应的权重表
+        缓存已满时清空缓存, 权重组合数量通常很少, 不需要更精细的淘汰策略
+        """
+        table = self.tables.get(weights)
+        if table is None:
+            if len(self.tables) >= self.max_size:
+                self.tables.clear()
+            table = self.tables[weights] = WeightTable(self.population, weights)
+        return table
+
+    def clear(self):
+        self.tables.clear()
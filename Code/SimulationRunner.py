@@ -0,0 +1,237 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    SimulationRunner
+
+Description
+_
+    Wishes 并行模拟模块
+    将 "N 个玩家 × M 抽" 的大规模模拟任务按玩家分片, 分发到进程池中执行, 最后合并各分片的统计结果
+    每个玩家使用独立的随机数流, 种子由主种子和 (任务名称, 玩家序号) 派生
+    因此模拟结果只取决于主种子, 与进程数和分片大小无关
+"""
+
+
+from Const import *
+from Base import *
+from WishRule import WishLogic
+from CardPool import CardPool
+from WishRandom import MersenneBackend, make_rng
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence, Tuple
+import hashlib
+import os
+
+
+def derive_seed(master_seed: int, *keys) -> int:
+    """
+    由主种子和任意标识派生 64 位子种子
+    使用哈希而非 random 派生, 保证不同标识的子种子互相独立, 且不依赖派生顺序
+    """
+    digest = hashlib.blake2b(repr((master_seed, *keys)).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+@dataclass
+class SimulationStats:
+    """
+    模拟统计结果
+    所有统计量均为计数, 不同分片的结果可直接相加合并
+    """
+    players: int = 0
+    draws: int = 0
+    star_counts: Dict[int, int] = field(default_factory=dict)               # 星级 -> 次数
+    tag_counts: Dict[int, Dict[str, int]] = field(default_factory=dict)     # 星级 -> 实际标签 -> 次数
+    star_intervals: Dict[int, Dict[int, int]] = field(default_factory=dict) # 星级 -> 相邻两次出现的间隔抽数 -> 次数
+
+    def merge(self, other: "SimulationStats"):
+        """
+        合并其他分片的统计结果
+        """
+        self.players += other.players
+        self.draws += other.draws
+        for star, count in other.star_counts.items():
+            self.star_counts[star] = self.star_counts.get(star, 0) + count
+        for star, tags in other.tag_counts.items():
+            target = self.tag_counts.setdefault(star, {})
+            for tag, count in tags.items():
+                target[tag] = target.get(tag, 0) + count
+        for star, intervals in other.star_intervals.items():
+            target = self.star_intervals.setdefault(star, {})
+            for interval, count in intervals.items():
+                target[interval] = target.get(interval, 0) + count
+
+    def rate(self, star: int) -> float:
+        """
+        星级出现率
+        """
+        return self.star_counts.get(star, 0) / self.draws if self.draws else 0.0
+
+    def tag_rate(self, star: int, tag: str) -> float:
+        """
+        该星级结果中实际标签为 tag 的比例
+        """
+        count = self.star_counts.get(star, 0)
+        return self.tag_counts.get(star, {}).get(tag, 0) / count if count else 0.0
+
+    def mean_interval(self, star: int) -> float:
+        """
+        该星级相邻两次出现的平均间隔抽数
+        *每个玩家的第一次间隔从该玩家的第一抽开始计算
+        """
+        intervals = self.star_intervals.get(star, {})
+        total = sum(intervals.values())
+        if not total:
+            return 0.0
+        return sum(interval * count for interval, count in intervals.items()) / total
+
+
+@dataclass
+class SimulationTask:
+    """
+    模拟任务
+    所有玩家都从 logic_state 指定的逻辑状态开始抽卡
+    """
+    name: str
+    logic_config: Dict
+    card_group: CardGroup
+    players: int
+    draws: int
+    logic_state: Dict = field(default_factory=dict)
+
+    @staticmethod
+    def from_card_pool(card_pool: CardPool, players: int, draws: int, with_state: bool = True) -> "SimulationTask":
+        """
+        由卡池创建模拟任务
+        with_state: 是否从卡池当前的逻辑状态开始抽卡
+        """
+        return SimulationTask(
+            card_pool.name,
+            card_pool.logic.config,
+            card_pool.card_group,
+            players,
+            draws,
+            card_pool.get_logic_state() if with_state else {}
+        )
+
+
+# 工作进程中的任务列表, 由进程池初始化函数设置, 避免每个分片重复传输卡组
+_worker_tasks: List[SimulationTask] = []
+
+
+def _init_worker(tasks: List[SimulationTask]):
+    global _worker_tasks
+    _worker_tasks = tasks
+
+
+def _run_shard(task: SimulationTask, first_player: int, players: int, master_seed: int, backend: str) -> SimulationStats:
+    """
+    执行一个分片: 玩家序号为 [first_player, first_player + players)
+    分片内共用一个随机数后端, 每个玩家开始前重新设定种子
+    """
+    stats = SimulationStats()
+    rng = make_rng(backend)
+    logic = WishLogic(task.logic_config, rng=rng)
+    card_group = task.card_group
+    star_counts = stats.star_counts
+    tag_counts = stats.tag_counts
+    star_intervals = stats.star_intervals
+
+    logic.load_state(task.logic_state)
+    initial_state = logic.snapshot()    # 每个玩家都从快照恢复初始状态, 无需重复解析状态字典
+
+    for player in range(first_player, first_player + players):
+        rng.seed(derive_seed(master_seed, task.name, player))
+        logic.reset()
+        logic.restore(initial_state)
+        last_hit: Dict[int, int] = {}   # 星级 -> 上次出现的抽数
+
+        for draw in range(1, task.draws + 1):
+            logic_result = logic.wish()
+            tag = logic_result.real_tag()
+            packed_card = card_group.random_card(logic_result.type_, logic_result.star, tag, rng)
+            logic.callback(packed_card)
+
+            star = logic_result.star
+            star_counts[star] = star_counts.get(star, 0) + 1
+            star_tags = tag_counts.setdefault(star, {})
+            star_tags[tag] = star_tags.get(tag, 0) + 1
+            interval = draw - last_hit.get(star, 0)
+            last_hit[star] = draw
+            intervals = star_intervals.setdefault(star, {})
+            intervals[interval] = intervals.get(interval, 0) + 1
+
+    stats.players = players
+    stats.draws = players * task.draws
+    return stats
+
+
+def _run_worker_shard(task_index: int, first_player: int, players: int, master_seed: int, backend: str) -> SimulationStats:
+    return _run_shard(_worker_tasks[task_index], first_player, players, master_seed, backend)
+
+
+class SimulationRunner:
+    """
+    并行模拟执行器
+    workers 为 1 时在当前进程内执行, 结果与多进程执行完全相同
+    backend 为随机数后端名称, 见 WishRandom
+    """
+    def __init__(self, workers: int | None = None, shard_size: int = 100, backend: str = MersenneBackend.name) -> None:
+        if shard_size <= 0:
+            raise ValueError(f"Invalid shard size: {shard_size}")
+        make_rng(backend)   # 检查后端是否可用
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.shard_size = shard_size    # 每个分片的玩家数
+        self.backend = backend
+
+    def shards(self, task: SimulationTask) -> List[Tuple[int, int]]:
+        """
+        将任务按玩家划分为分片, 返回 (起始玩家序号, 玩家数) 列表
+        """
+        return [
+            (first, min(self.shard_size, task.players - first))
+            for first in range(0, task.players, self.shard_size)
+        ]
+
+    def run(self, tasks: SimulationTask | Sequence[SimulationTask], seed: int) -> Dict[str, SimulationStats]:
+        """
+        执行模拟任务, 返回 任务名称: 统计结果
+        """
+        tasks = [tasks] if isinstance(tasks, SimulationTask) else list(tasks)
+        names = [task.name for task in tasks]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate simulation task names: {names}")
+
+        jobs = [
+            (task_index, first, players)
+            for task_index, task in enumerate(tasks)
+            for first, players in self.shards(task)
+        ]
+
+        if self.workers == 1 or len(jobs) <= 1:
+            shard_stats = [
+                _run_shard(tasks[task_index], first, players, seed, self.backend)
+                for task_index, first, players in jobs
+            ]
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(self.workers, len(jobs)),
+                initializer=_init_worker,
+                initargs=(tasks,)
+            ) as executor:
+                futures = [
+                    executor.submit(_run_worker_shard, task_index, first, players, seed, self.backend)
+                    for task_index, first, players in jobs
+                ]
+                shard_stats = [future.result() for future in futures]
+
+        # 按分片顺序合并, 保证结果与执行顺序无关
+        results = {task.name: SimulationStats() for task in tasks}
+        for (task_index, _, _), stats in zip(jobs, shard_stats):
+            results[tasks[task_index].name].merge(stats)
+
+        return results
@@ -0,0 +1,218 @@
+r"""
+Wishes v3.0
+-----------
+
+Module
+_
+    WishRandom
+
+Description
+_
+    Wishes 随机数后端模块
+    抽卡逻辑和卡组通过随机数后端取得随机数, 每个卡池可以拥有独立的、可设定种子的随机数流
+    支持的后端:
+        global      全局 random 模块 (默认, 受 random.seed 影响)
+        mersenne    独立的 random.Random 实例 (梅森旋转)
+        pcg64       NumPy PCG64, 批量预生成随机数
+        philox      NumPy Philox, 批量预生成随机数
+    *NumPy 仅在使用对应后端时导入
+"""
+
+
+from Const import *
+from abc import abstractmethod, ABC
+from functools import partial
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Type
+import random
+
+
+class RandomBackend(ABC):
+    """
+    随机数后端基类
+    random 和 choice 是实例属性, 指向底层生成器的方法, 调用时没有额外的 Python 函数开销
+    重新设定种子时原地更新这两个属性, 持有后端对象的规则无需重新编译
+    """
+    # 后端标识符
+    name: str = "RandomBackend"
+
+    def __init__(self, seed: int | None = None) -> None:
+        self.seed_value = seed
+        self.random: Callable[[], float]            # 返回 [0, 1) 内的浮点数
+        self.choice: Callable[[Sequence], Any]      # 从非空序列中随机选取一项
+
+    @abstractmethod
+    def seed(self, seed: int | None = None):
+        """
+        重新设定种子, seed 为 None 时使用系统熵源
+        """
+        pass
+
+    def config(self) -> Dict:
+        """
+        后端配置, 可通过 make_rng(**config) 重建后端
+        """
+        return {
+            "backend": self.name,
+            "seed": self.seed_value
+        }
+
+
+class GlobalRandomBackend(RandomBackend):
+    """
+    全局 random 模块后端
+    与未引入随机数后端时的行为完全一致
+    """
+    name: str = "global"
+
+    def __init__(self, seed: int | None = None) -> None:
+        super().__init__(seed)
+        self.random = random.random
+        self.choice = random.choice
+        if seed is not None:
+            self.seed(seed)
+
+    def seed(self, seed: int | None = None):
+        """
+        *将重新设定全局 random 模块的种子
+        """
+        self.seed_value = seed
+        random.seed(seed)
+
+
+class MersenneBackend(RandomBackend):
+    """
+    独立的梅森旋转后端
+    与使用同一种子的全局 random 模块产生相同的随机数序列
+    """
+    name: str = "mersenne"
+
+    def __init__(self, seed: int | None = None) -> None:
+        super().__init__(seed)
+        self.generator = random.Random(seed)
+        self._bind()
+
+    def _bind(self):
+        self.random = self.generator.random
+        self.choice = self.generator.choice
+
+    def seed(self, seed: int | None = None):
+        self.seed_value = seed
+        self.generator.seed(seed)
+
+    def __getstate__(self) -> Dict:
+        return {
+            "seed_value": self.seed_value,
+            "generator": self.generator
+        }
+
+    def __setstate__(self, state: Dict):
+        self.seed_value = state["seed_value"]
+        self.generator = state["generator"]
+        self._bind()
+
+
+class NumpyBackend(RandomBackend):
+    """
+    NumPy 随机数后端基类
+    每次批量生成 buffer_size 个随机数, 通过 C 层的迭代器逐个取出
+    复制或序列化时保存缓冲区中剩余的随机数, 副本与原后端产生相同的后续序列
+    """
+    # NumPy 位生成器名称
+    bit_generator: str = ""
+
+    def __init__(self, seed: int | None = None, buffer_size: int = RANDOM_BUFFER_SIZE) -> None:
+        super().__init__(seed)
+        if buffer_size <= 0:
+            raise ValueError(f"Invalid buffer size: {buffer_size}")
+        self.buffer_size = buffer_size
+        self.seed(seed)
+
+    def _start(self, bit_generator, buffered: List[float] | None = None):
+        """
+        使用位生成器创建生成器, 并建立缓冲随机数流
+        buffered 为流开头的剩余随机数, 用于恢复复制前的缓冲区
+        """
+        import numpy as np
+
+        self.generator = np.random.Generator(bit_generator)
+        self._buffer: List[float] = buffered if buffered else []
+        self._current: Iterator[float] = iter(self._buffer)
+        # iter(callable, sentinel) 在缓冲区耗尽时批量生成下一组随机数, 迭代器永不等于 None
+        # chain 对迭代器调用 iter 得到其本身, 因此 self._current 即为正在消耗的缓冲区
+        stream = chain.from_iterable(chain((self._current,), iter(self._refill, None)))
+        self.random = partial(next, stream)
+        self.choice = self._choice
+
+    def _refill(self) -> Iterator[float]:
+        self._buffer = self.generator.random(self.buffer_size).tolist()
+        self._current = iter(self._buffer)
+        return self._current
+
+    def _choice(self, seq: Sequence) -> Any:
+        return seq[int(self.random() * len(seq))]
+
+    def seed(self, seed: int | None = None):
+        import numpy as np
+
+        self.seed_value = seed
+        self._start(getattr(np.random, self.bit_generator)(seed))
+
+    def __getstate__(self) -> Dict:
+        remaining = self._current.__length_hint__() # type: ignore
+        return {
+            "seed_value": self.seed_value,
+            "buffer_size": self.buffer_size,
+            "state": self.generator.bit_generator.state,
+            "buffered": self._buffer[len(self._buffer) - remaining:]
+        }
+
+    def __setstate__(self, state: Dict):
+        import numpy as np
+
+        self.seed_value = state["seed_value"]
+        self.buffer_size = state["buffer_size"]
+        bit_generator = getattr(np.random, self.bit_generator)()
+        bit_generator.state = state["state"]
+        self._start(bit_generator, state["buffered"])
+
+
+class PCG64Backend(NumpyBackend):
+    """
+    NumPy PCG64 后端
+    """
+    name: str = "pcg64"
+    bit_generator: str = "PCG64"
+
+
+class PhiloxBackend(NumpyBackend):
+    """
+    NumPy Philox 后端 (基于计数器, 适合大量独立流)
+    """
+    name: str = "philox"
+    bit_generator: str = "Philox"
+
+
+# 共用的全局 random 模块后端, 未指定随机数后端的逻辑会话都使用它
+GLOBAL_RNG = GlobalRandomBackend()
+
+
+def name_to_rng_class(name: str) -> Type[RandomBackend]:
+    match name:
+        case GlobalRandomBackend.name:
+            return GlobalRandomBackend
+        case MersenneBackend.name:
+            return MersenneBackend
+        case PCG64Backend.name:
+            return PCG64Backend
+        case PhiloxBackend.name:
+            return PhiloxBackend
+        case _:
+            raise ValueError(f"Unknown random backend: {name}")
+
+
+def make_rng(backend: str = GlobalRandomBackend.name, seed: int | None = None, **kwargs) -> RandomBackend:
+    """
+    根据后端名称创建随机数后端
+    """
+    return name_to_rng_class(backend)(seed, **kwargs)
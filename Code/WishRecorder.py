@@ -9,64 +9,33 @@ _
 Description
 _
     Wishes 抽卡记录模块
+    details 和 interval 记录由记录日志后端写入, 见 RecordLog
+    可启用后台写入, 由 RecordWriter 线程批量写入文件, 见 RecordWriter
+    details 记录可通过 query() 按条件查询, 见 RecordQuery
+    stats 为增量维护的在线统计 (保底分布、连续 UP、小保底、卡片数量), 随 profile 保存, 见 RecordStats
+    崩溃恢复:
+        profile.json 是计数器的检查点, 通过 临时文件 + 重命名 原子替换, 并记录检查点对应的日志位置
+        加载时重放检查点之后的 details 记录, 恢复计数器并重建 interval 日志尾部, 见 RecordLog
+        持久化模式 (durability):
+            none        不主动写入磁盘, 由操作系统决定
+            batch       每次写入检查点前将日志写入磁盘 (fsync)
+            flush       每次写入日志后都将日志写入磁盘, 检查点同样写入磁盘
+    分段:
+        segments 为 details 日志的分段配置 (见 RecordLog), 每次写入日志后检查是否需要轮换
+        检查点之后封存的分段在恢复时同样会被重放
 """
 
 
 import os
-import csv
 import json
-import datetime as dt
+import time
+import threading
 from Const import *
 from Base import *
-from dataclasses import dataclass
-
-
-@dataclass
-class CardCache:
-    """
-    单张卡片缓存
-    """
-    order: int                  # 累计抽数
-    time: str                   # 时间
-    packed_card: PackedCard     # 卡片信息
-
-    def __str__(self) -> str:
-        """
-        返回 csv 格式的单行字符串
-        """
-        card = self.packed_card.card
-        return ",".join((
-            str(self.order),
-            self.time,
-            self.packed_card.real_tag,
-            card.game,
-            card.type,
-            str(card.star),
-            card.content
-        ))
-
-
-@dataclass
-class IntervalCache:
-    """
-    间隔缓存
-    """
-    counter: int                # 间隔抽数
-    packed_card: PackedCard     # 卡片信息
-
-    def __str__(self) -> str:
-        """
-        返回 csv 格式的单行字符串
-        """
-        card = self.packed_card.card
-        return ",".join((
-            str(self.counter),
-            self.packed_card.real_tag,
-            card.game,
-            card.type,
-            str(card.star),
-            card.content
-        ))
+from RecordLog import *
+from RecordWriter import RecordWriter
+from RecordQuery import RecordQuery, SqliteRecordQuery, make_query
+from RecordStats import RecordStats
 
 
 class WishRecorder:
@@ -74,9 +43,31 @@ class WishRecorder:
     抽卡记录管理类
     管理单个卡池的抽卡记录
     *为方便解析，内部使用字符串表示星级
+    backend 为记录日志后端名称, 见 RecordLog
+    durability 为持久化模式, checkpoint_interval 为两次检查点之间的写入次数
+    segments 为 details 日志的分段配置 {"size", "records", "compression"}, 为 None 时不分段
     """
-    def __init__(self, record_dir: str, max_star: int):
+    def __init__(
+            self,
+            record_dir: str,
+            max_star: int,
+            backend: str = CsvRecordLog.name,
+            durability: str = RECORD_DURABILITY_NONE,
+            checkpoint_interval: int = RECORD_CHECKPOINT_INTERVAL,
+            segments: Dict | None = None
+            ):
+        if durability not in (RECORD_DURABILITY_NONE, RECORD_DURABILITY_BATCH, RECORD_DURABILITY_FLUSH):
+            raise ValueError(f"Unknown record durability: {durability}")
+        if checkpoint_interval <= 0:
+            raise ValueError(f"Invalid checkpoint interval: {checkpoint_interval}")
         self.dir = record_dir
+        self.log = make_record_log(backend, record_dir)
+        self.durability = durability
+        self.log.set_durability(durability)
+        if segments is not None:
+            self.log.configure_segments(**segments)
+        self.checkpoint_interval = checkpoint_interval
+        self._flush_counter = 0     # 上次检查点之后的写入次数
 
         # 总抽数
         self.total_counter = 0
@@ -92,129 +83,250 @@ class WishRecorder:
         self.max_star_interval_counter = 0                  # 最高星级间隔抽数
         self.max_star_cache_list: List[IntervalCache] = []  # 最高星级缓存，只记录最高星级卡片
 
+        self.stats = RecordStats()                          # 在线统计
+        self._stats_missing = False                         # 加载的 profile 是否缺少在线统计
+
+        self.writer: RecordWriter | None = None             # 后台写入线程, 见 start_writer()
+        self._query: RecordQuery | SqliteRecordQuery | None = None  # 记录查询, 首次查询时创建
+        self._lock = threading.Lock()                       # 保护计数器和缓存
+        self._io_lock = threading.Lock()                    # 保证各批缓存按顺序写入
+
         if self._init_file():
             self.load_profile(self.dir)
+            self._recover()
 
     def _init_file(self) -> bool:
         """
         初始化文件，若文件已存在则不操作
         返回 profile 文件是否已存在
         """
+        if self.log.stores_profile:
+            # profile 由记录日志后端保存, 不创建记录目录
+            self.log.init_files()
+            if self.log.load_profile() is None:
+                self._write_profile(self._profile_data())
+                return False
+            return True
+
         profile_path = os.path.join(self.dir, "profile.json")
-        details_path = os.path.join(self.dir, "details.csv")
-        interval_path = os.path.join(self.dir, "interval.csv")
         flag = True
         if not os.path.exists(self.dir):
             os.mkdir(self.dir)
             flag = False
 
+        self.log.init_files()
+
         if not os.path.exists(profile_path):
-            with open(profile_path, "w", encoding="utf-8") as f:
-                data = {
-                    "cache_size": self.cache_size,
-                    "total": self.total_counter,
-                    "max_star_interval": self.max_star_interval_counter,
-                    "counters": self.counters,
-                }
-                json.dump(data, f, indent=4, ensure_ascii=False)
+            self._write_profile(self._profile_data() | {"log": self.log.positions()})
             flag = False
-        
-        if not os.path.exists(details_path):
-            with open(details_path, "w", encoding="utf-8") as f:
-                pass
-        
-        if not os.path.exists(interval_path):
-            with open(interval_path, "w", encoding="utf-8") as f:
-                pass
             
         return flag
-    
-    def _write_file(self):
+
+    def _profile_data(self) -> Dict:
         """
-        将 profile数据 和 缓存 写入文件
+        当前计数器的检查点数据, 日志位置 "log" 需在日志写入后填入
         """
-        profile_data = {
+        return {
             "cache_size": self.cache_size,
             "total": self.total_counter,
             "max_star_interval": self.max_star_interval_counter,
-            "counters": self.counters,
+            "counters": {
+                tag: {type_: dict(stars) for type_, stars in types.items()}
+                for tag, types in self.counters.items()
+            },
+            "stats": self.stats.to_dict(),
         }
+
+    def _write_profile(self, profile_data: Dict):
+        """
+        原子地替换 profile 文件: 先写入临时文件, 再重命名
+        """
+        if self.log.stores_profile:
+            self.log.write([], [], profile_data)
+            return
+
         profile_path = os.path.join(self.dir, "profile.json")
-        with open(profile_path, "w", encoding="utf-8", newline="") as f:
+        temp_path = profile_path + ".tmp"
+        durable = self.durability != RECORD_DURABILITY_NONE
+        with open(temp_path, "w", encoding="utf-8", newline="") as f:
             json.dump(profile_data, f, indent=4, ensure_ascii=False)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, profile_path)
 
-        if self.cache_list:
-            details_path = os.path.join(self.dir, "details.csv")
-            with open(details_path, "a+", encoding="utf-8", newline="") as f:
-                for row in self.cache_list:
-                    f.write(str(row) + "\n")
-            self.cache_list.clear()
-        
-        if self.max_star_cache_list:
-            interval_path = os.path.join(self.dir, "interval.csv")
-            with open(interval_path, "a+", encoding="utf-8", newline="") as f:
-                for row in self.max_star_cache_list:
-                    f.write(str(row) + "\n")
-            self.max_star_cache_list.clear()
+        # 重命名本身也需写入磁盘, 部分平台不支持打开目录
+        if durable and hasattr(os, "O_DIRECTORY"):
+            fd = os.open(self.dir, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _recover(self):
+        """
+        重放检查点之后的 details 记录
+        日志比检查点记录的位置更短时 (检查点之后日志被截断或重置), 从头重新统计
+        """
+        positions = self._checkpoint_positions
+        if positions is not None and not self.log.positions_valid(positions):
+            positions = None
+        if self._stats_missing and not self.log.stores_profile:
+            # 旧版本的 profile 没有在线统计, 从头重新统计一次
+            positions = None
+
+        if positions is None:
+            self.total_counter = 0
+            self.max_star_interval_counter = 0
+            self.counters = {}
+            self.stats = RecordStats()
+
+        rows, self.max_star_interval_counter = self.log.recover(positions, self.max_star, self.max_star_interval_counter)
+        for order, tag, game, type_, star, content in rows:
+            self.total_counter = order
+            self._count(tag, type_, str(star))
+            self.stats.add(order, tag, game, star, content)
+
+        if positions is None or rows:
+            self._checkpoint(self._profile_data() | {"log": self.log.positions()})
+    
+    def _write_file(self):
+        """
+        将 profile数据 和 缓存 写入文件
+        """
+        self._flush(checkpoint=True)
+
+    def _flush(self, checkpoint: bool = False):
+        """
+        取出当前缓存并写入日志, 每 checkpoint_interval 次写入 (或 checkpoint 为 True 时) 写入一次检查点
+        检查点只按取出缓存时的数据重写一次 profile
+        后台写入线程和同步写入共用此方法
+        """
+        with self._io_lock:
+            # 由后端保存 profile 时, profile 与记录在同一事务中写入, 每次写入都是检查点
+            checkpoint = checkpoint or self.log.stores_profile or self._flush_counter + 1 >= self.checkpoint_interval
+            with self._lock:
+                details, self.cache_list = self.cache_list, []
+                intervals, self.max_star_cache_list = self.max_star_cache_list, []
+                profile_data = self._profile_data() if checkpoint else None
+
+            try:
+                self.log.write(details, intervals, profile_data if self.log.stores_profile else None)
+            except BaseException:
+                # 写入失败时将记录放回缓存, 等待下次写入
+                with self._lock:
+                    self.cache_list[:0] = details
+                    self.max_star_cache_list[:0] = intervals
+                raise
+            if self.log.stores_profile:
+                return
+
+            if self.durability == RECORD_DURABILITY_FLUSH:
+                self.log.sync()
+
+            if details and self.log.should_rotate(details[-1].order):
+                # 上一个检查点的日志位置仍指向新封存的分段, 不需要立即写入检查点
+                self.log.rotate()
+
+            self._flush_counter += 1
+            if profile_data is not None:
+                profile_data["log"] = self.log.positions()
+                self._checkpoint(profile_data)
+
+    def _checkpoint(self, profile_data: Dict):
+        """
+        写入检查点, 持久化模式为 batch 时先将日志写入磁盘
+        """
+        if self.durability == RECORD_DURABILITY_BATCH:
+            self.log.sync()
+        self._write_profile(profile_data)
+        self._flush_counter = 0
+
+    def start_writer(self, flush_count: int = RECORD_FLUSH_COUNT, flush_interval: float = RECORD_FLUSH_INTERVAL):
+        """
+        启用后台写入: 缓存记录数达到 flush_count 或距上次写入超过 flush_interval 秒时, 由后台线程写入文件
+        启用期间文件句柄保持打开
+        """
+        if self.writer is not None:
+            self.stop_writer()
+        self.log.open()
+        self.writer = RecordWriter(self, flush_count, flush_interval)
+        self.writer.start()
+
+    def stop_writer(self):
+        """
+        停止后台写入并写入剩余记录
+        """
+        writer, self.writer = self.writer, None
+        if writer is None:
+            return
+        try:
+            writer.close()
+        finally:
+            self.log.close()
     
     def _reset_file(self):
         """
         重置文件数据
+        先重置日志, 此时若程序中断, 加载时日志短于检查点位置, 会从头重新统计
         """
-        profile_data = {
+        self.log.reset()
+        self._checkpoint({
             "cache_size": self.cache_size,
             "total": 0,
             "max_star_interval": 0,
             "counters": {},
-        }
-        profile_path = os.path.join(self.dir, "profile.json")
-        with open(profile_path, "w", encoding="utf-8", newline="") as f:
-            json.dump(profile_data, f, indent=4, ensure_ascii=False)
-
-        details_path = os.path.join(self.dir, "details.csv")
-        with open(details_path, "w", encoding="utf-8", newline="") as f:
-            pass
-
-        interval_path = os.path.join(self.dir, "interval.csv")
-        with open(interval_path, "w", encoding="utf-8", newline="") as f:
-            pass
+            "stats": RecordStats().to_dict(),
+            "log": self.log.positions(),
+        })
     
     def load_profile(self, record_dir: str):
         """
         从 profile 文件中加载数据
         """
-        profile_path = os.path.join(record_dir, "profile.json")
-        with open(profile_path, "r", encoding="utf-8") as f:
-            profile_data = json.load(f)
+        if self.log.stores_profile:
+            profile_data = self.log.load_profile()
+        else:
+            profile_path = os.path.join(record_dir, "profile.json")
+            with open(profile_path, "r", encoding="utf-8") as f:
+                profile_data = json.load(f)
         
         self.cache_size = profile_data["cache_size"]
         self.total_counter = profile_data["total"]
         self.max_star_interval_counter = profile_data["max_star_interval"]
         self.counters = profile_data["counters"]
+        stats = profile_data.get("stats")
+        self._stats_missing = not stats
+        self.stats = RecordStats.from_dict(stats) if stats else RecordStats()
+        # 旧版本的 profile 没有日志位置, 视为与日志一致
+        self._checkpoint_positions: Dict[str, int] | None = profile_data.get("log", self.log.positions())
         
     def add_record(self, packed_card: PackedCard):
         """
         追加单条记录
         """
+        with self._lock:
+            flush = self._add_record(packed_card)
+        if flush:
+            if self.writer is not None:
+                self.writer.notify()
+            else:
+                self._flush()
+
+    def _add_record(self, packed_card: PackedCard) -> bool:
+        """
+        将记录加入计数器和缓存, 返回是否需要写入文件
+        """
         self.total_counter += 1
         self.max_star_interval_counter += 1
         
-        if packed_card.real_tag not in self.counters:
-            self.counters[packed_card.real_tag] = {}
-        
         card = packed_card.card
-        if card.type not in self.counters[packed_card.real_tag]:
-            self.counters[packed_card.real_tag][card.type] = {}
-
-        star_string = str(card.star)
-        if star_string not in self.counters[packed_card.real_tag][card.type]:
-            self.counters[packed_card.real_tag][card.type][star_string] = 0
-
-        self.counters[packed_card.real_tag][card.type][star_string] += 1
+        self._count(packed_card.real_tag, card.type, str(card.star))
+        self.stats.add(self.total_counter, packed_card.real_tag, card.game, card.star, card.content)
 
         self.cache_list.append(CardCache(
             self.total_counter,
-            f"{dt.datetime.now().replace(microsecond=0)}",
+            int(time.time()),
             packed_card,
         ))
 
@@ -225,20 +337,47 @@ class WishRecorder:
             ))
             self.max_star_interval_counter = 0
         
-        if len(self.cache_list) >= self.cache_size:
-            self._write_file()
+        if self.writer is not None:
+            return len(self.cache_list) == self.writer.flush_count
+        return len(self.cache_list) >= self.cache_size
+
+    def _count(self, tag: str, type_: str, star_string: str):
+        """
+        计数器自增
+        """
+        if tag not in self.counters:
+            self.counters[tag] = {}
+        
+        if type_ not in self.counters[tag]:
+            self.counters[tag][type_] = {}
+
+        if star_string not in self.counters[tag][type_]:
+            self.counters[tag][type_][star_string] = 0
+
+        self.counters[tag][type_][star_string] += 1
 
     def clear(self):
         """
         清除记录
         """
-        self.total_counter = 0
-        self.max_star_interval_counter = 0
-        self.counters = {}
+        with self._io_lock:
+            with self._lock:
+                self.total_counter = 0
+                self.max_star_interval_counter = 0
+                self.counters = {}
+                self.stats = RecordStats()
 
-        self.cache_list = []
-        self.max_star_cache_list = []
-        
-        self._reset_file()
+                self.cache_list = []
+                self.max_star_cache_list = []
+            
+            self._reset_file()
 
-    # TODO: 查询 details 记录和 interval 记录
\ No newline at end of file
+    def query(self) -> RecordQuery | SqliteRecordQuery:
+        """
+        获取 details 记录查询, 见 RecordQuery
+        缓存中尚未写入的记录会先写入日志
+        """
+        self._flush()
+        if self._query is None or self._query.log is not self.log:
+            self._query = make_query(self.log)
+        return self._query
\ No newline at end of file
@@ -11,37 +11,147 @@ _
     Wishes 核心模块
     不同抽卡机制的模块化实现
     目的是实现卡池抽卡机制的可定制化
+    规则对象只保存不可变的规则参数, 计数器和保底标记等可变状态保存在逻辑会话的状态列表中
+    因此同一逻辑原型可被任意数量的会话 (玩家) 共享
 """
 
 
 from Base import *
 from Const import *
+from Sampling import *
+from WishRandom import *
 from abc import abstractmethod, ABC
-from typing import List, Dict, Type, Tuple, Optional
+from array import array
+from typing import List, Dict, Type, Tuple, Optional, Callable, Sequence, Iterable
 from copy import deepcopy
-import random
 
 
 class RuleContext:
     """
     规则执行上下文
+    每个逻辑会话拥有独立的上下文, 规则通讯桥梁由同一原型的所有会话共享
     """
-    def __init__(self) -> None:
+    __slots__ = ("result", "rule_bridge", "rng", "state", "packed_card_result", "star_table")
+
+    def __init__(
+            self,
+            rule_bridge: Dict[str, "BaseRule"] | None = None,
+            rng: RandomBackend | None = None,
+            state: array | None = None
+            ) -> None:
         # 当前抽逻辑结果
         self.result: Optional[LogicResult] = None
         # 规则通讯桥梁, 可通过规则 tag 名称访问规则对象
-        self.rule_bridge: Dict[str, BaseRule] = {}
+        self.rule_bridge: Dict[str, BaseRule] = rule_bridge if rule_bridge is not None else {}
+        # 随机数后端, 所有规则通过它取得随机数, 默认共用全局 random 模块后端
+        self.rng: RandomBackend = rng if rng is not None else GLOBAL_RNG
+        # 会话状态数组, 各规则的计数器和保底标记按 StateLayout 分配的槽位存放
+        self.state: array = state if state is not None else array(STATE_TYPECODE)
 
         # 当前抽实际结果
         self.packed_card_result: Optional[PackedCard] = None
 
+        # 当前抽星级权重表, 由概率增长规则给出, 为 None 时使用星级基础概率
+        self.star_table: Optional[WeightTable] = None
+
+
+# 编译后的规则阶段函数, 接收规则执行上下文
+RulePhase = Callable[[RuleContext], None]
+
+# 规则状态组: 状态名称 -> (键: 状态槽位 (星级 -> 类型 -> 状态槽位时嵌套一层), 是否为保底标记)
+StateGroups = Dict[str, Tuple[Dict, bool]]
+
+
+class StateLayout:
+    """
+    会话状态布局
+    构建逻辑原型时, 各规则依次申请状态槽位, 会话状态即按槽位顺序排列的整数数组
+    槽位在编译前确定, 编译后的规则直接以下标访问状态数组
+    计数器存放计数值, 保底标记存放 0 或 1
+    *保底标记从数组末尾向前申请, 槽位为负数下标, 所有标记连续存放在数组末尾, 每抽开始时可一次清除
+    """
+    def __init__(self) -> None:
+        self.counters: List[int] = []   # 计数器初始值
+        self.flags = 0                  # 保底标记数
+
+    @property
+    def initial_state(self) -> List[int]:
+        """
+        会话初始状态, 保底标记初始为 0
+        """
+        return self.counters + [0] * self.flags
+
+    def alloc(self, initial: int = 0) -> int:
+        """
+        申请一个状态槽位, 返回槽位下标
+        """
+        self.counters.append(initial)
+        return len(self.counters) - 1
+
+    def alloc_flag(self) -> int:
+        """
+        申请一个保底标记槽位, 返回负数槽位下标
+        """
+        self.flags += 1
+        return -self.flags
+
+    def alloc_group(self, keys: Iterable, initial: int = 0) -> Dict:
+        """
+        为每个键申请一个状态槽位, 返回 键: 槽位下标
+        """
+        return {
+            key: self.alloc(initial)
+            for key in keys
+        }
+
+    def alloc_flag_group(self, keys: Iterable) -> Dict:
+        """
+        为每个键申请一个保底标记槽位, 返回 键: 槽位下标
+        """
+        return {
+            key: self.alloc_flag()
+            for key in keys
+        }
+
+
+def _read_slots(state: array, slots: Dict, is_flag: bool, str_keys: bool) -> Dict:
+    """
+    按槽位读取状态组, 值为负数的槽位表示尚未启用, 不读取
+    """
+    values = {}
+    for key, slot in slots.items():
+        key = str(key) if str_keys else key
+        if isinstance(slot, dict):
+            values[key] = _read_slots(state, slot, is_flag, str_keys)
+        elif state[slot] >= 0:
+            values[key] = bool(state[slot]) if is_flag else state[slot]
+    return values
+
+
+def _load_slots(state: array, slots: Dict, values: Dict):
+    """
+    按槽位加载状态组, 状态字典中的键使用字符串类型
+    尚未启用的槽位加载后即启用
+    """
+    for key, slot in slots.items():
+        key = str(key)
+        if key not in values:
+            continue
+        if isinstance(slot, dict):
+            _load_slots(state, slot, values[key])
+        else:
+            state[slot] = int(values[key])
+
 
 class BaseRule(ABC):
     """
     规则基类
+    规则对象只保存规则参数, 可变状态通过 alloc_state 申请的槽位保存在 ctx.state 中
     """
     # 规则标识符
     tag: str = "BaseRule"
+    # 规则状态组, 由 alloc_state 设置, 无状态规则为空
+    state_groups: StateGroups = {}
 
     def __init__(self, **kwargs):
         """
@@ -49,7 +159,7 @@ class BaseRule(ABC):
         注意: 传入的配置字典是由 json 直接解析得到的字典, 这意味着所有的键都是字符串类型
         """
         super().__init__()
-    
+
     @abstractmethod
     def set_bridge(self, ctx: RuleContext):
         """
@@ -57,13 +167,41 @@ class BaseRule(ABC):
         """
         pass
 
+    def alloc_state(self, ctx: RuleContext, layout: StateLayout):
+        """
+        初始化时，在所有规则注册到上下文后申请状态槽位
+        默认不申请
+        """
+        pass
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        """
+        编译规则，返回 (执行函数, 回调函数)
+        编译在所有规则注册到上下文、申请状态槽位后进行，可预先解析对其他规则的引用
+        编译结果由所有会话共享，只能在执行时从 ctx 中读取状态和随机数后端
+        返回 None 的阶段不操作，将从执行管线中移除
+        编译结果必须与 apply 和 callback 在相同随机数序列下产生相同的结果
+        保底标记由执行管线在每抽开始时统一清除 (见 StateLayout), 编译结果无需清除
+        默认直接使用 apply 和 callback
+        """
+        return self.apply, self.callback
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        """
+        编译后的 (执行函数, 回调函数) 只对哪些星级的逻辑结果操作, None 表示与星级无关
+        星级决定后, 执行管线只执行对当前星级操作的阶段
+        在星级决定前执行的阶段不受限制, 总会执行
+        默认与星级无关
+        """
+        return None, None
+
     @abstractmethod
     def apply(self, ctx: RuleContext):
         """
         每次抽卡时具体执行的逻辑
         """
         pass
-    
+
     @abstractmethod
     def callback(self, ctx: RuleContext):
         """
@@ -71,27 +209,38 @@ class BaseRule(ABC):
         """
         pass
 
-    @abstractmethod
-    def reset(self, ctx: RuleContext):
+    def read_state(self, ctx: RuleContext, name: str) -> Dict:
         """
-        重置规则状态
+        读取会话中的一个规则状态组，星级键使用整数类型
         """
-        pass
-    
-    @abstractmethod
-    def load_state(self, state: Dict):
+        slots, is_flag = self.state_groups[name]
+        return _read_slots(ctx.state, slots, is_flag, False)
+
+    def load_state(self, ctx: RuleContext, state: Dict):
         """
         从状态字典中加载规则状态
         状态字典中的星级键使用字符串类型
         """
-        pass
-    
-    @abstractmethod
-    def reg_state(self, state: Dict):
+        if self.tag not in state:
+            return
+
+        rule_state: Dict = state[self.tag]
+        for name, (slots, _) in self.state_groups.items():
+            _load_slots(ctx.state, slots, rule_state.get(name, {}))
+
+    def reg_state(self, ctx: RuleContext, state: Dict):
         """
         注册规则状态
+        只注册非空的状态组
         """
-        pass
+        rule_state: Dict = {}
+        for name, (slots, is_flag) in self.state_groups.items():
+            values = _read_slots(ctx.state, slots, is_flag, True)
+            if values:
+                rule_state[name] = values
+
+        if rule_state:
+            state[self.tag] = rule_state
 
 
 class StarCounterRule(BaseRule):
@@ -109,61 +258,70 @@ class StarCounterRule(BaseRule):
         因此，当前实际抽数是 计数器值 + 1
         故各类型在使用本规则的计数器时需自加 1
         """
-        self.star_counter: Dict[int, int] = {
-            star: 0 
-            for star in star_list
-        }
+        self.star_list: Tuple[int, ...] = tuple(star_list)
+        self.star_slots: Dict[int, int] = {}    # 星级 -> 计数器槽位
 
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
 
+    def alloc_state(self, ctx: RuleContext, layout: StateLayout):
+        """
+        为 star_list 中的星级申请计数器槽位
+        其他规则用到、但不在 star_list 中的星级同样申请槽位，初始值 -1 表示尚未计数
+        这类星级在被抽出或被保底重置后才开始计数，读取时视为 0
+        """
+        referenced: List[int] = []
+        bridge = ctx.rule_bridge
+        if StarProbabilityRule.tag in bridge:
+            referenced.extend(bridge[StarProbabilityRule.tag].base_probability) # type: ignore
+        if StarPityRule.tag in bridge:
+            referenced.extend(bridge[StarPityRule.tag].star_pity) # type: ignore
+        for tag in STAR_INCREASE_RULE_TAGS:
+            if tag in bridge:
+                referenced.extend(bridge[tag].star_increase) # type: ignore
+
+        self.star_slots = layout.alloc_group(self.star_list)
+        for star in referenced:
+            if star not in self.star_slots:
+                self.star_slots[star] = layout.alloc(-1)
+        self.state_groups = {
+            "star_counter": (self.star_slots, False)
+        }
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        star_slots = self.star_slots
+        counted = tuple(slot for star, slot in star_slots.items() if star in self.star_list)
+        uncounted = tuple(slot for star, slot in star_slots.items() if star not in self.star_list)
+
+        def callback(ctx: RuleContext):
+            state = ctx.state
+            for slot in counted:
+                state[slot] += 1
+            for slot in uncounted:
+                if state[slot] >= 0:
+                    state[slot] += 1
+            result = ctx.result
+            if result and result.star in star_slots:
+                state[star_slots[result.star]] = 0
+
+        return None, callback
+
     def apply(self, ctx: RuleContext):
         """
         不操作
         """
-    
+
     def callback(self, ctx: RuleContext):
         """
         回调中，更新星级计数器
         """
-        for star in self.star_counter.keys():
-            self.star_counter[star] += 1
-        
-        if ctx.result and ctx.result.star:
-            self.star_counter[ctx.result.star] = 0
-        
-    def reset(self, ctx: RuleContext):
-        """
-        重置星级计数器
-        """
-        for star in self.star_counter.keys():
-            self.star_counter[star] = 0
-    
-    def load_state(self, state: Dict):
-        """
-        加载星级计数器状态
-        """
-        if self.tag not in state:
-            return
-        
-        star_counter_state = state[self.tag].get("star_counter", {})
-
-        for star in self.star_counter.keys():
-            self.star_counter[star] = star_counter_state.get(str(star), self.star_counter[star])
-    
-    def reg_state(self, state: Dict):
-        """
-        注册星级计数器状态
-        """
-        star_counter_state = {
-            str(star): self.star_counter[star]
-            for star in self.star_counter.keys()
-        }
+        state = ctx.state
+        for slot in self.star_slots.values():
+            if state[slot] >= 0:
+                state[slot] += 1
 
-        if star_counter_state:
-            state[self.tag] = {
-                "star_counter": star_counter_state
-            }
+        if ctx.result and ctx.result.star in self.star_slots:
+            state[self.star_slots[ctx.result.star]] = 0
 
 
 class TypeStarCounterRule(BaseRule):
@@ -175,84 +333,83 @@ class TypeStarCounterRule(BaseRule):
     tag: str = "TypeStarCounterRule"
 
     def __init__(self, type_star_dict: Dict[str, List[str]], **kwargs):
-        self.type_star_counter: Dict[int, Dict[str, int]] = {
-            int(star): {
-                type_: 0 
-                for type_ in type_star_dict[star]
-            } 
-            for star in type_star_dict.keys()
+        self.type_star_dict: Dict[int, Tuple[str, ...]] = {
+            int(star): tuple(types)
+            for star, types in type_star_dict.items()
         }
-    
+        self.type_slots: Dict[int, Dict[str, int]] = {}     # 星级 -> 类型 -> 计数器槽位
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
-    
+
+    def alloc_state(self, ctx: RuleContext, layout: StateLayout):
+        """
+        为每个星级下的类型申请计数器槽位
+        TypeStarPityRule 用到、但不在 type_star_dict 中的类型同样申请槽位，初始值 -1 表示尚未计数
+        """
+        pity_rule: TypeStarPityRule | None = ctx.rule_bridge.get(TypeStarPityRule.tag) # type: ignore
+        type_pity = pity_rule.type_pity if pity_rule else {}
+
+        self.type_slots = {}
+        for star, types in self.type_star_dict.items():
+            slots = layout.alloc_group(types)
+            for type_ in type_pity.get(star, {}):
+                if type_ not in slots:
+                    slots[type_] = layout.alloc(-1)
+            self.type_slots[star] = slots
+        self.state_groups = {
+            "type_star_counter": (self.type_slots, False)
+        }
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        type_slots = {
+            star: tuple(slots.items())
+            for star, slots in self.type_slots.items()
+        }
+
+        def callback(ctx: RuleContext):
+            result = ctx.result
+            if not result or result.star not in type_slots:
+                return
+            state = ctx.state
+            drawn = result.type_
+            for type_, slot in type_slots[result.star]:
+                counter = state[slot]
+                if counter >= 0:
+                    state[slot] = 0 if type_ == drawn else counter + 1
+
+        return None, callback
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        return None, tuple(self.type_slots)
+
     def apply(self, ctx: RuleContext):
         """
         不操作
         """
-    
+
     def callback(self, ctx: RuleContext):
         """
         回调中，更新类型计数器
         """
-        if not ctx.result or not ctx.result.star in self.type_star_counter:
+        if not ctx.result or not ctx.result.star in self.type_slots:
             return
 
-        for type_ in self.type_star_counter[ctx.result.star].keys():
-            if type_ == ctx.result.type_:
-                self.type_star_counter[ctx.result.star][type_] = 0
+        state = ctx.state
+        for type_, slot in self.type_slots[ctx.result.star].items():
+            if state[slot] < 0:
                 continue
-            self.type_star_counter[ctx.result.star][type_] += 1
-    
-    def reset(self, ctx: RuleContext):
-        """
-        重置类型计数器
-        """
-        for star in self.type_star_counter.keys():
-            for type_ in self.type_star_counter[star].keys():
-                self.type_star_counter[star][type_] = 0
-    
-    def load_state(self, state: Dict):
-        """
-        加载类型计数器状态
-        """
-        if self.tag not in state:
-            return
-
-        type_star_counter_state = state[self.tag].get("type_star_counter", {})
-
-        for star, type_counter in self.type_star_counter.items():
-            star_string = str(star)
-            if star_string not in type_star_counter_state:
+            if type_ == ctx.result.type_:
+                state[slot] = 0
                 continue
-
-            star_state = type_star_counter_state[star_string]
-            for type_ in type_counter.keys():
-                type_counter[type_] = star_state.get(type_, type_counter[type_])
-
-    def reg_state(self, state: Dict):
-        """
-        注册类型计数器状态
-        """
-        type_star_counter_state = {
-            str(star): {
-                type_: self.type_star_counter[star][type_]
-                for type_ in self.type_star_counter[star].keys()
-            }
-            for star in self.type_star_counter.keys()
-        }
-
-        if type_star_counter_state:
-            state[self.tag] = {
-                "type_star_counter": type_star_counter_state
-            }
+            state[slot] += 1
 
 
 class StarProbabilityRule(BaseRule):
     """
     星级基础概率规则
-    根据当前星级概率权重决定当前抽星级
-    每次回调都会重置概率为基础概率
+    根据当前星级权重表决定当前抽星级
+    概率增长规则通过 ctx.star_table 给出增长后的权重表，未给出时使用基础概率
     """
     tag: str = "StarProbabilityRule"
 
@@ -261,45 +418,38 @@ class StarProbabilityRule(BaseRule):
             int(star): probability
             for star, probability in star_probability.items()
         }
-        self.star_probability: Dict[int, int] = self.base_probability.copy()
-    
+        # 星级权重表缓存, 概率增长规则修改权重后才会建立新表
+        self.star_tables = WeightTableCache(self.base_probability.keys())
+        self.base_table = WeightTable(tuple(self.base_probability.keys()), tuple(self.base_probability.values()))
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
 
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        base_table = self.base_table
+
+        def apply(ctx: RuleContext):
+            result = ctx.result
+            if result is None or not result.star:
+                table = ctx.star_table
+                if table is None:
+                    table = base_table
+                ctx.result = LogicResult(star=table.draw(ctx.rng.random), type_="")
+
+        return apply, None
+
     def apply(self, ctx: RuleContext):
         """
-        根据 star_probability 的概率权重决定星级
+        根据当前星级权重表决定星级
         """
         # 若星级已被决定，则不操作
         if ctx.result is None or not ctx.result.star:
-            stars = list(self.star_probability.keys())
-            weights = list(self.star_probability.values())
-            target_star = random.choices(stars, weights=weights)[0]
+            table = ctx.star_table if ctx.star_table is not None else self.base_table
+            target_star = table.draw(ctx.rng.random)
             ctx.result = LogicResult(star=target_star, type_="")
-    
+
     def callback(self, ctx: RuleContext):
-        """
-        抽卡结束后重置概率
-        """
-        self.star_probability = self.base_probability.copy()
-    
-    def reset(self, ctx: RuleContext):
-        """
-        重置星级概率
-        """
-        self.star_probability = self.base_probability.copy()
-    
-    def load_state(self, state: Dict):
-        """
-        不操作
-        *星级概率无需保存
-        """
-    
-    def reg_state(self, state: Dict):
-        """
-        不操作
-        *星级概率无需保存
-        """
+        pass
 
 
 class TypeStarProbabilityRule(BaseRule):
@@ -317,10 +467,32 @@ class TypeStarProbabilityRule(BaseRule):
             }
             for star in type_probability.keys()
         }
-    
+        # 星级 -> 类型权重表, 空权重的星级不建表
+        self.type_tables: Dict[int, WeightTable] = {
+            star: WeightTable(tuple(type_weights.keys()), tuple(type_weights.values()))
+            for star, type_weights in self.type_probability.items()
+            if type_weights
+        }
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
 
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        type_tables = self.type_tables
+
+        def apply(ctx: RuleContext):
+            result = ctx.result
+            if result is None or not result.star or result.type_:
+                return
+            table = type_tables.get(result.star)
+            if table:
+                result.type_ = table.draw(ctx.rng.random)
+
+        return apply, None
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        return tuple(self.type_tables), None
+
     def apply(self, ctx: RuleContext):
         """
         根据星级，获取对应的类型概率权重并决定类型
@@ -328,24 +500,12 @@ class TypeStarProbabilityRule(BaseRule):
         # 若类型已决定，则不操作
         if ctx.result is None or not ctx.result.star or ctx.result.type_:
             return
-        
-        type_weights = self.type_probability.get(ctx.result.star, {})
-        types = tuple(type_weights.keys())
-        weights = tuple(type_weights.values())
-        if types and weights:
-            target_type = random.choices(types, weights=weights)[0]
-            ctx.result.type_ = target_type
-    
-    def callback(self, ctx: RuleContext):
-        pass
 
-    def reset(self, ctx: RuleContext):
-        pass
+        table = self.type_tables.get(ctx.result.star)
+        if table:
+            ctx.result.type_ = table.draw(ctx.rng.random)
 
-    def load_state(self, state: Dict):
-        pass
-
-    def reg_state(self, state: Dict):
+    def callback(self, ctx: RuleContext):
         pass
 
 
@@ -362,75 +522,83 @@ class StarPityRule(BaseRule):
             int(star): threshold
             for star, threshold in star_pity.items()
         }
-        self.is_pity: Dict[int, bool] = {    # 当前抽各星级是否触发保底
-            int(star): False
-            for star in self.star_pity.keys()
-        }
+        self.pity_slots: Dict[int, int] = {}        # 星级 -> 当前抽是否触发保底的标记槽位
         self.reset_lower_pity = reset_lower_pity    # 高星级是否重置低星级保底
-    
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
-    
+
+    def alloc_state(self, ctx: RuleContext, layout: StateLayout):
+        self.pity_slots = layout.alloc_flag_group(self.star_pity.keys())
+        self.state_groups = {
+            "is_pity": (self.pity_slots, True)
+        }
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        if StarCounterRule.tag not in ctx.rule_bridge:
+            return super().compile(ctx)
+
+        counter_slots: Dict[int, int] = ctx.rule_bridge[StarCounterRule.tag].star_slots # type: ignore
+        star_pity = tuple(
+            (star, threshold, counter_slots[star], self.pity_slots[star])
+            for star, threshold in self.star_pity.items()
+        )
+        counters = tuple(counter_slots.items())
+
+        def apply(ctx: RuleContext):
+            state = ctx.state
+            for star, threshold, counter_slot, flag_slot in star_pity:
+                counter = state[counter_slot]
+                if (counter if counter > 0 else 0) + 1 >= threshold:
+                    ctx.result = LogicResult(star=star, type_="")
+                    state[counter_slot] = 0
+                    state[flag_slot] = 1
+                    return
+
+        def callback(ctx: RuleContext):
+            if ctx.result is None:
+                return
+            cur_star = ctx.result.star
+            state = ctx.state
+            for star, slot in counters:
+                if star < cur_star and state[slot] >= 0:
+                    state[slot] = 0
+
+        return apply, callback if self.reset_lower_pity else None
+
     def apply(self, ctx: RuleContext):
         """
         检查星级保底，若触发，则按 star_pity 字典中顺序取最先触发保底星级
         若 星级保底被更大的星级保底覆盖 且 reset_lower_pity 为 True, 则重置该星级保底
         本规则决定的星级优先级大于 StarProbabilityRule
         """
-        for star in self.is_pity.keys():
-            self.is_pity[star] = False
+        state = ctx.state
+        for slot in self.pity_slots.values():
+            state[slot] = 0
 
-        star_counter = ctx.rule_bridge[StarCounterRule.tag].star_counter # type: ignore
+        counter_slots = ctx.rule_bridge[StarCounterRule.tag].star_slots # type: ignore
         for star, threshold in self.star_pity.items():
-            counter = star_counter.get(star, 0) + 1
+            counter = max(state[counter_slots[star]], 0) + 1
             if counter >= threshold:
                 ctx.result = LogicResult(star=star, type_="")
-                star_counter[star] = 0
-                self.is_pity[star] = True
+                state[counter_slots[star]] = 0
+                state[self.pity_slots[star]] = 1
                 return
-    
+
     def callback(self, ctx: RuleContext):
         """
         当 reset_lower_pity 为 True 时, 重置低星级保底
         """
         if not self.reset_lower_pity or ctx.result is None:
             return
-        
-        cur_star = ctx.result.star
-
-        star_counter: Dict[int, int] = ctx.rule_bridge[StarCounterRule.tag].star_counter # type: ignore
-        for star in star_counter.keys():
-            if star < cur_star:
-                star_counter[star] = 0
-
-    def reset(self, ctx: RuleContext):
-        for star in self.is_pity.keys():
-            self.is_pity[star] = False
-
-    def load_state(self, state: Dict):
-        """
-        加载保底状态
-        """
-        if self.tag not in state:
-            return
-        
-        is_pity = state[self.tag].get("is_pity", {})
-        for star in self.is_pity.keys():
-            self.is_pity[star] = is_pity.get(str(star), self.is_pity[star])
 
-    def reg_state(self, state: Dict):
-        """
-        注册保底状态
-        """
-        is_pity_state = {
-            str(star): is_pity
-            for star, is_pity in self.is_pity.items()
-        }
+        cur_star = ctx.result.star
 
-        if is_pity_state:
-            state[self.tag] = {
-                "is_pity": is_pity_state
-            }
+        state = ctx.state
+        counter_slots: Dict[int, int] = ctx.rule_bridge[StarCounterRule.tag].star_slots # type: ignore
+        for star, slot in counter_slots.items():
+            if star < cur_star and state[slot] >= 0:
+                state[slot] = 0
 
 
 class TypeStarPityRule(BaseRule):
@@ -449,17 +617,59 @@ class TypeStarPityRule(BaseRule):
             }
             for star in type_pity.keys()
         }
-        self.is_pity: Dict[int, Dict[str, bool]] = {    # 当前抽是否触发保底
-            star: {
-                type_: False
-                for type_ in self.type_pity[star].keys()
-            }
-            for star in self.type_pity.keys()
-        }
-    
+        self.pity_slots: Dict[int, Dict[str, int]] = {}     # 星级 -> 类型 -> 当前抽是否触发保底的标记槽位
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
 
+    def alloc_state(self, ctx: RuleContext, layout: StateLayout):
+        self.pity_slots = {
+            star: layout.alloc_flag_group(thresholds.keys())
+            for star, thresholds in self.type_pity.items()
+        }
+        self.state_groups = {
+            "is_pity": (self.pity_slots, True)
+        }
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        if TypeStarCounterRule.tag not in ctx.rule_bridge:
+            return super().compile(ctx)
+
+        type_slots: Dict[int, Dict[str, int]] = ctx.rule_bridge[TypeStarCounterRule.tag].type_slots # type: ignore
+        type_pity = {
+            star: tuple(
+                (type_, threshold, type_slots.get(star, {}).get(type_), self.pity_slots[star][type_])
+                for type_, threshold in thresholds.items()
+            )
+            for star, thresholds in self.type_pity.items()
+        }
+
+        def apply(ctx: RuleContext):
+            state = ctx.state
+            result = ctx.result
+            if result is None or not result.star:
+                return
+            star = result.star
+            if star not in type_pity:
+                return
+            if result.type_:
+                slot = type_slots[star].get(result.type_)
+                if slot is not None and state[slot] >= 0:
+                    state[slot] = 0
+                return
+            for type_, threshold, counter_slot, flag_slot in type_pity[star]:
+                counter = state[counter_slot] if counter_slot is not None else 0
+                if (counter if counter > 0 else 0) >= threshold:
+                    result.type_ = type_
+                    state[type_slots[star][type_]] = 0
+                    state[flag_slot] = 1
+                    return
+
+        return apply, None
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        return tuple(self.type_pity), None
+
     def apply(self, ctx: RuleContext):
         """
         根据星级，获取对应的类型保底
@@ -467,70 +677,37 @@ class TypeStarPityRule(BaseRule):
         若类型已被决定，则将重置该类型保底，且不操作
         本规则决定的类型优先级大于 TypeStarProbabilityRule
         """
-        for star in self.is_pity.keys():
-            for type_ in self.is_pity[star].keys():
-                self.is_pity[star][type_] = False
+        state = ctx.state
+        for slots in self.pity_slots.values():
+            for slot in slots.values():
+                state[slot] = 0
 
         if ctx.result is None or not ctx.result.star:
             return
 
-        type_counter = ctx.rule_bridge[TypeStarCounterRule.tag].type_star_counter # type: ignore
+        type_slots = ctx.rule_bridge[TypeStarCounterRule.tag].type_slots # type: ignore
         # 星级不包含在保底列表内，不操作
         if ctx.result.star not in self.type_pity:
             return
         # 类型已决定，更新计数器，不操作
         if ctx.result.type_:
-            if ctx.result.type_ in type_counter[ctx.result.star]:
-                type_counter[ctx.result.star][ctx.result.type_] = 0
+            slot = type_slots[ctx.result.star].get(ctx.result.type_)
+            if slot is not None and state[slot] >= 0:
+                state[slot] = 0
             return
         # 通过保底决定类型
         for type_, threshold in self.type_pity[ctx.result.star].items():
-            counter = type_counter.get(ctx.result.star, {}).get(type_, 0)
+            slot = type_slots.get(ctx.result.star, {}).get(type_)
+            counter = max(state[slot], 0) if slot is not None else 0
             if counter >= threshold:
                 ctx.result.type_ = type_
-                type_counter[ctx.result.star][type_] = 0
-                self.is_pity[ctx.result.star][type_] = True
+                state[type_slots[ctx.result.star][type_]] = 0
+                state[self.pity_slots[ctx.result.star][type_]] = 1
                 return
-    
+
     def callback(self, ctx: RuleContext):
         pass
 
-    def reset(self, ctx: RuleContext):
-        for star in self.is_pity.keys():
-            for type_ in self.is_pity[star].keys():
-                self.is_pity[star][type_] = False
-
-    def load_state(self, state: Dict):
-        """
-        加载 is_pity 保底状态
-        """
-        if self.tag not in state:
-            return
-
-        is_pity = state[self.tag].get("is_pity", {})
-        for star in self.is_pity.keys():
-            if star not in is_pity:
-                continue
-            for type_ in self.is_pity[star].keys():
-                self.is_pity[star][type_] = is_pity[star].get(type_, self.is_pity[star][type_])
-
-    def reg_state(self, state: Dict):
-        """
-        注册 is_pity 保底状态
-        """
-        is_pity_state = {
-            str(star): {
-                type_: is_pity
-                for type_, is_pity in self.is_pity[star].items()
-            }
-            for star in self.is_pity.keys()
-        }
-
-        if is_pity_state:
-            state[self.tag] = {
-                "is_pity": is_pity_state
-            }
-
 
 class UpRule(BaseRule):
     """
@@ -549,96 +726,79 @@ class UpRule(BaseRule):
             int(star): pity
             for star, pity in up_pity.items()
         }
-        self.up_counter: Dict[int, int] = {
-            star: 0
-            for star in self.up_probability.keys()
-        }
-        self.is_up_pity: Dict[int, bool] = {    # 当前抽是否触发 UP 保底
-            star: False
-            for star in self.up_pity.keys()
-        }
-    
+        self.counter_slots: Dict[int, int] = {}     # 星级 -> UP 计数器槽位
+        self.pity_slots: Dict[int, int] = {}        # 星级 -> 当前抽是否触发 UP 保底的标记槽位
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
-    
+
+    def alloc_state(self, ctx: RuleContext, layout: StateLayout):
+        self.counter_slots = layout.alloc_group(self.up_probability.keys())
+        self.pity_slots = layout.alloc_flag_group(self.up_pity.keys())
+        self.state_groups = {
+            "up_counter": (self.counter_slots, False),
+            "is_up_pity": (self.pity_slots, True)
+        }
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        up_rules = {
+            star: (probability, self.counter_slots[star], self.up_pity.get(star), self.pity_slots.get(star))
+            for star, probability in self.up_probability.items()
+        }
+
+        def apply(ctx: RuleContext):
+            state = ctx.state
+            result = ctx.result
+            if result is None or result.star not in up_rules:
+                return
+            probability, counter_slot, pity, flag_slot = up_rules[result.star]
+            if pity is not None and state[counter_slot] >= pity:    # 触发 UP 保底
+                result.tags.append(TAG_UP)
+                state[counter_slot] = 0
+                state[flag_slot] = 1 # type: ignore
+                return
+            if ctx.rng.random() * MAX_PROBABILITY < probability:    # 正常抽取 UP
+                result.tags.append(TAG_UP)
+            if TAG_UP in result.tags:
+                state[counter_slot] = 0
+            else:
+                state[counter_slot] += 1
+
+        return apply, None
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        return tuple(self.up_probability), None
+
     def apply(self, ctx: RuleContext):
         """
         根据星级，获取对应的 UP 保底
         若触发保底则决定为 UP
         若未触发，则根据 up_probability 中指定的对应星级的 UP 概率权重决定是否 UP
         """
-        for star in self.is_up_pity.keys():
-            self.is_up_pity[star] = False
+        state = ctx.state
+        for slot in self.pity_slots.values():
+            state[slot] = 0
 
         if ctx.result is None or ctx.result.star not in self.up_probability:
             return
-        
-        counter = self.up_counter[ctx.result.star]
-        if ctx.result.star in self.up_pity and counter >= self.up_pity[ctx.result.star]:    # 触发 UP 保底
+
+        counter_slot = self.counter_slots[ctx.result.star]
+        if ctx.result.star in self.up_pity and state[counter_slot] >= self.up_pity[ctx.result.star]:    # 触发 UP 保底
             ctx.result.tags.append(TAG_UP)
-            self.up_counter[ctx.result.star] = 0
-            self.is_up_pity[ctx.result.star] = True
+            state[counter_slot] = 0
+            state[self.pity_slots[ctx.result.star]] = 1
         else:
-            up_weight = self.up_probability[ctx.result.star]
-            if random.choices((True, False), (up_weight, MAX_PROBABILITY - up_weight))[0]:  # 正常抽取 UP
+            if bernoulli(self.up_probability[ctx.result.star], ctx.rng.random):  # 正常抽取 UP
                 ctx.result.tags.append(TAG_UP)
 
             if TAG_UP in ctx.result.tags:
-                self.up_counter[ctx.result.star] = 0
+                state[counter_slot] = 0
             else:
-                self.up_counter[ctx.result.star] += 1
-    
+                state[counter_slot] += 1
+
     def callback(self, ctx: RuleContext):
         pass
 
-    def reset(self, ctx: RuleContext):
-        """
-        重置 up_counter 计数器和 is_up_pity 保底状态
-        """
-        self.up_counter = {
-            star: 0
-            for star in self.up_probability.keys()
-        }
-        for star in self.is_up_pity.keys():
-            self.is_up_pity[star] = False
-    
-    def load_state(self, state: Dict):
-        """
-        加载 up_counter 计数器和 is_up_pity 保底状态
-        """
-        if self.tag not in state:
-            return
-        
-        up_counter_state = state[self.tag].get("up_counter", {})
-        for star in self.up_counter.keys():
-            self.up_counter[star] = up_counter_state.get(str(star), self.up_counter[star])
-        
-        is_up_pity_state = state[self.tag].get("is_up_pity", {})
-        for star in self.is_up_pity.keys():
-            self.is_up_pity[star] = is_up_pity_state.get(str(star), self.is_up_pity[star])
-    
-    def reg_state(self, state: Dict):
-        """
-        注册 up_counter 计数器和 is_up_pity 保底状态
-        """
-        up_counter_state = {
-            str(star): self.up_counter[star]
-            for star in self.up_counter.keys()
-        }
-        is_up_pity_state = {
-            str(star): self.is_up_pity[star]
-            for star in self.is_up_pity.keys()
-        }
-
-        if up_counter_state or is_up_pity_state:
-            state[self.tag] = {}
-
-            if up_counter_state:
-                state[self.tag]["up_counter"] = up_counter_state
-            
-            if is_up_pity_state:
-                state[self.tag]["is_up_pity"] = is_up_pity_state
-
 
 class UpTypeRule(BaseRule):
     """
@@ -663,115 +823,287 @@ class UpTypeRule(BaseRule):
             }
             for star in up_type_pity.keys()
         }
-        self.up_type_counter = {
-            star: {
-                type_: 0
-                for type_ in self.up_type_pity[star].keys()
-            }
-            for star in self.up_type_pity.keys()
-        }
-        self.is_up_type_pity = {
-            star: {
-                type_: False
-                for type_ in self.up_type_pity[star].keys()
-            }
-            for star in self.up_type_pity.keys()
+        self.counter_slots: Dict[int, Dict[str, int]] = {}  # 星级 -> 类型 -> UP 类型计数器槽位
+        self.pity_slots: Dict[int, Dict[str, int]] = {}     # 星级 -> 类型 -> 当前抽是否触发 UP 类型保底的标记槽位
+        # 星级 -> UP 类型权重表
+        self.up_type_tables: Dict[int, WeightTable] = {
+            star: WeightTable(tuple(type_weights.keys()), tuple(type_weights.values()))
+            for star, type_weights in self.up_type_probability.items()
         }
 
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
-    
+
+    def alloc_state(self, ctx: RuleContext, layout: StateLayout):
+        self.counter_slots = {
+            star: layout.alloc_group(pity.keys())
+            for star, pity in self.up_type_pity.items()
+        }
+        self.pity_slots = {
+            star: layout.alloc_flag_group(pity.keys())
+            for star, pity in self.up_type_pity.items()
+        }
+        self.state_groups = {
+            "up_type_counter": (self.counter_slots, False),
+            "is_up_type_pity": (self.pity_slots, True)
+        }
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        type_pity = {
+            star: tuple(
+                (type_, pity, self.counter_slots[star][type_], self.pity_slots[star][type_])
+                for type_, pity in thresholds.items()
+            )
+            for star, thresholds in self.up_type_pity.items()
+        }
+        type_tables = self.up_type_tables
+
+        def apply(ctx: RuleContext):
+            state = ctx.state
+            result = ctx.result
+            if result is None or result.star not in type_tables or TAG_UP not in result.tags:
+                return
+            star = result.star
+            if star in type_pity:
+                pity_types = type_pity[star]
+                for _, _, counter_slot, _ in pity_types:
+                    state[counter_slot] += 1
+                for type_, pity, counter_slot, flag_slot in pity_types:
+                    if state[counter_slot] > pity:     # 触发 UP 类型保底
+                        result.type_ = type_
+                        state[counter_slot] = 0
+                        state[flag_slot] = 1
+                        return
+            result.type_ = type_tables[star].draw(ctx.rng.random)
+
+        return apply, None
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        return tuple(self.up_type_tables), None
+
     def apply(self, ctx: RuleContext):
         """
         在当前为 UP 的情况下，根据概率权重决定类型
         所有可 UP 类型及对应权重由 up_type_probability 指定
         """
-        for star in self.is_up_type_pity.keys():
-            for type_ in self.is_up_type_pity[star].keys():
-                self.is_up_type_pity[star][type_] = False
+        state = ctx.state
+        for slots in self.pity_slots.values():
+            for slot in slots.values():
+                state[slot] = 0
 
         if ctx.result is None or ctx.result.star not in self.up_type_probability or TAG_UP not in ctx.result.tags:
             return
-        
+
         if ctx.result.star in self.up_type_pity:
-            counter = self.up_type_counter[ctx.result.star]
-            for type_ in counter.keys():
-                counter[type_] += 1
+            counter_slots = self.counter_slots[ctx.result.star]
+            for slot in counter_slots.values():
+                state[slot] += 1
 
-            for type_ in counter.keys():
-                if counter[type_] > self.up_type_pity[ctx.result.star][type_]:     # 触发 UP 类型保底
+            for type_, slot in counter_slots.items():
+                if state[slot] > self.up_type_pity[ctx.result.star][type_]:     # 触发 UP 类型保底
                     ctx.result.type_ = type_
-                    counter[type_] = 0
-                    self.is_up_type_pity[ctx.result.star][type_] = True
+                    state[slot] = 0
+                    state[self.pity_slots[ctx.result.star][type_]] = 1
                     return
-        
-        types = tuple(self.up_type_probability[ctx.result.star].keys())
-        weights = tuple(self.up_type_probability[ctx.result.star].values())
-        ctx.result.type_ = random.choices(types, weights=weights)[0]
+
+        ctx.result.type_ = self.up_type_tables[ctx.result.star].draw(ctx.rng.random)
 
     def callback(self, ctx: RuleContext):
         pass
 
-    def reset(self, ctx: RuleContext):
-        """
-        重置 up_type_counter 计数器和 is_up_type_pity 保底状态
-        """
-        self.up_type_counter = {
-            star: {
-                type_: 0 
-                for type_ in self.up_type_probability[star].keys()
-            }
-            for star in self.up_type_probability.keys()
-        }
-        for star in self.is_up_type_pity.keys():
-            for type_ in self.is_up_type_pity[star].keys():
-                self.is_up_type_pity[star][type_] = False
-    
-    def load_state(self, state: Dict):
-        """
-        加载 up_type_counter 计数器和 is_up_type_pity 保底状态
-        """
-        if self.tag not in state:
-            return
 
-        up_type_counter_state = state[self.tag].get("up_type_counter", {})
+def _normalize_probability(star_probability: Dict[int, int]):
+    """
+    对概率进行归一化处理，确保概率权重和不超过 MAX_PROBABILITY
+    在 star_probability 中顺序越靠前的星级，其概率优先级越高
+    """
+    total = 0
+    for star, probability in star_probability.items():
+        p = max(min(MAX_PROBABILITY - total, probability), 0)
+        total += p
+        star_probability[star] = p
 
-        for star in self.up_type_counter.keys():
-            for type_ in self.up_type_counter[star].keys():
-                self.up_type_counter[star][type_] = up_type_counter_state.get(str(star), {}).get(type_, self.up_type_counter[star][type_])
-        
-        is_up_type_pity_state = state[self.tag].get("is_up_type_pity", {})
-        for star in self.is_up_type_pity.keys():
-            for type_ in self.is_up_type_pity[star].keys():
-                self.is_up_type_pity[star][type_] = is_up_type_pity_state.get(str(star), {}).get(type_, self.is_up_type_pity[star][type_])
 
-    def reg_state(self, state: Dict):
+def _interval_increment(intervals: Sequence[Tuple[int, int]], counter: int) -> int:
+    """
+    计算当前实际抽数 counter 下的概率增长值
+    增长区间按顺序生效，遇到未达到起始抽数的区间即停止
+    """
+    increment = 0
+    for start, step in intervals:
+        if counter < start:
+            break
+        increment += (counter - start + 1) * step
+    return increment
+
+
+def _apply_star_increase(star_intervals: Dict[int, List[Tuple[int, int]]], star_probability: Dict[int, int], star_counter: Dict[int, int]):
+    """
+    根据星级计数器修改星级概率权重，并归一化
+    """
+    for star, intervals in star_intervals.items():
+        increment = _interval_increment(intervals, star_counter.get(star, 0) + 1)
+        if increment:
+            star_probability[star] += increment
+    _normalize_probability(star_probability)
+
+
+def _increase_star_table(ctx: RuleContext, star_intervals: Dict[int, List[Tuple[int, int]]]):
+    """
+    在当前星级权重 (ctx.star_table, 未设置时为基础概率) 上叠加概率增长，并将增长后的权重表写入 ctx.star_table
+    多个概率增长规则按规则顺序依次叠加
+    """
+    probability_rule: StarProbabilityRule = ctx.rule_bridge[StarProbabilityRule.tag] # type: ignore
+    counter_slots: Dict[int, int] = ctx.rule_bridge[StarCounterRule.tag].star_slots # type: ignore
+
+    table = ctx.star_table
+    if table is None:
+        star_probability = probability_rule.base_probability.copy()
+    else:
+        star_probability = dict(zip(table.population, table.weights))
+
+    state = ctx.state
+    star_counter = {
+        star: max(state[counter_slots[star]], 0)
+        for star in star_intervals
+    }
+    _apply_star_increase(star_intervals, star_probability, star_counter)
+    ctx.star_table = probability_rule.star_tables.get(tuple(star_probability.values()))
+
+
+def _counter_range(intervals: Sequence[Tuple[int, int]], base: int) -> Optional[Tuple[int, int]]:
+    """
+    计算影响概率权重的星级计数器区间 [low, high]
+    计数器不大于 low 时概率未开始增长，不小于 high 时概率已增长到上限或下限，区间外的权重都与端点相同
+    区间过大时返回 None
+    """
+    if not intervals:
+        return 0, 0
+
+    low = max(intervals[0][0] - 2, 0)
+    # 所有增长区间均生效后，概率随抽数线性变化
+    high = max(max(start for start, _ in intervals) - 1, low)
+    slope = _interval_increment(intervals, high + 2) - _interval_increment(intervals, high + 1)
+    if slope == 0:
+        return low, high
+
+    while True:
+        p = base + _interval_increment(intervals, high + 1)
+        if (slope > 0 and p >= MAX_PROBABILITY) or (slope < 0 and p <= 0):
+            return low, high
+        high += 1
+        if high - low >= SOFT_PITY_TABLE_SIZE:
+            return None
+
+
+class SoftPityTable:
+    """
+    软保底概率表
+    概率增长后的星级权重只取决于增长星级的计数器, 因此可以按计数器组合预先计算全部星级权重表
+    每个增长星级只覆盖 _counter_range 给出的计数器区间，区间外的计数器截断到端点
+    """
+    def __init__(self, dims: List[Tuple[int, int, int, int]], tables: List[WeightTable]) -> None:
+        self.dims = dims        # (计数器槽位, 计数器下界, 区间长度, 步长)
+        self.tables = tables
+
+    def lookup(self, state: array) -> WeightTable:
         """
-        注册 up_type_counter 计数器和 is_up_type_pity 保底状态
+        按会话状态中的星级计数器查表
         """
-        up_type_counter_state = {
-            str(star): {
-                type_: self.up_type_counter[star][type_]
-                for type_ in self.up_type_counter[star].keys()
-            }
-            for star in self.up_type_counter.keys()
-        }
-        is_up_type_pity_state = {
-            str(star): {
-                type_: self.is_up_type_pity[star][type_]
-                for type_ in self.is_up_type_pity[star].keys()
-            }
-            for star in self.is_up_type_pity.keys()
-        }
+        index = 0
+        for slot, low, span, stride in self.dims:
+            n = state[slot] - low
+            if n > 0:
+                index += (n if n < span else span) * stride
+        return self.tables[index]
 
-        if up_type_counter_state or is_up_type_pity_state:
-            state[self.tag] = {}
 
-            if up_type_counter_state:
-                state[self.tag]["up_type_counter"] = up_type_counter_state
+def _soft_pity_ranges(ctx: RuleContext, star_intervals: Dict[int, List[Tuple[int, int]]]) -> Optional[Dict[int, Tuple[int, int]]]:
+    """
+    检查能否使用软保底概率表，可以则返回各增长星级的计数器区间
+    需要满足:
+        星级计数器和星级基础概率规则存在
+        只有一个概率增长规则修改星级概率，保证增长前的概率总是基础概率
+        增长星级都在星级概率中
+        概率表大小不超过 SOFT_PITY_TABLE_SIZE
+    """
+    if StarCounterRule.tag not in ctx.rule_bridge or StarProbabilityRule.tag not in ctx.rule_bridge:
+        return None
+    if sum(tag in ctx.rule_bridge for tag in STAR_INCREASE_RULE_TAGS) > 1:
+        return None
+
+    base_probability: Dict[int, int] = ctx.rule_bridge[StarProbabilityRule.tag].base_probability # type: ignore
+    ranges: Dict[int, Tuple[int, int]] = {}
+    size = 1
+    for star, intervals in star_intervals.items():
+        if star not in base_probability:
+            return None
+        counter_range = _counter_range(intervals, base_probability[star])
+        if counter_range is None:
+            return None
+        size *= counter_range[1] - counter_range[0] + 1
+        if size > SOFT_PITY_TABLE_SIZE:
+            return None
+        ranges[star] = counter_range
+
+    return ranges
+
+
+def _build_soft_pity_table(ctx: RuleContext, star_intervals: Dict[int, List[Tuple[int, int]]]) -> Optional[SoftPityTable]:
+    """
+    构建软保底概率表，条件不满足时返回 None
+    每个表项都由 _apply_star_increase 计算，与逐抽计算的结果一致
+    """
+    ranges = _soft_pity_ranges(ctx, star_intervals)
+    if ranges is None:
+        return None
+
+    star_probability_rule: StarProbabilityRule = ctx.rule_bridge[StarProbabilityRule.tag] # type: ignore
+    base_probability = star_probability_rule.base_probability
+    counter_slots: Dict[int, int] = ctx.rule_bridge[StarCounterRule.tag].star_slots # type: ignore
+
+    dims: List[Tuple[int, int, int, int]] = []
+    stride = 1
+    for star, (low, high) in ranges.items():
+        dims.append((counter_slots[star], low, high - low, stride))
+        stride *= high - low + 1
+
+    tables: List[WeightTable] = []
+    shared: Dict[Tuple[int, ...], WeightTable] = {}     # 权重相同的表项共用同一个权重表
+    for index in range(stride):
+        counter: Dict[int, int] = {}
+        for star, (_, low, span, star_stride) in zip(ranges, dims):
+            counter[star] = low + index // star_stride % (span + 1)
+        probability = base_probability.copy()
+        _apply_star_increase(star_intervals, probability, counter)
+        weights = tuple(probability.values())
+        if weights not in shared:
+            shared[weights] = WeightTable(tuple(probability.keys()), weights)
+        tables.append(shared[weights])
+
+    return SoftPityTable(dims, tables)
+
+
+def _compile_star_increase(rule: BaseRule, ctx: RuleContext, star_intervals: Dict[int, List[Tuple[int, int]]]) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+    """
+    编译概率增长规则
+    可以使用软保底概率表时，每抽只需按计数器查表
+    否则逐抽计算增长后的权重
+    两种方式都通过 ctx.star_table 将权重表交给 StarProbabilityRule
+    """
+    if StarCounterRule.tag not in ctx.rule_bridge or StarProbabilityRule.tag not in ctx.rule_bridge:
+        return rule.apply, rule.callback
 
-            if is_up_type_pity_state:
-                state[self.tag]["is_up_type_pity"] = is_up_type_pity_state
+    table = _build_soft_pity_table(ctx, star_intervals)
+    if table is None:
+        return rule.apply, None
+
+    lookup = table.lookup
+
+    def apply(ctx: RuleContext):
+        ctx.star_table = lookup(ctx.state)
+
+    return apply, None
 
 
 class StarProbabilityIncreaseRule(BaseRule):
@@ -787,44 +1119,38 @@ class StarProbabilityIncreaseRule(BaseRule):
             int(star): (start, increment)
             for star, (start, increment) in star_increase.items()
         }
-    
+        # 星级 -> 增长区间列表, 等差增长即只有一个区间
+        self.star_intervals: Dict[int, List[Tuple[int, int]]] = {
+            star: [(start, increment)]
+            for star, (start, increment) in self.star_increase.items()
+        }
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
-    
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        return _compile_star_increase(self, ctx, self.star_intervals)
+
+    def use_soft_pity_table(self, ctx: RuleContext) -> bool:
+        """
+        编译后是否使用软保底概率表
+        """
+        return _soft_pity_ranges(ctx, self.star_intervals) is not None
+
     def apply(self, ctx: RuleContext):
         """
-        修改 StarProbabilityRule 的概率权重，实现概率增长
+        修改当前抽的星级权重，实现概率增长
         将检查各星级计数器是否达到概率累加起点
         若达到，则根据超出抽数计算当前抽该星级的概率
         在 star_probability 中顺序越靠前的星级，其概率优先级越高
         优先级高的星级概率增长时，会挤占优先级低的星级的概率
         星级的概率累加起点及累加值由 star_increase 指定
-        由于 StarProbabilityRule 在每次抽卡结束后都将重置概率
+        由于每次抽卡开始时都将清除上一抽的星级权重
         因此本规则只有在先于 StarProbabilityRule 执行时才生效
         """
-        for star, (start, increment) in self.star_increase.items():
-            counter = ctx.rule_bridge[StarCounterRule.tag].star_counter.get(star, 0) + 1 # type: ignore
-            if counter >= start:
-                k = counter - start + 1
-                ctx.rule_bridge[StarProbabilityRule.tag].star_probability[star] += k * increment # type: ignore
-        
-        # 对概率进行归一化处理，确保概率权重和为 MAX_PROBABILITY
-        total = 0
-        for star, probability in ctx.rule_bridge[StarProbabilityRule.tag].star_probability.items(): # type: ignore
-            p = max(min(MAX_PROBABILITY - total, probability), 0)
-            total += p
-            ctx.rule_bridge[StarProbabilityRule.tag].star_probability[star] = p # type: ignore
-    
-    def callback(self, ctx: RuleContext):
-        pass
-
-    def reset(self, ctx: RuleContext):
-        pass
+        _increase_star_table(ctx, self.star_intervals)
 
-    def load_state(self, state: Dict):
-        pass
-
-    def reg_state(self, state: Dict):
+    def callback(self, ctx: RuleContext):
         pass
 
 
@@ -840,49 +1166,40 @@ class StarProbabilityIntervalIncreaseRule(BaseRule):
         # 星级 -> (起始抽数, 增长值) 列表
         self.star_increase: Dict[int, List[Tuple[int, int]]] = {
             int(star): [
-                    (start, increment) 
+                    (start, increment)
                     for start, increment in intervals
                 ]
             for star, intervals in star_increase.items()
         }
-    
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
 
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        return _compile_star_increase(self, ctx, self.star_increase)
+
+    def use_soft_pity_table(self, ctx: RuleContext) -> bool:
+        """
+        编译后是否使用软保底概率表
+        """
+        return _soft_pity_ranges(ctx, self.star_increase) is not None
+
     def apply(self, ctx: RuleContext):
         """
-        修改 StarProbabilityRule 的概率权重，实现概率增长
+        修改当前抽的星级权重，实现概率增长
         每个区间的起始概率都是上个区间的结束概率
         第一个区间的起始概率为 StarProbabilityRule 的基础概率
         """
-        # 修改概率权重
-        for star, intervals in self.star_increase.items():
-            counter = ctx.rule_bridge[StarCounterRule.tag].star_counter.get(star, 0) + 1 # type: ignore
-            for start, increment in intervals:
-                if counter >= start:
-                    k = counter - start + 1
-                    ctx.rule_bridge[StarProbabilityRule.tag].star_probability[star] += k * increment # type: ignore
-                else:
-                    break
-        
-        # 对概率进行归一化处理，确保概率权重和为 MAX_PROBABILITY
-        total = 0
-        for star, probability in ctx.rule_bridge[StarProbabilityRule.tag].star_probability.items(): # type: ignore
-            p = max(min(MAX_PROBABILITY - total, probability), 0)
-            total += p
-            ctx.rule_bridge[StarProbabilityRule.tag].star_probability[star] = p # type: ignore
+        _increase_star_table(ctx, self.star_increase)
 
     def callback(self, ctx: RuleContext):
         pass
 
-    def reset(self, ctx: RuleContext):
-        pass
-
-    def load_state(self, state: Dict):
-        pass
 
-    def reg_state(self, state: Dict):
-        pass
+# 星级概率增长规则标识符, 这些规则会修改当前抽的星级权重
+STAR_INCREASE_RULE_TAGS = (StarProbabilityIncreaseRule.tag, StarProbabilityIntervalIncreaseRule.tag)
+# 决定星级的规则标识符, 编译后的执行管线在这些规则之后按星级分组
+STAR_DECISION_RULE_TAGS = (StarPityRule.tag, StarProbabilityRule.tag)
 
 
 class FesRule(BaseRule):
@@ -899,30 +1216,35 @@ class FesRule(BaseRule):
             int(star): probability
             for star, probability in fes_probability.items()
         }
-    
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
-    
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        fes_probability = self.fes_probability
+
+        def apply(ctx: RuleContext):
+            result = ctx.result
+            if result is None or TAG_UP not in result.tags or result.star not in fes_probability:
+                return
+            if ctx.rng.random() * MAX_PROBABILITY < fes_probability[result.star]:
+                result.tags.append(TAG_FES)
+
+        return apply, None
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        return tuple(self.fes_probability), None
+
     def apply(self, ctx: RuleContext):
         if ctx.result is None or TAG_UP not in ctx.result.tags or ctx.result.star not in self.fes_probability:
             return
-        
-        fes_weight = self.fes_probability[ctx.result.star]
-        if random.choices((True, False), (fes_weight, MAX_PROBABILITY - fes_weight))[0]:
+
+        if bernoulli(self.fes_probability[ctx.result.star], ctx.rng.random):
             ctx.result.tags.append(TAG_FES)
 
     def callback(self, ctx: RuleContext):
         pass
 
-    def reset(self, ctx: RuleContext):
-        pass
-
-    def load_state(self, state: Dict):
-        pass
-
-    def reg_state(self, state: Dict):
-        pass
-
 
 class AppointRule(BaseRule):
     """
@@ -940,24 +1262,63 @@ class AppointRule(BaseRule):
             int(star): pity
             for star, pity in appoint_pity.items()
         }
-        self.appoint_counter: Dict[int, int] = {
-            star: 0 
-            for star in self.appoint_pity.keys()
-        }
-        self.is_appoint_pity: Dict[int, bool] = {
-            star: False 
-            for star in self.appoint_pity.keys()
-        }
-    
+        self.counter_slots: Dict[int, int] = {}     # 星级 -> Appoint 计数器槽位
+        self.pity_slots: Dict[int, int] = {}        # 星级 -> 当前抽是否触发 Appoint 的标记槽位
+
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
-    
+
+    def alloc_state(self, ctx: RuleContext, layout: StateLayout):
+        self.counter_slots = layout.alloc_group(self.appoint_pity.keys())
+        self.pity_slots = layout.alloc_flag_group(self.appoint_pity.keys())
+        self.state_groups = {
+            "appoint_counter": (self.counter_slots, False),
+            "is_appoint_pity": (self.pity_slots, True)
+        }
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        counter_slots = self.counter_slots
+        appoint_rules = {
+            star: (pity, counter_slots[star], self.pity_slots[star])
+            for star, pity in self.appoint_pity.items()
+        }
+
+        def apply(ctx: RuleContext):
+            state = ctx.state
+            result = ctx.result
+            if result is None or TAG_UP not in result.tags:
+                return
+            if result.star not in appoint_rules:
+                return
+            pity, counter_slot, flag_slot = appoint_rules[result.star]
+            if state[counter_slot] >= pity:
+                result.tags.append(TAG_APPOINT)
+                state[counter_slot] = 0
+                state[flag_slot] = 1
+                return
+            state[counter_slot] += 1
+
+        def callback(ctx: RuleContext):
+            packed_card = ctx.packed_card_result
+            if packed_card is None or TAG_APPOINT not in packed_card.tags:
+                return
+            star = packed_card.card.star
+            if star in counter_slots:
+                ctx.state[counter_slots[star]] = 0
+
+        return apply, callback
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        # 卡组按逻辑结果的星级抽取卡片, 回调中的卡片星级与逻辑结果相同
+        return tuple(self.appoint_pity), tuple(self.appoint_pity)
+
     def apply(self, ctx: RuleContext):
         """
         在本抽为 UP 的前提下，检查是否达到 Appoint 阈值，若达到，则强制结果为 Appoint 卡片
         """
-        for star in self.appoint_pity.keys():
-            self.is_appoint_pity[star] = False
+        state = ctx.state
+        for slot in self.pity_slots.values():
+            state[slot] = 0
 
         if ctx.result is None or TAG_UP not in ctx.result.tags:
             return
@@ -965,14 +1326,15 @@ class AppointRule(BaseRule):
         star = ctx.result.star
         if star not in self.appoint_pity:
             return
-        
-        if self.appoint_counter[star] >= self.appoint_pity[star]:
+
+        counter_slot = self.counter_slots[star]
+        if state[counter_slot] >= self.appoint_pity[star]:
             ctx.result.tags.append(TAG_APPOINT)
-            self.appoint_counter[star] = 0
-            self.is_appoint_pity[star] = True
+            state[counter_slot] = 0
+            state[self.pity_slots[star]] = 1
             return
 
-        self.appoint_counter[star] += 1
+        state[counter_slot] += 1
 
     def callback(self, ctx: RuleContext):
         """
@@ -985,57 +1347,7 @@ class AppointRule(BaseRule):
         if star not in self.appoint_pity:
             return
 
-        self.appoint_counter[star] = 0
-
-    def reset(self, ctx: RuleContext):
-        """
-        重置 appoint_counter 计数器和 is_appoint_pity 标记
-        """
-        self.appoint_counter = {
-            star: 0 
-            for star in self.appoint_pity.keys()
-        }
-        self.is_appoint_pity = {
-            star: False 
-            for star in self.appoint_pity.keys()
-        }
-    
-    def load_state(self, state: Dict):
-        """
-        加载 appoint_counter 计数器和 is_appoint_pity 保底状态
-        """
-        if self.tag not in state:
-            return
-        
-        appoint_counter_state = state[self.tag].get("appoint_counter", {})
-        for star in self.appoint_pity.keys():
-            self.appoint_counter[star] = appoint_counter_state.get(str(star), self.appoint_counter[star])
-        
-        is_appoint_pity_state = state[self.tag].get("is_appoint_pity", {})
-        for star in self.appoint_pity.keys():
-            self.is_appoint_pity[star] = is_appoint_pity_state.get(str(star), self.is_appoint_pity[star])
-
-    def reg_state(self, state: Dict):
-        """
-        注册 appoint_counter 计数器和 is_appoint_pity 保底状态
-        """
-        appoint_counter_state = {
-            str(star): counter 
-            for star, counter in self.appoint_counter.items()
-        }
-        is_appoint_pity_state = {
-            str(star): is_appoint_pity
-            for star, is_appoint_pity in self.is_appoint_pity.items()
-        }
-
-        if appoint_counter_state or is_appoint_pity_state:
-            state[self.tag] = {}
-
-            if appoint_counter_state:
-                state[self.tag]["appoint_counter"] = appoint_counter_state
-
-            if is_appoint_pity_state:
-                state[self.tag]["is_appoint_pity"] = is_appoint_pity_state
+        ctx.state[self.counter_slots[star]] = 0
 
 
 class CaptureRule(BaseRule):
@@ -1057,13 +1369,28 @@ class CaptureRule(BaseRule):
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
 
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        capture_probability = self.capture_probability
+
+        def apply(ctx: RuleContext):
+            result = ctx.result
+            if result is None or TAG_UP in result.tags or result.star not in capture_probability:
+                return
+            if ctx.rng.random() * MAX_PROBABILITY < capture_probability[result.star]:
+                result.tags.append(TAG_UP)
+
+        return apply, None
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        return tuple(self.capture_probability), None
+
     def apply(self, ctx: RuleContext):
         """
         捕获判定
         """
         if ctx.result is None:
             return
-        
+
         if TAG_UP in ctx.result.tags:
             return
 
@@ -1071,21 +1398,12 @@ class CaptureRule(BaseRule):
         if star not in self.capture_probability:
             return
 
-        if random.choices((True, False), (self.capture_probability[star], MAX_PROBABILITY - self.capture_probability[star]))[0]:
+        if bernoulli(self.capture_probability[star], ctx.rng.random):
             ctx.result.tags.append(TAG_UP)
 
     def callback(self, ctx: RuleContext):
         pass
 
-    def reset(self, ctx: RuleContext):
-        pass
-
-    def load_state(self, state: Dict):
-        pass
-
-    def reg_state(self, state: Dict):
-        pass
-
 
 class CapturePityRule(BaseRule):
     """
@@ -1103,70 +1421,92 @@ class CapturePityRule(BaseRule):
             int(star): pity
             for star, pity in capture_pity.items()
         }
-        self.capture_pity_counter = {
-            star: 0 
-            for star in self.capture_pity.keys()
-        }
-        self.is_capture_pity = {
-            star: False 
-            for star in self.capture_pity.keys()
-        }
+        self.counter_slots: Dict[int, int] = {}     # 星级 -> 捕获保底计数器槽位
+        self.pity_slots: Dict[int, int] = {}        # 星级 -> 当前抽是否触发捕获保底的标记槽位
 
     def set_bridge(self, ctx: RuleContext):
         ctx.rule_bridge[self.tag] = self
 
+    def alloc_state(self, ctx: RuleContext, layout: StateLayout):
+        self.counter_slots = layout.alloc_group(self.capture_pity.keys())
+        self.pity_slots = layout.alloc_flag_group(self.capture_pity.keys())
+        self.state_groups = {
+            "capture_pity_counter": (self.counter_slots, False),
+            "is_capture_pity": (self.pity_slots, True)
+        }
+
+    def compile(self, ctx: RuleContext) -> Tuple[Optional[RulePhase], Optional[RulePhase]]:
+        capture_rules = {
+            star: (pity, self.counter_slots[star], self.pity_slots[star])
+            for star, pity in self.capture_pity.items()
+        }
+        up_rule: UpRule | None = ctx.rule_bridge.get(UpRule.tag)  # type: ignore
+
+        def apply(ctx: RuleContext):
+            state = ctx.state
+            result = ctx.result
+            if result is None or result.star not in capture_rules:
+                return
+            pity, counter_slot, flag_slot = capture_rules[result.star]
+            if state[counter_slot] >= pity:
+                result.tags.append(TAG_UP)
+                state[flag_slot] = 1
+                state[counter_slot] = 0
+
+        if up_rule is None:
+            return apply, None
+
+        # 星级 -> (捕获保底计数器槽位, UP 保底标记槽位), 只包含同时设置了 UP 保底的星级
+        up_pity_slots = {
+            star: (self.counter_slots[star], up_rule.pity_slots[star])
+            for star in self.capture_pity
+            if star in up_rule.up_pity
+        }
+
+        def callback(ctx: RuleContext):
+            result = ctx.result
+            if result is None or result.star not in up_pity_slots:
+                return
+            if TAG_UP not in result.tags:
+                return
+            counter_slot, up_flag_slot = up_pity_slots[result.star]
+            state = ctx.state
+            if state[up_flag_slot]:
+                state[counter_slot] += 1
+            else:
+                state[counter_slot] = 0
+
+        return apply, callback
+
+    def star_scope(self, ctx: RuleContext) -> Tuple[Optional[Tuple[int, ...]], Optional[Tuple[int, ...]]]:
+        return tuple(self.capture_pity), tuple(self.capture_pity)
+
     def apply(self, ctx: RuleContext):
         """
         捕获保底判定
         """
-        for star in self.capture_pity.keys():
-            self.is_capture_pity[star] = False
+        state = ctx.state
+        for slot in self.pity_slots.values():
+            state[slot] = 0
 
         if ctx.result is None:
             return
-        
+
         star = ctx.result.star
 
         if star not in self.capture_pity:
             return
-        
-        if self.capture_pity_counter[star] >= self.capture_pity[star]:
+
+        counter_slot = self.counter_slots[star]
+        if state[counter_slot] >= self.capture_pity[star]:
             ctx.result.tags.append(TAG_UP)
-            self.is_capture_pity[star] = True
-            self.capture_pity_counter[star] = 0
+            state[self.pity_slots[star]] = 1
+            state[counter_slot] = 0
             return
 
-        # if TAG_UP in ctx.result.tags:
-        #     self.capture_pity_counter[star] = 0     # 触发 UP, 重置计数器
-        #     return
-
-        # star = ctx.result.star
-        # if star not in self.capture_pity:
-        #     return
-
-        # if self.capture_pity_counter[star] >= self.capture_pity[star]:
-        #     ctx.result.tags.append(TAG_UP)
-        #     self.is_capture_pity[star] = True
-        #     self.capture_pity_counter[star] = 0
-        #     return
-
-        # # 更新捕获保底计数器
-        # if TAG_UP not in ctx.result.tags:
-        #     self.capture_pity_counter[star] += 1
-        
-        # if UpRule.tag not in ctx.rule_bridge:
-        #     return
-        
-        # up_rule = ctx.rule_bridge[UpRule.tag]
-        # if star not in up_rule.up_pity: # type: ignore
-        #     return
-
-        # if up_rule.is_up_pity[star]: # type: ignore
-        #     self.capture_pity_counter[star] += 1
-
     def callback(self, ctx: RuleContext):
         """
-        更新 capture_pity_counter 捕获保底计数器
+        更新捕获保底计数器
         """
         if ctx.result is None:
             return
@@ -1178,76 +1518,28 @@ class CapturePityRule(BaseRule):
 
         if UpRule.tag not in ctx.rule_bridge:
             return
-        
-        up_rule = ctx.rule_bridge[UpRule.tag]
-        if star not in up_rule.up_pity: # type: ignore
-            return
 
-        if up_rule.is_up_pity[star] and TAG_UP in ctx.result.tags: # type: ignore
-            self.capture_pity_counter[star] += 1
+        up_rule: UpRule = ctx.rule_bridge[UpRule.tag] # type: ignore
+        if star not in up_rule.up_pity:
             return
-        
-        if TAG_UP in ctx.result.tags:
-            self.capture_pity_counter[star] = 0
 
-    def reset(self, ctx: RuleContext):
-        """
-        重置 capture_pity_counter 捕获保底计数器和 is_capture_pity 保底状态
-        """
-        self.capture_pity_counter = {
-            star: 0 
-            for star in self.capture_pity.keys()
-        }
-        self.is_capture_pity = {
-            star: False 
-            for star in self.capture_pity.keys()
-        }
-
-    def load_state(self, state: Dict):
-        """
-        加载 capture_pity_counter 捕获保底计数器和 is_capture_pity 保底状态
-        """
-        if self.tag not in state:
+        state = ctx.state
+        if state[up_rule.pity_slots[star]] and TAG_UP in ctx.result.tags:
+            state[self.counter_slots[star]] += 1
             return
 
-        capture_pity_counter_state = state[self.tag].get("capture_pity_counter", {})
-
-        for star in self.capture_pity.keys():
-            self.capture_pity_counter[star] = capture_pity_counter_state.get(str(star), self.capture_pity_counter[star])
-        
-        is_capture_pity_state = state[self.tag].get("is_capture_pity", {})
-        for star in self.capture_pity.keys():
-            self.is_capture_pity[star] = is_capture_pity_state.get(str(star), self.is_capture_pity[star])
-
-    def reg_state(self, state: Dict):
-        """
-        注册 capture_pity_counter 捕获保底计数器和 is_capture_pity 保底状态
-        """
-        capture_pity_counter_state = {
-            str(star): counter
-            for star, counter in self.capture_pity_counter.items()
-        }
-
-        is_capture_pity_state = {
-            str(star): is_capture
-            for star, is_capture in self.is_capture_pity.items()
-        }
-
-        if capture_pity_counter_state or is_capture_pity_state:
-            state[self.tag] = {}
-
-            if capture_pity_counter_state:
-                state[self.tag]["capture_pity_counter"] = capture_pity_counter_state
-
-            if is_capture_pity_state:
-                state[self.tag]["is_capture_pity"] = is_capture_pity_state
+        if TAG_UP in ctx.result.tags:
+            state[self.counter_slots[star]] = 0
 
 
-class WishLogic:
+class WishLogicPrototype:
     """
-    核心逻辑驱动引擎
+    抽卡逻辑原型
+    持有规则对象 (规则参数、概率表) 和编译后的执行管线，可被任意数量的逻辑会话共享
+    原型本身不保存可变状态，会话的状态按原型的状态布局存放在各自的上下文中
+    默认使用编译后的执行管线，compiled 为 False 时逐规则解释执行
     """
-    def __init__(self, config: Dict) -> None:
+    def __init__(self, config: Dict, compiled: bool = True) -> None:
         """
         config 结构:
         config: {
@@ -1262,6 +1554,7 @@ class WishLogic:
         }
         """
         self.name = config["name"] if "name" in config else ""
+        self.config = config    # 原始配置, 用于在其他进程中重建逻辑
 
         rule_config: Dict[str, Dict] = config["rules"]
         self.rules: List[BaseRule] = [
@@ -1269,21 +1562,176 @@ class WishLogic:
             for rule_class_tag, rule_class_config in rule_config.items()
         ]
 
+        # 原型上下文, 规则在其中注册, 会话共用其规则通讯桥梁
         self.ctx = RuleContext()
         for rule in self.rules:
             rule.set_bridge(self.ctx)
 
-    def wish(self) -> LogicResult:
+        layout = StateLayout()
+        for rule in self.rules:
+            rule.alloc_state(self.ctx, layout)
+        self.initial_state = array(STATE_TYPECODE, layout.initial_state)    # 会话初始状态
+        self.ctx.state = self.initial_state[:]
+        # 保底标记连续存放在状态数组末尾, 编译后的执行管线在每抽开始时一次清除
+        self.flag_start = len(layout.counters)
+        self.cleared_flags = array(STATE_TYPECODE, [0] * layout.flags)
+
+        self.compiled = compiled
+        self.apply_pipeline: List[RulePhase] = []       # 编译后的执行管线
+        self.callback_pipeline: List[RulePhase] = []    # 编译后的回调管线
+        self.decision_pipeline: Tuple[RulePhase, ...] = ()  # 执行管线中决定星级的部分, 每抽都执行
+        self.resolve_pipeline: Tuple[RulePhase, ...] = ()   # 执行管线中星级决定后的部分
+        self.star_apply_pipelines: Dict[int, Tuple[RulePhase, ...]] = {}    # 星级 -> resolve_pipeline 中对该星级操作的阶段
+        self.star_callback_pipelines: Dict[int, Tuple[RulePhase, ...]] = {} # 星级 -> callback_pipeline 中对该星级操作的阶段
+        self.compile()
+
+    def compile(self):
+        """
+        编译规则链
+        按规则顺序收集各规则编译后的阶段函数，并移除不操作的阶段
+        最后一个决定星级的规则之后的阶段按 star_scope 以星级分组, 每抽只执行对当前星级操作的阶段
+        """
+        self.apply_pipeline = []
+        self.callback_pipeline = []
+        apply_scopes: List[Optional[Tuple[int, ...]]] = []
+        callback_scopes: List[Optional[Tuple[int, ...]]] = []
+        decision = 0
+        stars: set[int] = set()
+        for rule in self.rules:
+            apply, callback = rule.compile(self.ctx)
+            apply_stars, callback_stars = rule.star_scope(self.ctx)
+            if apply is not None:
+                self.apply_pipeline.append(apply)
+                apply_scopes.append(apply_stars)
+                if rule.tag in STAR_DECISION_RULE_TAGS:
+                    decision = len(self.apply_pipeline)
+            if callback is not None:
+                self.callback_pipeline.append(callback)
+                callback_scopes.append(callback_stars)
+            stars.update(apply_stars or ())
+            stars.update(callback_stars or ())
+
+        if StarProbabilityRule.tag in self.ctx.rule_bridge:
+            stars.update(self.ctx.rule_bridge[StarProbabilityRule.tag].base_probability)   # type: ignore
+        if StarPityRule.tag in self.ctx.rule_bridge:
+            stars.update(self.ctx.rule_bridge[StarPityRule.tag].star_pity)     # type: ignore
+
+        self.decision_pipeline = tuple(self.apply_pipeline[:decision])
+        self.resolve_pipeline = tuple(self.apply_pipeline[decision:])
+        self.star_apply_pipelines = {
+            star: tuple(
+                apply
+                for apply, scope in zip(self.resolve_pipeline, apply_scopes[decision:])
+                if scope is None or star in scope
+            )
+            for star in stars
+        }
+        self.star_callback_pipelines = {
+            star: tuple(
+                callback
+                for callback, scope in zip(self.callback_pipeline, callback_scopes)
+                if scope is None or star in scope
+            )
+            for star in stars
+        }
+
+    def new_context(self, rng: RandomBackend | None = None) -> RuleContext:
         """
-        抽卡
+        创建处于初始状态的会话上下文
         """
-        self.ctx.result = None
-        self.ctx.packed_card_result = None
+        return RuleContext(self.ctx.rule_bridge, rng, self.initial_state[:])
 
-        for rule in self.rules:
-            rule.apply(self.ctx)        # 逐级执行规则，确定抽卡结果
+    def new_logic(self, rng: RandomBackend | None = None, state: Dict | None = None) -> "WishLogic":
+        """
+        创建逻辑会话
+        state: 初始逻辑状态, 格式与 CardPool.get_logic_state 相同
+        """
+        logic = WishLogic.from_prototype(self, rng)
+        if state:
+            logic.load_state(state)
+
+        return logic
+
+
+class WishLogic:
+    """
+    核心逻辑驱动引擎 (逻辑会话)
+    只持有逻辑原型和自身的上下文，规则、概率表和执行管线均由原型提供
+    rng 为随机数后端，默认使用全局 random 模块
+    """
+    __slots__ = ("prototype", "ctx")
+
+    def __init__(self, config: Dict, compiled: bool = True, rng: RandomBackend | None = None) -> None:
+        """
+        由逻辑配置创建独立的原型和会话, config 结构见 WishLogicPrototype
+        大量会话共用同一逻辑时, 应使用 WishLogicPrototype.new_logic 创建
+        """
+        self.prototype = WishLogicPrototype(config, compiled)
+        self.ctx = self.prototype.new_context(rng)
 
-        result = self.ctx.result if self.ctx.result else LogicResult(star=0, type_="")
+    @staticmethod
+    def from_prototype(prototype: WishLogicPrototype, rng: RandomBackend | None = None) -> "WishLogic":
+        """
+        由逻辑原型创建处于初始状态的会话
+        """
+        logic = WishLogic.__new__(WishLogic)
+        logic.prototype = prototype
+        logic.ctx = prototype.new_context(rng)
+
+        return logic
+
+    @property
+    def name(self) -> str:
+        return self.prototype.name
+
+    @property
+    def config(self) -> Dict:
+        return self.prototype.config
+
+    @property
+    def rules(self) -> List[BaseRule]:
+        return self.prototype.rules
+
+    @property
+    def compiled(self) -> bool:
+        return self.prototype.compiled
+
+    @property
+    def rng(self) -> RandomBackend:
+        return self.ctx.rng
+
+    def set_rng(self, rng: RandomBackend):
+        """
+        更换随机数后端
+        *仅重新设定种子时使用 rng.seed 即可，无需更换后端
+        """
+        self.ctx.rng = rng
+
+    def wish(self, star: int = 0) -> LogicResult:
+        """
+        抽卡
+        star: 预先决定的星级, 为 0 时由规则决定
+        *预先决定星级等价于以该星级为条件抽卡, 保底规则仍会覆盖与保底冲突的星级
+        """
+        ctx = self.ctx
+        ctx.result = LogicResult(star=star, type_="") if star else None
+        ctx.packed_card_result = None
+        ctx.star_table = None
+
+        prototype = self.prototype
+        if prototype.compiled:
+            ctx.state[prototype.flag_start:] = prototype.cleared_flags
+            for apply in prototype.decision_pipeline:
+                apply(ctx)
+            result = ctx.result
+            pipeline = prototype.star_apply_pipelines.get(result.star) if result else None
+            for apply in pipeline if pipeline is not None else prototype.resolve_pipeline:
+                apply(ctx)
+        else:
+            for rule in prototype.rules:
+                rule.apply(ctx)         # 逐级执行规则，确定抽卡结果
+
+        result = ctx.result if ctx.result else LogicResult(star=0, type_="")
 
         return result
 
@@ -1291,39 +1739,70 @@ class WishLogic:
         """
         抽卡结束，回调逻辑
         """
-        self.ctx.packed_card_result = packed_card
+        ctx = self.ctx
+        ctx.packed_card_result = packed_card
 
-        for rule in self.rules:
-            rule.callback(self.ctx)
+        prototype = self.prototype
+        if prototype.compiled:
+            result = ctx.result
+            pipeline = prototype.star_callback_pipelines.get(result.star) if result else None
+            for callback in pipeline if pipeline is not None else prototype.callback_pipeline:
+                callback(ctx)
+        else:
+            for rule in prototype.rules:
+                rule.callback(ctx)
 
     def reset(self):
         """
         逻辑状态重置
         """
-        self.ctx.result = None
-
-        for rule in self.rules:
-            rule.reset(self.ctx)
+        ctx = self.ctx
+        ctx.result = None
+        ctx.packed_card_result = None
+        ctx.star_table = None
+        ctx.state[:] = self.prototype.initial_state
 
     def load_state(self, state: Dict):
         """
         加载逻辑状态
         """
-        for rule in self.rules:
-            rule.load_state(state)
+        for rule in self.prototype.rules:
+            rule.load_state(self.ctx, state)
 
     def reg_state(self, state: Dict):
         """
         注册逻辑状态
         """
-        for rule in self.rules:
-            rule.reg_state(state)
+        for rule in self.prototype.rules:
+            rule.reg_state(self.ctx, state)
+
+    def snapshot(self) -> array:
+        """
+        获取逻辑状态快照
+        快照是状态数组的副本, 只能恢复到同一原型的会话中
+        *需要持久化时使用 reg_state, 快照的槽位布局随规则配置变化
+        """
+        return self.ctx.state[:]
+
+    def restore(self, snapshot: array):
+        """
+        从快照恢复逻辑状态
+        """
+        state = self.ctx.state
+        if len(snapshot) != len(state) or snapshot.typecode != state.typecode:
+            raise ValueError(f"Snapshot does not match the state layout of logic: {self.name}")
+        state[:] = snapshot
 
     def copy(self) -> "WishLogic":
         """
-        创建深拷贝副本
+        创建副本
+        副本与原逻辑共用原型，只复制状态数组和随机数后端 (全局 random 模块后端不复制)
         """
-        logic = deepcopy(self)
+        rng = self.ctx.rng
+        if not isinstance(rng, GlobalRandomBackend):
+            rng = deepcopy(rng)
+        logic = WishLogic.from_prototype(self.prototype, rng)
+        logic.restore(self.ctx.state)
 
         return logic
 
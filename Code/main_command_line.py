@@ -1,4 +1,5 @@
 from ManageSystem import *
+from SimulationRunner import *
 from Const import *
 from typing import Dict, Callable, Tuple
 import os
@@ -44,12 +45,16 @@ class Program:
             with open(CARDS_DIR_CONFIG_FILE, "r", encoding="utf-8") as f:
                 cards_dir_config = json.load(f)
 
-            # 初始化管理系统
-            self.card_system = CardSystem(CARDS_DIR, cards_dir_config)
-            self.standard_group_system = StandardGroupSystem(RESIDENT_GROUP_DIR, self.card_system)
-            self.card_group_system = CardGroupSystem(CARD_GROUP_DIR, self.card_system, self.standard_group_system)
-            self.wish_logic_system = WishLogicSystem(LOGIC_CONFIG_DIR)
-            self.card_pool_system = CardPoolSystem(CARD_POOL_DIR, self.card_group_system, self.wish_logic_system)
+            # 初始化管理系统 (并发读取配置文件)
+            (
+                self.card_system,
+                self.standard_group_system,
+                self.card_group_system,
+                self.wish_logic_system,
+                self.card_pool_system
+            ) = load_systems(
+                CARDS_DIR, cards_dir_config, RESIDENT_GROUP_DIR, CARD_GROUP_DIR, LOGIC_CONFIG_DIR, CARD_POOL_DIR
+            )
         except:
             print(Fore.RED + "Initialization Error: " + traceback.format_exc())
             print("Error initializing the program. Please check the configuration files.  初始化程序错误，请检查配置文件。")
@@ -67,6 +72,9 @@ class Program:
             "wish": (self.wish, (), "Wish once", "抽一次"),
             "wishten": (self.wishten, (), "Wish ten times", "抽十次"),
             "wishcount": (self.wishcount, ("count",), "Wish the specified number of times", "抽指定次数"),
+            "simulate": (self.simulate, ("players", "draws", "seed"), "Simulate players on the current card pool", "在当前卡池上模拟多个玩家抽卡"),
+            "history": (self.history, ("count",), "Show the latest records of the current card pool", "显示当前卡池的最近记录"),
+            "stats": (self.stats, (), "Show the record statistics of the current card pool", "显示当前卡池的记录统计"),
             "save": (self.save, (), "Save the current card pool", "保存当前卡池"),
             "reset": (self.reset, (), "Reset the current card pool", "重置当前卡池"),
         }
@@ -226,13 +234,71 @@ class Program:
                     continue
                 return
 
-        result = self.current_card_pool.wish_count(count)
-        print("Wishing is completed, waiting for output...  抽卡已完成，等待输出...")
-        for packed_card in result.cards:
-            self.counter += 1
-            print(Fore.BLUE + f"{self.counter}. {packed_card}" + Style.RESET_ALL)
+        # 分批抽卡并输出, 无需等待全部抽完
+        batches = self.current_card_pool.iter_wish_batches(WISH_BATCH_SIZE, count, fast_forward=count >= FAST_FORWARD_MIN_COUNT)
+        for batch in batches:
+            self.is_saved = False
+            print("\n".join(
+                Fore.BLUE + f"{self.counter + n}. {packed_card}" + Style.RESET_ALL
+                for n, packed_card in enumerate(batch, 1)
+            ))
+            self.counter += batch.count
+        print("Wishing is completed  抽卡已完成")
+
+    def simulate(self, players_s: str, draws_s: str, seed_s: str):
+        if not self.current_card_pool:
+            self.report_error("No card pool is currently selected  当前没有选择卡池")
+            return
 
-        self.is_saved = False
+        players, draws, seed = int(players_s), int(draws_s), int(seed_s)
+        if players <= 0 or draws <= 0:
+            self.report_error(f"Invalid players or draws 无效玩家数或抽数: <{players} {draws}>")
+            return
+
+        print("Simulating...  模拟中...")
+        task = SimulationTask.from_card_pool(self.current_card_pool, players, draws)
+        stats = SimulationRunner().run(task, seed)[task.name]
+
+        print("-" * 20 + f"\nSimulation result 模拟结果: {players} x {draws}\n")
+        for star in sorted(stats.star_counts.keys(), reverse=True):
+            print(
+                f"Star {star}: rate {stats.rate(star):.4%} | mean interval {stats.mean_interval(star):.2f}"
+                f" | up {stats.tag_rate(star, TAG_UP) + stats.tag_rate(star, TAG_FES) + stats.tag_rate(star, TAG_APPOINT):.2%}"
+            )
+        print("-" * 20)
+
+    def history(self, count_s: str):
+        if not self.current_card_pool:
+            self.report_error("No card pool is currently selected  当前没有选择卡池")
+            return
+
+        count = int(count_s)
+        if count <= 0:
+            self.report_error(f"Invalid count 无效次数: <{count}>")
+            return
+
+        records = self.current_card_pool.recorder.query().last(count)
+        print("-" * 20 + f"\nLatest records 最近记录: <{self.current_card_pool.name}>\n")
+        for record in records:
+            print(Fore.BLUE + str(record) + Style.RESET_ALL)
+        print("-" * 20)
+
+    def stats(self):
+        if not self.current_card_pool:
+            self.report_error("No card pool is currently selected  当前没有选择卡池")
+            return
+
+        recorder = self.current_card_pool.recorder
+        stats = recorder.stats
+        print("-" * 20 + f"\nRecord statistics 记录统计: <{self.current_card_pool.name}> total {recorder.total_counter}\n")
+        for star in sorted(stats.pity.keys(), reverse=True):
+            won, lost, guaranteed = stats.fifty_fifty_counts(star)
+            print(
+                f"Star {star}: mean interval {stats.mean_pity(star):.2f}"
+                f" | 50/50 won {won} lost {lost} guaranteed {guaranteed} ({stats.win_rate(star):.2%})"
+                f" | longest up {stats.longest_streak(star, True)} / standard {stats.longest_streak(star, False)}"
+            )
+        print("-" * 20)
 
     def save(self):
         if not self.current_card_pool: